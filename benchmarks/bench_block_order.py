@@ -0,0 +1,48 @@
+# Pablo Carreira - 18/10/26
+"""Blocks read per second for each iteration order, on striped and tiled images.
+
+Usage: python benchmarks/bench_block_order.py [rows] [cols]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import gdal
+
+from geodata.block_grid import BLOCK_ORDERS
+from geodata.rasterdata import RasterData
+
+
+def create_image(img_file: str, rows: int, cols: int, options: list) -> str:
+    dataset = gdal.GetDriverByName("GTiff").Create(img_file, cols, rows, 1, gdal.GDT_Byte, options=options)
+    dataset.SetGeoTransform((0, 1, 0, rows, 0, -1))
+    dataset.GetRasterBand(1).WriteArray(np.random.randint(0, 255, (rows, cols), dtype=np.uint8))
+    del dataset
+    return img_file
+
+
+def blocks_per_second(img_file: str, order: str) -> float:
+    # A new dataset for each run, so the gdal block cache starts empty.
+    raster = RasterData(img_file)
+    n_blocks = 0
+    start = time.perf_counter()
+    for _ in raster.get_iterator(order=order):
+        n_blocks += 1
+    return n_blocks / (time.perf_counter() - start)
+
+
+def main(rows: int = 10000, cols: int = 10000):
+    gdal.SetCacheMax(16 * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        layouts = {"striped": ["COMPRESS=DEFLATE"],
+                   "tiled": ["COMPRESS=DEFLATE", "TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"]}
+        for name, options in layouts.items():
+            img_file = create_image(os.path.join(temp_dir, name + ".tif"), rows, cols, options)
+            for order in BLOCK_ORDERS:
+                print("{:<8} {:<8} {:>10.1f} blocks/s".format(name, order, blocks_per_second(img_file, order)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
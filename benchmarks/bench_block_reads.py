@@ -0,0 +1,53 @@
+# Pablo Carreira - 18/10/26
+"""Allocations per block: get_iterator against get_buffered_iterator.
+
+Usage: python benchmarks/bench_block_reads.py [rows] [cols]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from osgeo import gdal
+
+from geodata import RasterData
+
+
+def create_image(img_file: str, rows: int, cols: int) -> RasterData:
+    raster = RasterData.create(img_file, rows, cols, 1, 0, rows, bands=1, data_type=gdal.GDT_Byte)
+    raster.write_all(np.random.randint(0, 255, (rows, cols), dtype=np.uint8))
+    return RasterData(img_file)
+
+
+def measure(iterator) -> dict:
+    """Consumes the iterator, returns the time and the bytes allocated by each step."""
+    allocated = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    while True:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    return {"blocks": len(allocated), "seconds": elapsed, "bytes_per_block": np.mean(allocated)}
+
+
+def main(rows: int = 8000, cols: int = 8000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        raster = create_image(os.path.join(temp_dir, "bench.tif"), rows, cols)
+        for name, iterator in (("get_iterator", raster.get_iterator()),
+                               ("get_buffered_iterator", raster.get_buffered_iterator())):
+            result = measure(iterator)
+            print("{:<24} {blocks} blocks  {seconds:.3f} s  {bytes_per_block:,.0f} bytes allocated per block".format(
+                name, **result))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+# Pablo Carreira - 18/10/26
+"""Feature insertion into a GeoPackage: add_feature_to_layer against bulk_writer.
+
+Usage: python benchmarks/bench_bulk_writer.py [n_features] [batch_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import ogr
+
+from geodata import VectorData
+
+
+def square(x: float, y: float, size: float = 10) -> ogr.Geometry:
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for px, py in ((x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)):
+        ring.AddPoint_2D(px, py)
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def per_feature(vector: VectorData, geometries):
+    for i, geometry in enumerate(geometries):
+        vector.add_feature_to_layer(geometry, {"ID": i})
+
+
+def bulk(vector: VectorData, geometries, batch_size: int):
+    with vector.bulk_writer(batch_size) as writer:
+        writer.write_many((geometry, {"ID": i}) for i, geometry in enumerate(geometries))
+    return writer
+
+
+def main(n_features: int = 100000, batch_size: int = 10000):
+    corners = np.random.uniform(0, 100000, (n_features, 2)).tolist()
+    geometries = [square(x, y) for x, y in corners]
+    wkbs = [bytes(geometry.ExportToWkb()) for geometry in geometries]
+    # The per feature path commits every feature, a sample is enough.
+    n_slow = min(n_features, 5000)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, run, n in (("add_feature_to_layer", lambda v: per_feature(v, geometries[:n_slow]), n_slow),
+                             ("bulk_writer geometry", lambda v: bulk(v, geometries, batch_size), n_features),
+                             ("bulk_writer wkb", lambda v: bulk(v, wkbs, batch_size), n_features)):
+            file_name = os.path.join(temp_dir, name.replace(" ", "_") + ".gpkg")
+            vector = VectorData.create(file_name, "GPKG", 32722, geom_type=ogr.wkbPolygon)
+            start = time.perf_counter()
+            run(vector)
+            elapsed = time.perf_counter() - start
+            print("{:<22} {} features  {:.3f} s  {:,.0f} features/s".format(name, n, elapsed, n / elapsed))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
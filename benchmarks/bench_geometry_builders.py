@@ -0,0 +1,38 @@
+# Pablo Carreira - 18/10/26
+"""Building many linestrings: the JSON round trip of each line against the WKB batch builder.
+
+Usage: python benchmarks/bench_geometry_builders.py [n_lines] [vertices_per_line]
+"""
+import json
+import sys
+import time
+
+import numpy as np
+from osgeo import ogr
+
+from geodata.vector_utils import lines_to_wkb, split_wkb
+
+
+def json_path(lines):
+    return [ogr.CreateGeometryFromJson(json.dumps({"type": "LineString", "coordinates": line})) for line in lines]
+
+
+def wkb_path(coords, offsets):
+    return [ogr.CreateGeometryFromWkb(wkb) for wkb in split_wkb(*lines_to_wkb(coords, offsets))]
+
+
+def main(n_lines: int = 100000, vertices_per_line: int = 50):
+    coords = np.cumsum(np.random.normal(0, 1, (n_lines * vertices_per_line, 2)), axis=0)
+    offsets = np.arange(n_lines + 1) * vertices_per_line
+    lines = [coords[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+    for name, func in (("json round trip", lambda: json_path(lines)),
+                       ("wkb builder + ogr", lambda: wkb_path(coords, offsets)),
+                       ("wkb builder only", lambda: lines_to_wkb(coords, offsets))):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print("{:<18} {} lines  {:.3f} s  {:,.0f} lines/s".format(name, n_lines, elapsed, n_lines / elapsed))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,55 @@
+# Pablo Carreira - 18/10/26
+"""Point sampling: one read_block_by_utm_coordinates per point against sample_points.
+
+Usage: python benchmarks/bench_sample_points.py [n_points] [rows] [cols]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import gdal
+
+from geodata import RasterData
+
+
+def create_image(img_file: str, rows: int, cols: int) -> RasterData:
+    raster = RasterData.create(img_file, rows, cols, 10, 300000, 7000000, bands=1, data_type=gdal.GDT_Byte)
+    raster.write_all(np.random.randint(0, 255, (rows, cols), dtype=np.uint8))
+    return RasterData(img_file)
+
+
+def sample_loop(raster: RasterData, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """The per point loop, one gdal read for each point."""
+    res = raster.geotransform.x_resolution
+    ox, oy = raster.origem
+    values = np.empty((len(xs), 1), dtype=np.uint8)
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        # Bounds of the pixel under the point.
+        xu0 = ox + (x - ox) // res * res
+        yu1 = oy - (oy - y) // res * res
+        values[i] = raster.read_block_by_utm_coordinates(xu0, xu0 + res, yu1 - res, yu1)[0, 0]
+    return values
+
+
+def main(n_points: int = 100000, rows: int = 8000, cols: int = 8000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        raster = create_image(os.path.join(temp_dir, "bench.tif"), rows, cols)
+        xs, ys = raster.geotransform.forward(np.random.uniform(0, cols, n_points), np.random.uniform(0, rows, n_points))
+
+        start = time.perf_counter()
+        loop_values = sample_loop(raster, xs, ys)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        values = raster.sample_points(xs, ys)
+        batch_time = time.perf_counter() - start
+
+        assert np.array_equal(values, loop_values)
+        print("{} points  loop {:.3f} s  sample_points {:.3f} s  ({:.0f}x)".format(
+            n_points, loop_time, batch_time, loop_time / batch_time))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,82 @@
+# Pablo Carreira - 18/10/26
+"""Clip by tile: features of each tile with SetSpatialFilter, with the STR tree index and by scanning the layer.
+
+Usage: python benchmarks/bench_spatial_index.py [n_features] [n_tiles]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import ogr
+
+from geodata import VectorData
+from geodata.geo_objects import BBoxArray
+from geodata.srs_utils import epsg_para_wkt
+
+EXTENT = 100000.0
+
+
+def create_layer(file_name: str, n_features: int) -> VectorData:
+    vector = VectorData.create(file_name, "GPKG", 32722, geom_type=ogr.wkbPoint)
+    layer = vector.get_layer()
+    layer.StartTransaction()
+    for x, y in np.random.uniform(0, EXTENT, (n_features, 2)).tolist():
+        feature = ogr.Feature(layer.GetLayerDefn())
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        feature.SetGeometry(point)
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    return VectorData(file_name)
+
+
+def timed(name: str, n_tiles: int, func):
+    start = time.perf_counter()
+    n_found = func()
+    elapsed = time.perf_counter() - start
+    print("{:<20} {} tiles  {:.3f} s  {:.2f} ms per tile  {} features".format(
+        name, n_tiles, elapsed, elapsed / n_tiles * 1000, n_found))
+
+
+def main(n_features: int = 1000000, n_tiles: int = 100):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vector = create_layer(os.path.join(temp_dir, "bench.gpkg"), n_features)
+        layer = vector.get_layer()
+        corners = np.random.uniform(0, EXTENT - 1000, (n_tiles, 2))
+        tiles = BBoxArray(np.column_stack((corners, corners + 1000)), epsg_para_wkt(32722))
+
+        def spatial_filter():
+            found = 0
+            for bbox in tiles:
+                layer.SetSpatialFilterRect(*bbox.as_tuple())
+                found += sum(1 for _ in layer)
+            layer.SetSpatialFilter(None)
+            return found
+
+        def index_lookup():
+            found = 0
+            for fids in vector.query_many(tiles):
+                found += sum(1 for fid in fids.tolist() if layer.GetFeature(fid) is not None)
+            return found
+
+        def full_scan(n_scans=3):
+            found = 0
+            for bbox in tiles[:n_scans]:
+                for feature in layer:
+                    x, y = feature.GetGeometryRef().GetPoint_2D()
+                    found += bbox.xmin <= x <= bbox.xmax and bbox.ymin <= y <= bbox.ymax
+            return found
+
+        start = time.perf_counter()
+        vector.build_spatial_index(persist=True)
+        print("index built in {:.3f} s".format(time.perf_counter() - start))
+        timed("SetSpatialFilter", n_tiles, spatial_filter)
+        timed("index + GetFeature", n_tiles, index_lookup)
+        timed("index query only", n_tiles, lambda: sum(map(len, vector.query_many(tiles))))
+        timed("full scan", min(3, n_tiles), full_scan)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,49 @@
+# Pablo Carreira - 18/10/26
+"""The tile loop pattern: transform the bbox of each tile and compare its srs with the image.
+
+Compares building the SpatialReference objects from WKT on every tile with the cached srs_utils.
+
+Usage: python benchmarks/bench_srs.py [n_tiles]
+"""
+import sys
+import time
+
+import numpy as np
+from osgeo import osr
+
+from geodata.geo_objects import BBox
+from geodata.srs_utils import epsg_para_wkt, is_same_srs, GDAL_MAJOR_VERSION
+
+
+def uncached_tile(bbox: BBox, image_wkt: str, dst_epsg: int):
+    """What each tile used to cost: every srs parsed again from WKT."""
+    src_srs, image_srs, dst_srs = osr.SpatialReference(), osr.SpatialReference(), osr.SpatialReference()
+    src_srs.ImportFromWkt(bbox.wkt_srs)
+    image_srs.ImportFromWkt(image_wkt)
+    dst_srs.ImportFromEPSG(dst_epsg)
+    if GDAL_MAJOR_VERSION >= 3:
+        src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    assert src_srs.IsSame(image_srs)
+    points = np.asarray(osr.CoordinateTransformation(src_srs, dst_srs).TransformPoints(bbox._geometry))
+    return BBox(points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max(), dst_srs.ExportToWkt())
+
+
+def cached_tile(bbox: BBox, image_wkt: str, dst_epsg: int):
+    assert is_same_srs(bbox.wkt_srs, image_wkt)
+    return bbox.transform_srs(dst_epsg)
+
+
+def main(n_tiles: int = 10000):
+    wkt = epsg_para_wkt(32722)
+    tiles = [BBox(500000 + i * 100, 7000000, 500100 + i * 100, 7000100, wkt) for i in range(n_tiles)]
+    for name, tile_func in (("uncached", uncached_tile), ("cached", cached_tile)):
+        start = time.perf_counter()
+        for bbox in tiles:
+            tile_func(bbox, wkt, 4326)
+        elapsed = time.perf_counter() - start
+        print("{:<10} {} tiles  {:.3f} s  {:.1f} us per tile".format(name, n_tiles, elapsed, elapsed / n_tiles * 1e6))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,92 @@
+# Pablo Carreira - 18/10/26
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable
+
+import numpy as np
+
+
+class BlockCache:
+    def __init__(self, max_bytes: int):
+        """A least recently used cache of decoded blocks, bounded by the total size in bytes.
+
+        Thread safe. The cached arrays are read only, the readers copy from them. The blocks are loaded
+        one at a time, the loaders of a cache share the dataset handle of its RasterData.
+
+        :param max_bytes: Maximum size of the cached blocks. Blocks bigger than this are not cached.
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive.")
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #: Incremented by invalidate and clear, a block loaded before that is not cached.
+        self.generation = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def get(self, key: Hashable, loader: Callable[[], np.ndarray]) -> np.ndarray:
+        """Returns the cached block or loads it with loader, caching the result."""
+        data = self._lookup(key)
+        if data is not None:
+            return data
+        with self._load_lock:
+            # Another thread may have loaded the block while this one waited.
+            data = self._lookup(key)
+            if data is not None:
+                return data
+            with self._lock:
+                self.misses += 1
+                generation = self.generation
+            data = loader()
+            data.setflags(write=False)
+            with self._lock:
+                if generation == self.generation:
+                    self._put(key, data)
+        return data
+
+    def _lookup(self, key: Hashable) -> np.ndarray:
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def _put(self, key: Hashable, data: np.ndarray):
+        if data.nbytes > self.max_bytes:
+            return
+        old = self._blocks.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old.nbytes
+        self._blocks[key] = data
+        self.current_bytes += data.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._blocks.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        """Removes blocks from the cache, e.g. after they are written."""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                data = self._blocks.pop(key, None)
+                if data is not None:
+                    self.current_bytes -= data.nbytes
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._blocks.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "blocks": len(self._blocks), "bytes": self.current_bytes, "max_bytes": self.max_bytes}
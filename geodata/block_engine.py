@@ -0,0 +1,251 @@
+# Pablo Carreira - 18/10/26
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Iterable, Iterator, Tuple, Any, Union, List
+
+import numpy as np
+from osgeo import gdal
+
+BACKEND_THREAD = "thread"
+BACKEND_PROCESS = "process"
+
+_local = threading.local()
+#: Handles of the worker processes, they live until the process pool is shut down.
+_process_handles = {}
+
+
+class WorkerHandles:
+    def __init__(self):
+        """The gdal datasets (and OGR datasources) opened by the workers of one run, see worker_handle.
+
+        Each thread has its own handles, kept from one task to the next and closed by close() at the
+        end of the run, so the files are not held open and a later run sees the changes made to them.
+        In the process backend the handles belong to the worker process and end with it.
+        """
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # Sent to a worker process: there the handles belong to the process.
+        return _process_worker_handles, ()
+
+    def bind(self, task: Callable) -> Callable:
+        """The task running with these handles."""
+        return partial(_call_with_handles, self, task)
+
+    def thread_cache(self) -> dict:
+        """The handles of the current thread."""
+        if self._caches is None:
+            return _process_handles
+        with self._lock:
+            return self._caches.setdefault(threading.get_ident(), {})
+
+    def close(self):
+        """Drops the handles, gdal closes the files."""
+        if self._caches is None:
+            return
+        with self._lock:
+            for cache in self._caches.values():
+                cache.clear()
+            self._caches.clear()
+
+
+def _process_worker_handles() -> WorkerHandles:
+    handles = WorkerHandles.__new__(WorkerHandles)
+    handles._caches = None
+    handles._lock = None
+    return handles
+
+
+def _call_with_handles(handles: WorkerHandles, task: Callable, item):
+    previous = getattr(_local, "handles", None)
+    _local.handles = handles.thread_cache()
+    try:
+        return task(item)
+    finally:
+        _local.handles = previous
+
+
+def worker_handle(key: Tuple, opener: Callable[[], Any]):
+    """Returns a handle private to the current thread (or process) for the current run.
+
+    Inside a task of run_tasks (or of a WorkerHandles.bind) the handle is opened the first time and
+    kept for the next tasks of the run. Outside of a run a new handle is opened on every call.
+
+    :param key: Identifies the handle, e.g. ("gdal", path).
+    :param opener: Opens the handle.
+    """
+    cache = getattr(_local, "handles", None)
+    if cache is None:
+        return opener()
+    handle = cache.get(key)
+    if handle is None:
+        handle = cache[key] = opener()
+    return handle
+
+
+def worker_dataset(src_image: str) -> gdal.Dataset:
+    """Returns a read only gdal dataset private to the current thread (or process).
+
+    Gdal datasets can't be shared between threads, so every worker opens its own handle
+    the first time it touches a file and keeps it for the next blocks of the run (see worker_handle).
+
+    :param src_image: Path to the raster file.
+    """
+    return worker_handle(("gdal", src_image), partial(_open_dataset, src_image))
+
+
+def _open_dataset(src_image: str) -> gdal.Dataset:
+    dataset = gdal.Open(src_image, gdal.GA_ReadOnly)
+    if not dataset:
+        raise IOError("Can't open file: {}".format(src_image))
+    return dataset
+
+
+class DatasetSource:
+    __slots__ = ("src_image", "_dataset", "_lock")
+
+    def __init__(self, src_image: str = None, dataset: gdal.Dataset = None):
+        """A way for workers to reach the data of a RasterData.
+
+        File based rasters are reopened by each worker of a run (see worker_dataset). Rasters without a file
+        (e.g. MEM datasets) share the single dataset behind a lock and can't be sent to other processes.
+
+        :param src_image: Path to the raster file.
+        :param dataset: The gdal dataset, used only when there is no file.
+        """
+        if src_image is None and dataset is None:
+            raise ValueError("Must provide src_image or dataset.")
+        self.src_image = src_image
+        self._dataset = dataset if src_image is None else None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        if self.src_image is None:
+            raise ValueError("Rasters without a file can't be used by the process backend.")
+        return self.src_image
+
+    def __setstate__(self, state):
+        self.src_image = state
+        self._dataset = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def dataset(self) -> Iterator[gdal.Dataset]:
+        """Context with a gdal dataset that can be used by the current worker."""
+        if self.src_image is not None:
+            yield worker_dataset(self.src_image)
+        else:
+            with self._lock:
+                yield self._dataset
+
+
+def create_executor(workers: int, backend: str):
+    """Creates the pool executor for a backend."""
+    if backend == BACKEND_THREAD:
+        return ThreadPoolExecutor(max_workers=workers)
+    elif backend == BACKEND_PROCESS:
+        return ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError("Invalid backend: {}.".format(backend))
+
+
+def run_tasks(task: Callable, items: Iterable, workers: int = 1, backend: str = BACKEND_THREAD,
+              ordered: bool = True, max_in_flight: int = None) -> Iterator[Tuple[Any, Any]]:
+    """Runs task(item) for every item and yields (item, result).
+
+    Only max_in_flight items are submitted at a time, so the memory used by blocks waiting to be
+    consumed is bounded regardless of the number of items. The handles opened by the workers
+    (see worker_handle) are closed when the run ends.
+
+    :param task: A callable receiving one item. Must be picklable for the process backend.
+    :param items: The items (e.g. block indices).
+    :param workers: Number of workers, 1 runs everything in the calling thread.
+    :param backend: BACKEND_THREAD or BACKEND_PROCESS.
+    :param ordered: Yield results in the same order of items, otherwise as they complete.
+    :param max_in_flight: Maximum number of submitted and not consumed items, defaults to 2 * workers.
+    """
+    if workers < 1:
+        raise ValueError("workers must be >= 1.")
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    elif max_in_flight < 1:
+        raise ValueError("max_in_flight must be >= 1.")
+
+    handles = WorkerHandles()
+    task = handles.bind(task)
+    try:
+        if workers == 1:
+            for item in items:
+                yield item, task(item)
+            return
+        executor = create_executor(workers, backend)
+        try:
+            yield from submit_bounded(executor, task, items, ordered, max_in_flight)
+        finally:
+            executor.shutdown(wait=True)
+    finally:
+        handles.close()
+
+
+def submit_bounded(executor, task: Callable, items: Iterable, ordered: bool = True,
+                   max_in_flight: int = 2) -> Iterator[Tuple[Any, Any]]:
+    """Submits task(item) to an executor keeping at most max_in_flight items pending, yields (item, result).
+
+    :param executor: A concurrent.futures executor.
+    :param task: A callable receiving one item.
+    :param items: The items.
+    :param ordered: Yield results in the same order of items, otherwise as they complete.
+    :param max_in_flight: Maximum number of submitted and not consumed items.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield from _collect(pending, ordered)
+            pending.append((executor.submit(task, item), item))
+        while pending:
+            yield from _collect(pending, ordered)
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def _collect(pending: deque, ordered: bool) -> Iterator[Tuple[Any, Any]]:
+    """Waits for at least one pending future and yields the finished ones."""
+    if ordered:
+        future, item = pending.popleft()
+        yield item, future.result()
+        return
+    done, _ = wait([future for future, _ in pending], return_when=FIRST_COMPLETED)
+    for entry in [entry for entry in pending if entry[0] in done]:
+        pending.remove(entry)
+        yield entry[1], entry[0].result()
+
+
+def read_and_apply(source: DatasetSource, func: Callable, banda: int, item: Tuple[int, Tuple]):
+    """Reads a block of one band and applies func to it. Used by RasterData.map_blocks.
+
+    :param source: Where the block is read from.
+    :param func: The function applied to the block data.
+    :param banda: Band to read.
+    :param item: Pair (block index, block) from the block list.
+    """
+    return func(read_block(source, banda, item))
+
+
+def read_block(source: DatasetSource, bands: Union[int, List[int]], item: Tuple[int, Tuple]) -> np.ndarray:
+    """Reads a block of one band (rows, cols) or of a list of bands (bands, rows, cols) with a single call.
+
+    :param source: Where the block is read from.
+    :param bands: A band or a list of bands.
+    :param item: Pair (block index, block) from the block list.
+    """
+    block = item[1]
+    with source.dataset() as dataset:
+        if isinstance(bands, int):
+            return dataset.GetRasterBand(bands).ReadAsArray(*block)
+        return dataset.ReadAsArray(*block, band_list=bands)
@@ -0,0 +1,139 @@
+# Pablo Carreira - 18/10/26
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+BLOCK_ORDER_COLUMN = "column"
+BLOCK_ORDER_ROW = "row"
+BLOCK_ORDER_ZORDER = "zorder"
+BLOCK_ORDER_HILBERT = "hilbert"
+BLOCK_ORDERS = (BLOCK_ORDER_COLUMN, BLOCK_ORDER_ROW, BLOCK_ORDER_ZORDER, BLOCK_ORDER_HILBERT)
+
+BLOCK_DTYPE = np.dtype([("xoff", np.int64), ("yoff", np.int64), ("width", np.int64), ("height", np.int64),
+                        ("row", np.int64), ("col", np.int64)])
+
+
+class BlockGrid:
+    def __init__(self, rows: int, cols: int, block_size: Sequence[int]):
+        """The grid of blocks of a raster, computed at once with numpy.
+
+        The blocks are kept in a structured array (xoff, yoff, width, height, row, col) in the
+        same order of RasterData.block_list: column by column, all the rows of a column first.
+        Other iteration orders are given by order(), as permutations of the block indices.
+
+        :param rows: Image height.
+        :param cols: Image width.
+        :param block_size: Block size as given by gdal (width, height).
+        """
+        self.rows = rows
+        self.cols = cols
+        self.block_width, self.block_height = int(block_size[0]), int(block_size[1])
+        # Caso haja um pedaço sobrando do final, inclui mais um bloco.
+        self.n_block_rows = -(-rows // self.block_height)
+        self.n_block_cols = -(-cols // self.block_width)
+
+        yoff, height = self._axis_blocks(rows, self.block_height)
+        xoff, width = self._axis_blocks(cols, self.block_width)
+        grid_shape = (self.n_block_cols, self.n_block_rows)
+        block_rows = np.broadcast_to(np.arange(self.n_block_rows), grid_shape)
+        block_cols = np.broadcast_to(np.arange(self.n_block_cols)[:, np.newaxis], grid_shape)
+
+        self.blocks = np.empty(self.n_block_rows * self.n_block_cols, dtype=BLOCK_DTYPE)
+        self.blocks["xoff"] = xoff[block_cols].ravel()
+        self.blocks["yoff"] = yoff[block_rows].ravel()
+        self.blocks["width"] = width[block_cols].ravel()
+        self.blocks["height"] = height[block_rows].ravel()
+        self.blocks["row"] = block_rows.ravel()
+        self.blocks["col"] = block_cols.ravel()
+        self._orders = {}
+
+    @staticmethod
+    def _axis_blocks(size: int, block_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Offsets and sizes of the blocks along one axis, the last block may be smaller."""
+        offsets = np.arange(0, size, block_size, dtype=np.int64)
+        return offsets, np.minimum(block_size, size - offsets)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """Number of blocks (rows, cols)."""
+        return self.n_block_rows, self.n_block_cols
+
+    def as_list(self) -> List[Tuple[int, int, int, int]]:
+        """The blocks as a list of (xoff, yoff, width, height) tuples, the format of RasterData.block_list."""
+        return self.blocks[["xoff", "yoff", "width", "height"]].tolist()
+
+    def positions_coordinates(self) -> np.ndarray:
+        """Array (block rows, block cols, 4) with the position of each block in pixels: y0, y1, x0, x1."""
+        coords = np.empty((self.n_block_rows, self.n_block_cols, 4), dtype=np.int64)
+        y0, height = self._axis_blocks(self.rows, self.block_height)
+        x0, width = self._axis_blocks(self.cols, self.block_width)
+        coords[..., 0] = y0[:, np.newaxis]
+        coords[..., 1] = (y0 + height)[:, np.newaxis]
+        coords[..., 2] = x0
+        coords[..., 3] = x0 + width
+        return coords
+
+    def array_indices(self) -> np.ndarray:
+        """Array (n blocks, 2) with the (row, col) index of every block, rows first."""
+        return np.indices(self.shape, dtype=np.int64).reshape(2, -1).T
+
+    def index_of(self, row, col):
+        """Index in the blocks array (and in block_list) of the blocks at row, col. Accepts arrays."""
+        return np.asarray(col) * self.n_block_rows + np.asarray(row)
+
+    def order(self, order: str = BLOCK_ORDER_COLUMN) -> np.ndarray:
+        """The block indices in the iteration order, the result is cached.
+
+        BLOCK_ORDER_ROW follows the storage order of GeoTIFF strips and tiles, BLOCK_ORDER_ZORDER and
+        BLOCK_ORDER_HILBERT keep consecutive blocks close to each other in both directions.
+
+        :param order: One of BLOCK_ORDERS.
+        """
+        if order not in self._orders:
+            rows, cols = self.blocks["row"], self.blocks["col"]
+            if order == BLOCK_ORDER_COLUMN:
+                indices = np.arange(len(self), dtype=np.int64)
+            elif order == BLOCK_ORDER_ROW:
+                indices = np.lexsort((cols, rows))
+            elif order == BLOCK_ORDER_ZORDER:
+                indices = np.argsort(_morton_code(rows, cols), kind="stable")
+            elif order == BLOCK_ORDER_HILBERT:
+                indices = np.argsort(_hilbert_distance(rows, cols, max(self.shape)), kind="stable")
+            else:
+                raise ValueError("Invalid order: {}, must be one of {}.".format(order, BLOCK_ORDERS))
+            self._orders[order] = indices
+        return self._orders[order]
+
+
+def _morton_code(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Interleaves the bits of rows and cols (Z-order curve)."""
+    rows, cols = rows.astype(np.uint64), cols.astype(np.uint64)
+    code = np.zeros(len(rows), dtype=np.uint64)
+    for bit in range(int(max(rows.max(initial=0), cols.max(initial=0))).bit_length()):
+        bit = np.uint64(bit)
+        one = np.uint64(1)
+        code |= ((rows >> bit) & one) << (np.uint64(2) * bit + one)
+        code |= ((cols >> bit) & one) << (np.uint64(2) * bit)
+    return code
+
+
+def _hilbert_distance(rows: np.ndarray, cols: np.ndarray, size: int) -> np.ndarray:
+    """Position of each (row, col) along a Hilbert curve covering a size x size grid."""
+    n = 1 << max(int(size - 1).bit_length(), 0)
+    x, y = cols.astype(np.int64), rows.astype(np.int64)
+    distance = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        distance += s * s * ((3 * rx) ^ ry)
+        # Rotates the quadrant so the curve is continuous.
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+    return distance
@@ -0,0 +1,133 @@
+# Pablo Carreira - 18/10/26
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+
+
+class RunningStats:
+    def __init__(self):
+        """Count, min, max, sum, mean and standard deviation accumulated block by block.
+
+        Partial results (e.g. from other workers) are combined with merge, the variance uses the
+        parallel algorithm of Chan et al. so the results match numpy on the whole array.
+        """
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, data: np.ndarray):
+        """Adds the values of an array."""
+        if data.size == 0:
+            return
+        other = RunningStats()
+        other.count = data.size
+        other.min = data.min()
+        other.max = data.max()
+        # Integers are summed exactly, like numpy does.
+        other.sum = data.sum(dtype=np.int64 if data.dtype.kind in "iub" else np.float64)
+        other.mean = other.sum / other.count
+        other._m2 = float(np.square(data - other.mean, dtype=np.float64).sum())
+        self.merge(other)
+
+    def merge(self, other: "RunningStats"):
+        """Adds the values accumulated by other."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.min, self.max = other.count, other.min, other.max
+            self.sum, self.mean, self._m2 = other.sum, other.mean, other._m2
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum = self.sum + other.sum
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / self.count if self.count else float("nan")
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def as_dict(self) -> Dict:
+        return {"count": self.count, "min": self.min, "max": self.max, "sum": self.sum,
+                "mean": self.mean, "std": self.std}
+
+
+class StreamingHistogram:
+    def __init__(self, bins: int, value_range: Tuple[float, float]):
+        """Histogram with fixed bins accumulated block by block, equivalent to np.histogram(data, bins, value_range).
+
+        :param bins: Number of bins.
+        :param value_range: (min, max) of the bins.
+        """
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.edges = np.histogram_bin_edges([], bins, value_range)
+        self.value_range = value_range
+
+    def update(self, data: np.ndarray):
+        self.counts += np.histogram(data, self.edges)[0]
+
+    def merge(self, other: "StreamingHistogram"):
+        self.counts += other.counts
+
+
+class IntegerCounter:
+    def __init__(self, minimum: int, maximum: int):
+        """Counts of every integer value between minimum and maximum, used for exact percentiles."""
+        self.minimum = int(minimum)
+        self.counts = np.zeros(int(maximum) - self.minimum + 1, dtype=np.int64)
+
+    def update(self, data: np.ndarray):
+        self.counts += np.bincount((data.ravel().astype(np.int64) - self.minimum), minlength=len(self.counts))
+
+    def merge(self, other: "IntegerCounter"):
+        self.counts += other.counts
+
+
+class ClassCounter:
+    def __init__(self):
+        """Number of pixels of each value (class), accumulated block by block."""
+        self.counts = {}
+
+    def update(self, data: np.ndarray):
+        values, counts = np.unique(data, return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.counts[value] = self.counts.get(value, 0) + count
+
+    def merge(self, other: "ClassCounter"):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+
+
+def accumulate(factory: Callable, data: np.ndarray):
+    """Creates an accumulator with factory and adds the data to it. Task for the workers."""
+    accumulator = factory()
+    accumulator.update(data)
+    return accumulator
+
+
+def percentiles_from_counts(counts: np.ndarray, values: np.ndarray, q: Sequence[float]) -> np.ndarray:
+    """Percentiles from the counts of sorted values, with the linear interpolation of np.percentile.
+
+    Exact when each count is of a single value (integers), approximated by the bin edges otherwise.
+
+    :param counts: Number of elements of each value.
+    :param values: The sorted values.
+    :param q: Percentiles, between 0 and 100.
+    """
+    cumulative = np.cumsum(counts)
+    positions = np.asarray(q, dtype=np.float64) / 100 * (cumulative[-1] - 1)
+    lower = np.floor(positions)
+    # Value of the k-th element: the first value whose cumulative count is bigger than k.
+    lower_values = values[np.searchsorted(cumulative, lower, side="right")]
+    upper_values = values[np.searchsorted(cumulative, np.ceil(positions), side="right")]
+    return lower_values + (positions - lower) * (upper_values - lower_values)
@@ -1,9 +1,9 @@
-from typing import Tuple, Union
+from typing import Iterator, List, Tuple, Union, Sequence
 from warnings import warn
 
 import numpy as np
 
-from geodata.srs_utils import create_osr_srs
+from geodata.srs_utils import create_osr_srs, get_osr_transform, is_same_srs, srs_to_wkt
 
 try:
     # noinspection PyUnresolvedReferences
@@ -13,7 +13,7 @@ except ImportError:
 
 
 class BBox:
-    # __slots__ = ['xmin', 'ymin', 'xmax', 'ymax', '_wkt_srs', '_geometry']
+    __slots__ = ['xmin', 'ymin', 'xmax', 'ymax', '_wkt_srs', '_geometry']
 
     def __init__(self, xmin: float, ymin: float, xmax: float, ymax: float, wkt_srs: str=None):
 
@@ -51,29 +51,23 @@ class BBox:
         """This magic method allows the BBox to be cast as a sequence."""
         return iter((self.xmin, self.ymin, self.xmax, self.ymax))
 
-    # def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference]):
-    def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference]):
-        """Transform this BBox to a srs and returns a new BBox."""
+    def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference], densify_points: int = 0):
+        """Transform this BBox to a srs and returns a new BBox.
 
+        Only the 4 corners are transformed by default, the edges may bend outside of them (e.g. UTM to
+        geographic over large areas). Use densify_points to get the true extent.
+
+        :param new_srs: The new srs.
+        :param densify_points: Points per edge to transform, doubled until the extent converges. 0 for the corners only.
+        """
         if self._wkt_srs is None:
             raise AttributeError("SRS not defined for this BBox.")
 
-        src_srs = osr.SpatialReference()
-        src_srs.ImportFromWkt(self._wkt_srs)
-
-        # Compatibilidade com gdal 3.
-        if int(gdal.__version__.split('.')[0]) >= 3:
-            src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-
-        dst_srs = create_osr_srs(new_srs)
-        transform = osr.CoordinateTransformation(src_srs, dst_srs)
-        new_geom = transform.TransformPoints(self._geometry)
-        # Get bbox from new geom:
-        new_geom = np.asarray(new_geom)
-        xcol = new_geom[:, 0]
-        ycol = new_geom[:, 1]
-        new_bbox = BBox(xcol.min(), ycol.min(), xcol.max(), ycol.max(), dst_srs.ExportToWkt())
-        new_bbox._geometry = tuple(map(tuple, new_geom[:, :2]))
+        # The srs and the transform are cached, with the traditional GIS axis order on gdal 3.
+        transform = get_osr_transform(self._wkt_srs, new_srs)
+        bounds, new_geom = _transform_rings(transform, np.array([self._geometry], dtype=np.float64), densify_points)
+        new_bbox = BBox(*bounds[0].tolist(), wkt_srs=_export_wkt(new_srs))
+        new_bbox._geometry = tuple(map(tuple, new_geom[0].tolist()))
         return new_bbox
 
     @classmethod
@@ -107,6 +101,197 @@ class BBox:
         return (self.xmax + self.xmin) / 2, (self.ymax + self.ymin) / 2
 
 
+#: Refinements of the densified reprojection, each one doubles the points per edge.
+DENSIFY_MAX_REFINEMENTS = 6
+#: The densified extent converged when it changes less than this fraction of its size.
+DENSIFY_TOLERANCE = 1e-6
+
+
+def _export_wkt(srs: Union[str, int, osr.SpatialReference]) -> str:
+    if isinstance(srs, osr.SpatialReference):
+        return srs.ExportToWkt()
+    return srs_to_wkt(srs)
+
+
+def _densify_rings(corners: np.ndarray, points_per_edge: int) -> np.ndarray:
+    """Points along the edges of rings (N, 4, 2) of 4 corners, (N, 4 * points_per_edge, 2).
+    The corners are at every points_per_edge points."""
+    t = (np.arange(points_per_edge) / points_per_edge)[:, np.newaxis]
+    following = np.roll(corners, -1, axis=1)
+    points = corners[:, :, np.newaxis] + (following - corners)[:, :, np.newaxis] * t
+    return points.reshape((len(corners), -1, 2))
+
+
+def _transform_rings(transform: osr.CoordinateTransformation, corners: np.ndarray,
+                     densify_points: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Transforms rings of 4 corners, returns the extents (N, 4) and the transformed corners (N, 4, 2).
+
+    With densify_points the edges are densified, the points are doubled until the extents converge.
+    """
+    points_per_edge = max(densify_points, 1)
+    bounds, transformed = _transform_densified(transform, corners, points_per_edge)
+    for _ in range(DENSIFY_MAX_REFINEMENTS if densify_points > 0 else 0):
+        new_bounds, new_transformed = _transform_densified(transform, corners, points_per_edge * 2)
+        size = np.maximum(new_bounds[:, 2] - new_bounds[:, 0], new_bounds[:, 3] - new_bounds[:, 1])
+        converged = np.abs(new_bounds - bounds).max(axis=1) <= DENSIFY_TOLERANCE * size
+        bounds, transformed = new_bounds, new_transformed
+        points_per_edge *= 2
+        if converged.all():
+            break
+    return bounds, transformed[:, ::points_per_edge]
+
+
+def _transform_densified(transform: osr.CoordinateTransformation, corners: np.ndarray,
+                         points_per_edge: int) -> Tuple[np.ndarray, np.ndarray]:
+    """One TransformPoints call for all the densified rings, returns the extents and the points."""
+    points = _densify_rings(corners, points_per_edge)
+    transformed = np.asarray(transform.TransformPoints(points.reshape((-1, 2)).tolist()), dtype=np.float64)
+    transformed = transformed[:, :2].reshape(points.shape)
+    return np.concatenate((transformed.min(axis=1), transformed.max(axis=1)), axis=1), transformed
+
+
+class BBoxArray:
+    __slots__ = ["bounds", "_wkt_srs"]
+
+    def __init__(self, bounds: Union[np.ndarray, Sequence], wkt_srs: str = None):
+        """Many bounding boxes with the same srs, kept in an array (N, 4) of xmin, ymin, xmax, ymax.
+
+        The operations are vectorized over all the boxes. The binary operations take a BBox (applied
+        to every box) or a BBoxArray of the same length (box by box).
+
+        :param bounds: Array (N, 4) with xmin, ymin, xmax, ymax of each box.
+        :param wkt_srs: Spatial reference system in well known text format, shared by all the boxes.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64)
+        if bounds.size == 0:
+            bounds = bounds.reshape((0, 4))
+        if bounds.ndim != 2 or bounds.shape[1] != 4:
+            raise ValueError("bounds must have the shape (N, 4), got {}.".format(bounds.shape))
+        self.bounds = bounds
+        self._wkt_srs = wkt_srs
+
+    @classmethod
+    def from_bboxes(cls, bboxes: Sequence[BBox]) -> "BBoxArray":
+        """Creates the array from a list of BBox, they must have the same srs."""
+        wkt_srs = bboxes[0].wkt_srs if len(bboxes) else None
+        for bbox in bboxes:
+            if bbox.wkt_srs != wkt_srs and (bbox.wkt_srs is None or wkt_srs is None or
+                                            not is_same_srs(bbox.wkt_srs, wkt_srs)):
+                raise ValueError("All the BBox must have the same srs.")
+        return cls([bbox.as_tuple() for bbox in bboxes], wkt_srs)
+
+    def to_bboxes(self) -> List[BBox]:
+        return [BBox(*row, wkt_srs=self._wkt_srs) for row in self.bounds.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def __iter__(self) -> Iterator[BBox]:
+        return iter(self.to_bboxes())
+
+    def __getitem__(self, item) -> Union[BBox, "BBoxArray"]:
+        """An int returns a BBox, slices, masks and index arrays return a BBoxArray."""
+        if isinstance(item, (int, np.integer)):
+            return BBox(*self.bounds[item].tolist(), wkt_srs=self._wkt_srs)
+        return BBoxArray(self.bounds[item], self._wkt_srs)
+
+    @property
+    def wkt_srs(self):
+        return self._wkt_srs
+
+    @property
+    def srs(self) -> osr.SpatialReference:
+        return create_osr_srs(self.wkt_srs)
+
+    @property
+    def xmin(self) -> np.ndarray:
+        return self.bounds[:, 0]
+
+    @property
+    def ymin(self) -> np.ndarray:
+        return self.bounds[:, 1]
+
+    @property
+    def xmax(self) -> np.ndarray:
+        return self.bounds[:, 2]
+
+    @property
+    def ymax(self) -> np.ndarray:
+        return self.bounds[:, 3]
+
+    def area(self) -> np.ndarray:
+        return (self.xmax - self.xmin) * (self.ymax - self.ymin)
+
+    def total_bounds(self) -> BBox:
+        """The BBox that contains all the boxes."""
+        if not len(self):
+            raise ValueError("Empty BBoxArray.")
+        return BBox(self.xmin.min(), self.ymin.min(), self.xmax.max(), self.ymax.max(), self._wkt_srs)
+
+    def _other_bounds(self, other: Union[BBox, "BBoxArray"]) -> np.ndarray:
+        """The bounds of other, broadcastable against self.bounds."""
+        if isinstance(other, BBox):
+            bounds = np.array(other.as_tuple(), dtype=np.float64)
+        elif isinstance(other, BBoxArray):
+            if len(other) != len(self):
+                raise ValueError("BBoxArray of different lengths: {} and {}.".format(len(self), len(other)))
+            bounds = other.bounds
+        else:
+            raise TypeError("Expected a BBox or a BBoxArray.")
+        if self._wkt_srs != other.wkt_srs and self._wkt_srs is not None and other.wkt_srs is not None:
+            if not is_same_srs(self._wkt_srs, other.wkt_srs):
+                raise ValueError("Must be in the same SRS.")
+        return bounds
+
+    def intersects(self, other: Union[BBox, "BBoxArray"]) -> np.ndarray:
+        """True where the boxes overlap or touch."""
+        o = self._other_bounds(other)
+        return ((self.xmin <= o[..., 2]) & (o[..., 0] <= self.xmax) &
+                (self.ymin <= o[..., 3]) & (o[..., 1] <= self.ymax))
+
+    def contains(self, other: Union[BBox, "BBoxArray"]) -> np.ndarray:
+        """True where the box contains other entirely."""
+        o = self._other_bounds(other)
+        return ((self.xmin <= o[..., 0]) & (o[..., 2] <= self.xmax) &
+                (self.ymin <= o[..., 1]) & (o[..., 3] <= self.ymax))
+
+    def contains_point(self, x: float, y: float) -> np.ndarray:
+        """True where the box contains the point (x, y), edges included."""
+        return (self.xmin <= x) & (x <= self.xmax) & (self.ymin <= y) & (y <= self.ymax)
+
+    def intersection(self, other: Union[BBox, "BBoxArray"]) -> "BBoxArray":
+        """The intersection of each box with other, NaN where they do not intersect."""
+        o = self._other_bounds(other)
+        bounds = np.column_stack((np.maximum(self.xmin, o[..., 0]), np.maximum(self.ymin, o[..., 1]),
+                                  np.minimum(self.xmax, o[..., 2]), np.minimum(self.ymax, o[..., 3])))
+        bounds[~self.intersects(other)] = np.nan
+        return BBoxArray(bounds, self._wkt_srs)
+
+    def union(self, other: Union[BBox, "BBoxArray"]) -> "BBoxArray":
+        """The box that contains each box and other (see total_bounds for the union of all)."""
+        o = self._other_bounds(other)
+        bounds = np.column_stack((np.minimum(self.xmin, o[..., 0]), np.minimum(self.ymin, o[..., 1]),
+                                  np.maximum(self.xmax, o[..., 2]), np.maximum(self.ymax, o[..., 3])))
+        return BBoxArray(bounds, self._wkt_srs)
+
+    def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference],
+                      densify_points: int = 0) -> "BBoxArray":
+        """Transform the boxes to a srs with a single TransformPoints call and returns a new BBoxArray.
+
+        Like BBox.transform_srs, each new box is the extent of the transformed corners, or of the
+        densified edges with densify_points (one call per refinement).
+        """
+        if self._wkt_srs is None:
+            raise AttributeError("SRS not defined for this BBoxArray.")
+        if not len(self):
+            return BBoxArray(self.bounds.copy(), _export_wkt(new_srs))
+        # Corners in the order of BBox._geometry: (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin).
+        corners = self.bounds[:, [0, 3, 2, 3, 2, 1, 0, 1]].reshape((-1, 4, 2))
+        transform = get_osr_transform(self._wkt_srs, new_srs)
+        bounds, _ = _transform_rings(transform, corners, densify_points)
+        return BBoxArray(bounds, _export_wkt(new_srs))
+
+
 class RasterDefinition:
     __slots__ = ["rows", "cols", "xmin", "ymax", "xres", "yres", "srs"]
 
@@ -134,3 +319,64 @@ class RasterDefinition:
         self.xmin = xmin
         self.cols = cols
         self.rows = rows
+
+
+class GeoTransform:
+    __slots__ = ["x0", "a", "b", "y0", "d", "e", "_inverse"]
+
+    def __init__(self, geotransform: Sequence[float]):
+        """The affine transform between pixel (col, row) and world (x, y) coordinates, as given by
+        gdal GetGeoTransform: x = x0 + col * a + row * b, y = y0 + col * d + row * e.
+
+        Applied to whole arrays of points at once. Supports non-square and rotated pixels.
+
+        :param geotransform: The 6 gdal coefficients.
+        """
+        self.x0, self.a, self.b, self.y0, self.d, self.e = map(float, geotransform)
+        determinant = self.a * self.e - self.b * self.d
+        if determinant == 0:
+            raise ValueError("Geotransform is not invertible: {}.".format(tuple(geotransform)))
+        # Coefficients of the inverse, same layout: col = x0 + x * a + y * b, row = y0 + x * d + y * e.
+        a, b, d, e = self.e / determinant, -self.b / determinant, -self.d / determinant, self.a / determinant
+        self._inverse = (-self.x0 * a - self.y0 * b, a, b, -self.x0 * d - self.y0 * e, d, e)
+
+    def forward(self, cols, rows) -> Tuple[np.ndarray, np.ndarray]:
+        """Pixel to world. The upper left corner of a pixel is at integer coordinates, the center at + 0.5.
+
+        :param cols: Column coordinates (scalar or array).
+        :param rows: Row coordinates (scalar or array).
+        :returns: The x and y arrays.
+        """
+        cols, rows = np.asarray(cols, dtype=np.float64), np.asarray(rows, dtype=np.float64)
+        return self.x0 + cols * self.a + rows * self.b, self.y0 + cols * self.d + rows * self.e
+
+    def inverse(self, xs, ys) -> Tuple[np.ndarray, np.ndarray]:
+        """World to pixel, fractional coordinates (use np.floor for the pixel containing the point).
+
+        :param xs: X coordinates (scalar or array).
+        :param ys: Y coordinates (scalar or array).
+        :returns: The column and row arrays.
+        """
+        x0, a, b, y0, d, e = self._inverse
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        if self.is_north_up:
+            # Same operations as the direct formula, avoids rounding differences on pixel edges.
+            return (xs - self.x0) / self.a, (ys - self.y0) / self.e
+        return x0 + xs * a + ys * b, y0 + xs * d + ys * e
+
+    @property
+    def is_north_up(self) -> bool:
+        """True if there is no rotation."""
+        return self.b == 0 and self.d == 0
+
+    @property
+    def x_resolution(self) -> float:
+        return self.a
+
+    @property
+    def y_resolution(self) -> float:
+        """Usually negative, the rows go down."""
+        return self.e
+
+    def as_tuple(self) -> Tuple[float, ...]:
+        return self.x0, self.a, self.b, self.y0, self.d, self.e
@@ -0,0 +1,131 @@
+# Pablo Carreira - 18/10/26
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterator, Sequence, Tuple, Union
+
+import numpy as np
+
+from geodata.block_engine import WorkerHandles, read_block, submit_bounded
+
+
+class PrefetchStats:
+    __slots__ = ("n_blocks", "wait_time", "consume_time")
+
+    def __init__(self):
+        """Time spent by a prefetching iteration waiting for reads and consuming the blocks (seconds)."""
+        self.n_blocks = 0
+        self.wait_time = 0.0
+        self.consume_time = 0.0
+
+    @property
+    def wait_ratio(self) -> float:
+        """Fraction of the time spent waiting for I/O, near 0 means the reads are hidden behind the processing."""
+        total = self.wait_time + self.consume_time
+        return self.wait_time / total if total else 0.0
+
+    def __str__(self):
+        return "Blocks: {}, waiting: {:.3f} s, consuming: {:.3f} s".format(
+            self.n_blocks, self.wait_time, self.consume_time)
+
+
+class BlockPrefetcher:
+    def __init__(self, raster_data: "RasterData", depth: int = 2, workers: int = 1,
+                 bands: Union[int, Sequence[int]] = 1, order: str = None):
+        """Iterates over the blocks of a RasterData reading the next blocks in background threads
+        while the current one is processed.
+
+        Each thread reads with its own dataset handle. Yields pairs (block index, block data).
+
+        :param raster_data: The RasterData.
+        :param depth: Number of blocks read ahead.
+        :param workers: Number of reading threads.
+        :param bands: A band (rows, cols) or a sequence of bands (bands, rows, cols).
+        :param order: Order of the blocks, see RasterData.get_block_indices.
+        """
+        if depth < 1 or workers < 1:
+            raise ValueError("depth and workers must be >= 1.")
+        self.raster_data = raster_data
+        self.depth = depth
+        self.workers = workers
+        self.bands = bands if isinstance(bands, int) else raster_data._get_band_list(bands)
+        self.order = order
+        self.stats = PrefetchStats()
+
+    def _items(self) -> Iterator[Tuple[int, Tuple]]:
+        block_list = self.raster_data.block_list
+        for block_index in self.raster_data.get_block_indices(self.order):
+            yield block_index, block_list[block_index]
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        handles = WorkerHandles()
+        task = handles.bind(partial(read_block, self.raster_data.dataset_source, self.bands))
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # depth reads keep running while the consumer holds the current block.
+                results = submit_bounded(executor, task, self._items(), max_in_flight=self.depth + 1)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        (block_index, _), block_data = next(results)
+                    except StopIteration:
+                        break
+                    self.stats.wait_time += time.perf_counter() - start
+                    self.stats.n_blocks += 1
+                    start = time.perf_counter()
+                    yield block_index, block_data
+                    self.stats.consume_time += time.perf_counter() - start
+        finally:
+            handles.close()
+
+
+class AsyncBlockPrefetcher(BlockPrefetcher):
+    """Asyncio version of BlockPrefetcher, the reads run in threads and don't block the event loop:
+
+        async for block_index, block_data in raster.aiter_blocks():
+            ...
+    """
+
+    def __iter__(self):
+        raise TypeError("Use async for.")
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        loop = asyncio.get_running_loop()
+        handles = WorkerHandles()
+        task = handles.bind(partial(read_block, self.raster_data.dataset_source, self.bands))
+        items = self._items()
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for item in islice(items, self.depth):
+                pending.append((item, loop.run_in_executor(executor, task, item)))
+            while pending:
+                item, future = pending.popleft()
+                start = time.perf_counter()
+                block_data = await future
+                self.stats.wait_time += time.perf_counter() - start
+                self.stats.n_blocks += 1
+                for next_item in islice(items, 1):
+                    pending.append((next_item, loop.run_in_executor(executor, task, next_item)))
+                start = time.perf_counter()
+                yield item[0], block_data
+                self.stats.consume_time += time.perf_counter() - start
+        finally:
+            for _, future in pending:
+                future.cancel()
+            # Waiting for the running reads would block the event loop, another thread closes the
+            # handles after them.
+            threading.Thread(target=_shutdown, args=(executor, handles)).start()
+
+
+def _shutdown(executor: ThreadPoolExecutor, handles: WorkerHandles):
+    """Waits for the reads still running and closes the handles they used."""
+    executor.shutdown(wait=True)
+    handles.close()
@@ -59,7 +59,8 @@ class RasterPaddingIterator(collections.Iterator):
         self.infinite = infinite
         self.block_coordinates = raster_data.get_blocks_positions_coordinates()
         self.padding = padding
-        self.block_size = raster_data.block_size
+        # Block size as (rows, cols), gdal gives (width, height).
+        self.block_size = raster_data.block_size[1], raster_data.block_size[0]
         self.raster_data = raster_data
 
         self.index = 0
@@ -1,9 +1,11 @@
 # Pablo Carreira - 30/05/17
-from random import Random
-from typing import Sequence
+import hashlib
+from typing import Sequence, Tuple, Iterator, Union
 
 import numpy as np
 
+from geodata.block_grid import BlockGrid
+
 MIRROR_TOP = "top"
 MIRROR_BOTTOM = "bottom"
 MIRROR_LEFT = "left"
@@ -13,6 +15,9 @@ MIRROR_ERROR_MESSAGE = "Padding bigger than block dimension."
 SAMPLER_RATIO_METHOD = "ratio"
 SAMPLER_METHOD_N_SAMPLES = "n_samples"
 
+SPATIAL_CHECKERBOARD = "checkerboard"
+SPATIAL_GROUPS = "groups"
+
 
 class ArraySampler:
     def __init__(self, method: str, ratio: float = None, n_samples: int = None, random_seed: str = "abc"):
@@ -38,7 +43,7 @@ class ArraySampler:
 
         # Parameters checks:
         if method == SAMPLER_RATIO_METHOD:
-            if ratio < 0 or ratio > 1 or ratio is None:
+            if ratio is None or ratio < 0 or ratio > 1:
                 raise ValueError("Ratio must be < 1 and > 0")
         elif method == SAMPLER_METHOD_N_SAMPLES:
             if n_samples is None:
@@ -58,24 +63,106 @@ class ArraySampler:
             raise ValueError("Invalid method.")
         return n_selected, n_blocks_total - n_selected
 
+    def _random_generator(self) -> np.random.Generator:
+        """A new generator from the seed, so every call gives the same results."""
+        if isinstance(self.random_seed, int):
+            return np.random.default_rng(self.random_seed)
+        digest = hashlib.sha256(str(self.random_seed).encode("utf-8")).digest()
+        return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+    def sample_indices(self, n_elements: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Take samples from the indices 0..n_elements - 1, in O(n).
+
+        :param n_elements: The number of elements.
+        :returns: A tuple with the selected indices (random order) and the not selected indices (ascending).
+        """
+        n_selected, _ = self._calculate_output_length(n_elements)
+        selected = self._random_generator().permutation(n_elements)[:n_selected]
+        mask = np.zeros(n_elements, dtype=bool)
+        mask[selected] = True
+        return selected, np.flatnonzero(~mask)
+
     def sample(self, array: Sequence) -> Sequence:
         """Take samples from a sequence using the defined method.
 
         :param array: The list of indices.
         :returns: A tuple containing a alist of selected elements and a list of not selected elements.
+            For numpy arrays, two arrays.
         """
-        n_blocks = len(array)
-        n_selected, n_not_selected = self._calculate_output_length(n_blocks)
-        random_generator = Random(self.random_seed)
-        # Obs: Para otimização, é possível copiar e reproduzir a função sample,
-        # separando os selecionados e não selecionados.
-        selected = random_generator.sample(array, n_selected)
-        # Agora calcula os não selecionados:
-        not_selected = []
-        for item in array:
-            if item not in selected:
-                not_selected.append(item)
-        return selected, not_selected
+        selected, not_selected = self.sample_indices(len(array))
+        if isinstance(array, np.ndarray):
+            return array[selected], array[not_selected]
+        return [array[item] for item in selected], [array[item] for item in not_selected]
+
+    def sample_stratified(self, labels: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """Take samples from every class separately, keeping the proportion of the classes.
+
+        With SAMPLER_RATIO_METHOD the ratio is applied to each class, with SAMPLER_METHOD_N_SAMPLES the
+        samples are divided between the classes proportionally to their sizes.
+
+        :param labels: The class of each element.
+        :returns: A tuple with the selected indices and the not selected indices (both ascending).
+        """
+        labels = np.asarray(labels)
+        classes, inverse, class_sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        n_selected, _ = self._calculate_output_length(len(labels))
+        if self.method == SAMPLER_RATIO_METHOD:
+            quotas = (class_sizes * self.ratio).astype(np.int64)
+        else:
+            # Largest remainder, so the quotas add up to n_samples.
+            exact = class_sizes * n_selected / len(labels)
+            quotas = np.floor(exact).astype(np.int64)
+            remainders = np.argsort(quotas - exact, kind="stable")[:n_selected - quotas.sum()]
+            quotas[remainders] += 1
+
+        # Random order inside each class: shuffle, then a stable sort by class.
+        order = self._random_generator().permutation(len(labels))
+        order = order[np.argsort(inverse[order], kind="stable")]
+        class_starts = np.concatenate(([0], np.cumsum(class_sizes)[:-1]))
+        rank = np.arange(len(labels)) - class_starts[inverse[order]]
+        mask = np.zeros(len(labels), dtype=bool)
+        mask[order[rank < quotas[inverse[order]]]] = True
+        return np.flatnonzero(mask), np.flatnonzero(~mask)
+
+    def kfold(self, n_elements: int, k: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Splits the indices 0..n_elements - 1 in k random folds, ignores the sampling method.
+
+        :returns: An iterator of k tuples (train indices, validation indices), both ascending.
+        """
+        if k < 2 or k > n_elements:
+            raise ValueError("k must be between 2 and the number of elements.")
+        folds = np.array_split(self._random_generator().permutation(n_elements), k)
+        for fold in folds:
+            mask = np.ones(n_elements, dtype=bool)
+            mask[fold] = False
+            yield np.flatnonzero(mask), np.sort(fold)
+
+    def iter_sample(self, n_elements: int, chunk_size: int = 1000000) -> Iterator[np.ndarray]:
+        """Take samples from the indices 0..n_elements - 1 without creating the full list of indices.
+
+        The indices are visited in chunks and the number of samples taken from each chunk is drawn from
+        the hypergeometric distribution, so the total is exactly the same of sample_indices.
+
+        :param n_elements: The number of elements.
+        :param chunk_size: Number of indices visited at a time.
+        :returns: An iterator of arrays with the selected indices of each chunk (ascending).
+        """
+        n_selected, _ = self._calculate_output_length(n_elements)
+        random_generator = self._random_generator()
+        remaining = n_elements
+        for start in range(0, n_elements, chunk_size):
+            size = min(chunk_size, n_elements - start)
+            if n_selected == 0:
+                taken = 0
+            elif size == remaining:
+                taken = n_selected
+            else:
+                taken = random_generator.hypergeometric(n_selected, remaining - n_selected, size)
+            if taken:
+                yield start + np.sort(random_generator.choice(size, taken, replace=False))
+            n_selected -= taken
+            remaining -= size
 
     def predict_samples_sizes(self, img_shape, block_size: Sequence):
         """Given an src_img shape and a block size, predict the size of selected and not selected samples list."""
@@ -91,6 +178,103 @@ class ArraySampler:
         return self._calculate_output_length(n_blocks_total)
 
 
+class SpatialBlockSampler:
+    def __init__(self, method: str, group_size: int = 1, ratio: float = 0.5, buffer: int = 0,
+                 random_seed: Union[str, int] = "abc"):
+        """Splits the blocks of a raster in train and validation sets by their position, so neighbour
+        (autocorrelated) blocks don't end up in different sets.
+
+        The blocks are joined in square groups of group_size x group_size blocks and whole groups go
+        to the validation set: alternating like a checkerboard (SPATIAL_CHECKERBOARD) or taken randomly
+        with a ratio (SPATIAL_GROUPS). Training blocks closer than buffer blocks to a validation block
+        are left out of both sets (with a checkerboard, keep buffer smaller than group_size).
+
+        :param method: SPATIAL_CHECKERBOARD or SPATIAL_GROUPS.
+        :param group_size: Size of the groups, in blocks.
+        :param ratio: Ratio of validation groups for SPATIAL_GROUPS.
+        :param buffer: Distance in blocks (including diagonals) from the validation blocks to exclude.
+        :param random_seed: Seed for SPATIAL_GROUPS, see ArraySampler.
+        """
+        if method not in (SPATIAL_CHECKERBOARD, SPATIAL_GROUPS):
+            raise ValueError("Invalid method.")
+        if group_size < 1 or buffer < 0:
+            raise ValueError("group_size must be >= 1 and buffer >= 0.")
+        self.method = method
+        self.group_size = group_size
+        self.buffer = buffer
+        self.group_sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=ratio, random_seed=random_seed)
+
+    def validation_mask(self, grid_shape: Tuple[int, int]) -> np.ndarray:
+        """Boolean array (block rows, block cols), True for the validation blocks."""
+        n_group_rows = -(-grid_shape[0] // self.group_size)
+        n_group_cols = -(-grid_shape[1] // self.group_size)
+        if self.method == SPATIAL_CHECKERBOARD:
+            group_mask = (np.add.outer(np.arange(n_group_rows), np.arange(n_group_cols)) % 2).astype(bool)
+        else:
+            group_mask = np.zeros(n_group_rows * n_group_cols, dtype=bool)
+            group_mask[self.group_sampler.sample_indices(len(group_mask))[0]] = True
+            group_mask = group_mask.reshape((n_group_rows, n_group_cols))
+        # Each group becomes group_size x group_size blocks.
+        block_mask = np.repeat(np.repeat(group_mask, self.group_size, axis=0), self.group_size, axis=1)
+        return block_mask[:grid_shape[0], :grid_shape[1]]
+
+    def split(self, block_grid: BlockGrid) -> Tuple[np.ndarray, np.ndarray]:
+        """Splits the blocks of a grid (RasterData.block_grid).
+
+        :returns: A tuple with the train and validation block indices (indices of block_list, ascending),
+            ready to be used with the block readers (e.g. RasterData.read_block_into).
+        """
+        validation = self.validation_mask(block_grid.shape)
+        train = ~_dilate(validation, self.buffer) if self.buffer else ~validation
+        blocks = block_grid.blocks
+        index_grid = np.empty(block_grid.shape, dtype=np.int64)
+        index_grid[blocks["row"], blocks["col"]] = np.arange(len(blocks))
+        return np.sort(index_grid[train]), np.sort(index_grid[validation])
+
+
+def _dilate(mask: np.ndarray, distance: int) -> np.ndarray:
+    """Binary dilation of a 2D mask by a square of (2 * distance + 1) elements, with cumulative sums."""
+    window = 2 * distance + 1
+    for axis in (0, 1):
+        padding = [(0, 0), (0, 0)]
+        padding[axis] = (distance + 1, distance)
+        cumulative = np.cumsum(np.pad(mask, padding).astype(np.int64), axis=axis)
+        if axis == 0:
+            mask = (cumulative[window:] - cumulative[:-window]) > 0
+        else:
+            mask = (cumulative[:, window:] - cumulative[:, :-window]) > 0
+    return mask
+
+
+class BufferPool:
+    def __init__(self, shape: Sequence[int], dtype, size: int = 2):
+        """A fixed set of preallocated arrays handed out in turns, for reading blocks without allocations.
+
+        An array returned by next() is handed out again only after size - 1 other arrays, so the
+        consumer can keep up to size - 1 previous blocks.
+
+        :param shape: Shape of the arrays.
+        :param dtype: Numpy dtype of the arrays.
+        :param size: Number of arrays.
+        """
+        if size < 1:
+            raise ValueError("size must be >= 1.")
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self._next = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> np.ndarray:
+        buffer = self.buffers[self._next]
+        self._next = (self._next + 1) % len(self.buffers)
+        return buffer
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self.buffers)
+
+
 def mirror_block(block_data: np.ndarray, padding: int, direction: str):
     """Mirrors a portion of a block by a given padding.
 
@@ -128,6 +312,36 @@ def mirror_block(block_data: np.ndarray, padding: int, direction: str):
         AttributeError('Direction must be one of [top, bottom, left, right] got: {}.'.format(direction))
 
 
+def mirror_halo(padded: np.ndarray, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+    """Fills the borders of a padded block mirroring the data inside it, in place.
+
+    Works like mirror_block in the four directions at once, without copying the block.
+
+    :param padded: Array (..., rows, cols), the data is inside the borders.
+    :param top: Number of rows to fill at the top.
+    :param bottom: Number of rows to fill at the bottom.
+    :param left: Number of columns to fill at the left.
+    :param right: Number of columns to fill at the right.
+    :returns: The same padded array.
+    """
+    rows, cols = padded.shape[-2:]
+    if min(top, bottom, left, right) < 0:
+        raise ValueError("Padding must be positive.")
+    if max(top, bottom) > rows - top - bottom or max(left, right) > cols - left - right:
+        raise ValueError(MIRROR_ERROR_MESSAGE)
+    # Rows first, only in the data columns, then the columns along all the rows (fills the corners).
+    data_cols = slice(left, cols - right)
+    if top:
+        padded[..., :top, data_cols] = padded[..., top:2 * top, data_cols][..., ::-1, :]
+    if bottom:
+        padded[..., rows - bottom:, data_cols] = padded[..., rows - 2 * bottom:rows - bottom, data_cols][..., ::-1, :]
+    if left:
+        padded[..., :left] = padded[..., left:2 * left][..., ::-1]
+    if right:
+        padded[..., cols - right:] = padded[..., cols - 2 * right:cols - right][..., ::-1]
+    return padded
+
+
 def normalize_channel_range(x: np.ndarray) -> np.ndarray:
     """Normaliza entre 0 e 1"""
     # return 2 * (x / 255) - 1
@@ -0,0 +1,90 @@
+# Pablo Carreira - 18/10/26
+import time
+
+import numpy as np
+
+DEFAULT_FLUSH_BYTES = 64 * 1024 * 1024
+
+
+class RasterWriter:
+    def __init__(self, raster_data: "RasterData", flush_bytes: int = DEFAULT_FLUSH_BYTES, flush_interval: float = None):
+        """A write session that flushes the gdal dataset only after a size or time threshold.
+
+        The blocks are written to the gdal block cache as usual, the writer counts the bytes written
+        and calls FlushCache when they add up to flush_bytes, when flush_interval seconds have
+        passed since the last flush or when the session is closed.
+
+        Use RasterData.writer() to create it:
+
+            with raster.writer() as writer:
+                for index, block in enumerate(blocks):
+                    writer.write_block(block, index)
+
+        :param raster_data: The RasterData to write to, must be write enabled.
+        :param flush_bytes: Flush when the bytes written since the last flush reach this size. None disables it.
+        :param flush_interval: Flush when this time (seconds) has passed since the last flush. None disables it.
+        """
+        if not raster_data.write_enabled:
+            raise ValueError("RasterData is not write enabled.")
+        self.raster_data = raster_data
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.pending_bytes = 0
+        #: Statistics for tuning the thresholds.
+        self.n_flushes = 0
+        self.bytes_written = 0
+        self.closed = False
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> "RasterWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write_block(self, data_array: np.ndarray, block_index: int, channel: int = 1, halo: int = 0):
+        """Writes a block of data to a band, see RasterData.write_block."""
+        block_position = self.raster_data.block_list[block_index]
+        if halo:
+            data_array = data_array[..., halo:data_array.shape[-2] - halo, halo:data_array.shape[-1] - halo]
+        self.write_window(data_array, block_position[0], block_position[1], channel)
+
+    def write_window(self, data_array: np.ndarray, xoff: int, yoff: int, channel: int = 1):
+        """Writes an array to a band at a position in pixels, see RasterData.write_window."""
+        self._check_open()
+        self.raster_data.write_window(data_array, xoff, yoff, channel, flush=False)
+        self._written(data_array.nbytes)
+
+    def write_all(self, data_array: np.ndarray, channel: int = 1):
+        """Writes an array starting from the first position, see RasterData.write_all."""
+        self._check_open()
+        self.raster_data.write_all(data_array, channel, flush=False)
+        self._written(data_array.nbytes)
+
+    def flush(self):
+        """Flushes the data written since the last flush to the disk."""
+        self._check_open()
+        self.raster_data.gdal_dataset.FlushCache()
+        self.n_flushes += 1
+        self.pending_bytes = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flushes the remaining data and ends the session."""
+        if self.closed:
+            return
+        if self.pending_bytes:
+            self.flush()
+        self.closed = True
+
+    def _written(self, n_bytes: int):
+        self.pending_bytes += n_bytes
+        self.bytes_written += n_bytes
+        if self.flush_bytes is not None and self.pending_bytes >= self.flush_bytes:
+            self.flush()
+        elif self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError("Writer already closed.")
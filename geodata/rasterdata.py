@@ -1,11 +1,26 @@
 # Pablo Carreira - 08/03/17
-from typing import Iterator, List, Tuple, Union, Sequence
+import os
+from functools import partial
+from itertools import repeat
+from typing import Iterator, List, Tuple, Union, Sequence, Callable, Dict
 
 import numpy as np
-from osgeo import gdal, osr
+from osgeo import gdal, gdal_array, osr
 
-from geodata.geo_objects import BBox, RasterDefinition
-from geodata.srs_utils import create_osr_srs
+from geodata.block_cache import BlockCache
+from geodata.block_engine import BACKEND_THREAD, DatasetSource, read_and_apply, run_tasks
+from geodata.block_grid import BlockGrid, BLOCK_ORDERS, BLOCK_ORDER_COLUMN, BLOCK_ORDER_ROW, BLOCK_ORDER_ZORDER, \
+    BLOCK_ORDER_HILBERT
+from geodata.block_stats import RunningStats, StreamingHistogram, IntegerCounter, ClassCounter, accumulate, \
+    percentiles_from_counts
+from geodata.geo_objects import BBox, RasterDefinition, GeoTransform
+from geodata.prefetch import AsyncBlockPrefetcher, BlockPrefetcher
+from geodata.raster_utils import BufferPool, mirror_halo
+from geodata.raster_writer import DEFAULT_FLUSH_BYTES, RasterWriter
+from geodata.srs_utils import create_osr_srs, get_osr_transform, is_same_srs
+
+INTERLEAVE_BAND = "band"
+INTERLEAVE_PIXEL = "pixel"
 
 
 class RasterData:
@@ -14,7 +29,11 @@ class RasterData:
     # n_channels: int = 1 ou apenas n_channels: int
 
     _block_list = None
+    _block_grid = None
     _block_indices = None
+    _memmap = None
+    _geotransform = None
+    _block_cache = None
     n_channels = 1
     proj = None
     origem = None
@@ -44,7 +63,8 @@ class RasterData:
     @property
     def raster_definition(self):
         """Retorna o objeto RasterDefinition com as características deste raster."""
-        return RasterDefinition(self.rows, self.cols, self.origem[0], self.origem[1], self.pixel_size, -self.pixel_size, self.wkt_srs)
+        return RasterDefinition(self.rows, self.cols, self.origem[0], self.origem[1], self.geotransform.x_resolution,
+                                self.geotransform.y_resolution, self.wkt_srs)
 
     def compare(self, other: "RasterData") -> None:
         """Prints a comparison of this and other RasterData"""
@@ -61,10 +81,8 @@ class RasterData:
         :param other: Other RasterData
         :return:
         """
-        # Estas 3 linhas garantem a comparação correta da referência espacial.
-        spatial_self = osr.SpatialReference(self.proj)
-        spatial_other = osr.SpatialReference(other.proj)
-        same_spatial = spatial_self.IsSame(spatial_other)
+        # Garante a comparação correta da referência espacial (o resultado fica em cache).
+        same_spatial = is_same_srs(self.proj, other.proj)
         return (self.rows == other.rows and
                 self.cols == other.cols and
                 self.origem == other.origem and
@@ -110,10 +128,78 @@ class RasterData:
         return RasterData(gdal.Warp(out_image, self.gdal_dataset, options=options))
 
     def read_all(self) -> np.ndarray:
-        """Reads the entire data into an array."""
+        """Reads the entire data into an array.
+        After as_memmap() this is a read only view of the file, no data is copied."""
+        if self._memmap is not None:
+            return self._memmap[0] if self.n_channels == 1 else self._memmap
         return self.gdal_dataset.ReadAsArray()
 
-    def read_block_by_coordinates(self, y0, y1, x0, x1):
+    def as_memmap(self) -> Union[np.memmap, None]:
+        """Maps the file in memory, so read_all, read_block_by_coordinates and the multi-band block
+        readers become slices of the file instead of gdal reads.
+
+        Only possible for uncompressed GeoTIFFs stored in contiguous strips (as created by create()),
+        tiled images like the ones from clone_empty are not. Otherwise returns None and the reads
+        keep using gdal.
+
+        The map is read only, data written with gdal is seen after it is flushed.
+
+        :returns: A read only view (bands, rows, cols) of the file or None.
+        """
+        if self._memmap is None:
+            layout = self._get_memmap_layout()
+            if layout is None:
+                return None
+            offset, dtype, interleave = layout
+            if interleave == INTERLEAVE_PIXEL:
+                mapped = np.memmap(self.src_image, dtype, "r", offset, (self.rows, self.cols, self.n_channels))
+                self._memmap = np.moveaxis(mapped, -1, 0)
+            else:
+                self._memmap = np.memmap(self.src_image, dtype, "r", offset, (self.n_channels, self.rows, self.cols))
+        return self._memmap
+
+    def _get_memmap_layout(self) -> Union[Tuple[int, np.dtype, str], None]:
+        """Checks if the file can be mapped, returns (offset of the first pixel, dtype, interleave) or None."""
+        dataset = self.gdal_dataset
+        if self.src_image is None or not os.path.isfile(self.src_image):
+            return None
+        if dataset.GetDriver().ShortName != "GTiff" or dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"):
+            return None
+        bands = [dataset.GetRasterBand(item + 1) for item in range(self.n_channels)]
+        if len({band.DataType for band in bands}) != 1 or bands[0].GetMetadataItem("NBITS", "IMAGE_STRUCTURE"):
+            return None
+        blk_width, blk_height = self.block_size
+        if blk_width != self.cols:
+            return None  # Tiled.
+        if self.n_channels == 1 or dataset.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE") == "BAND":
+            interleave, bands_per_strip = INTERLEAVE_BAND, 1
+        else:
+            interleave, bands_per_strip = INTERLEAVE_PIXEL, self.n_channels
+        if self.write_enabled:
+            dataset.FlushCache()
+        with open(self.src_image, "rb") as tiff_file:
+            byte_order = {b"II": "<", b"MM": ">"}.get(tiff_file.read(2))
+        if byte_order is None:
+            return None
+        dtype = np.dtype(self.get_numpy_dtype()).newbyteorder(byte_order)
+
+        # Every strip must start where the previous ends, and every band where the previous ends.
+        strip_bytes = blk_height * self.cols * bands_per_strip * dtype.itemsize
+        n_strips = self.block_grid.n_block_rows
+        first_offset = None
+        for band_index, band in enumerate(bands[:1] if interleave == INTERLEAVE_PIXEL else bands):
+            for strip in range(n_strips):
+                strip_offset = band.GetMetadataItem("BLOCK_OFFSET_0_{}".format(strip), "TIFF")
+                if not strip_offset:
+                    return None  # Strip not written yet (sparse file).
+                if first_offset is None:
+                    first_offset = int(strip_offset)
+                expected = first_offset + band_index * self.rows * self.cols * dtype.itemsize + strip * strip_bytes
+                if int(strip_offset) != expected:
+                    return None
+        return first_offset, dtype, interleave
+
+    def read_block_by_coordinates(self, y0, y1, x0, x1, out: np.ndarray = None):
         """Get a block by image coordinates.
         Returns a RGB block.
         
@@ -123,102 +209,53 @@ class RasterData:
         :param y1: Y end.
         :param x0: X start.
         :param x1: X end.         
+        :param out: Optional (bands, rows, cols) buffer to read into (see allocate_block_buffer), the
+            returned block is a view of it.
         """
         # Make sure the params are ints otherwise gdal won't accept them.
         x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
         # Gdal takes offset and size instead of start and end, so we convert the parameters.
         x_size = x1 - x0
         y_size = y1 - y0
-        channels_count = range(self.n_channels)
-        channels_blocks = []
-        for item in channels_count:
-            channel = self.gdal_dataset.GetRasterBand(item + 1)
-            channels_blocks.append(channel.ReadAsArray(x0, y0, x_size, y_size))
-        return np.dstack(channels_blocks)
+        block_data = self._read_window(x0, y0, x_size, y_size, self._get_band_list(), out)
+        return np.moveaxis(block_data, 0, -1)
 
     def get_bbox_position_within_image(self, other_bbox: BBox, allow_partial: bool=False, allow_any_srs=False):
         """Claculate the position of a bbox within the image (in pixels).
 
-        Both must be in the same coordinate system.
+        Both must be in the same coordinate system. In rotated images the window covers the 4 corners of the bbox.
 
         :param other_bbox: Other bbox.
         :param allow_partial: Allows the function to return partial coverage, if not raises RuntimeError.
         """
         this_bbox = self.get_bbox()
-        pixel_size = self.pixel_size
-
-        # Create SRS for comparison.
-        this_srs, other_srs = osr.SpatialReference(), osr.SpatialReference()
-        this_srs.ImportFromWkt(this_bbox.wkt_srs)
-        other_srs.ImportFromWkt(other_bbox.wkt_srs)
-
-        if not this_srs.IsSame(other_srs) and not allow_any_srs:
+        if not allow_any_srs and not is_same_srs(this_bbox.wkt_srs, other_bbox.wkt_srs):
             raise RuntimeError("Must be in the same SRS.")
 
+        # The pixel window of the 4 corners, in case the image is rotated.
+        cols, rows = self.geotransform.inverse((other_bbox.xmin, other_bbox.xmax, other_bbox.xmin, other_bbox.xmax),
+                                               (other_bbox.ymin, other_bbox.ymin, other_bbox.ymax, other_bbox.ymax))
+        col_min, col_max, row_min, row_max = cols.min(), cols.max(), rows.min(), rows.max()
+
         # Detect out of bounds:
-        out_of_bounds = False
-        if other_bbox.xmax <= this_bbox.xmin:
-            out_of_bounds = True
-        elif other_bbox.xmin >= this_bbox.xmax:
-            out_of_bounds = True
-        elif other_bbox.ymax <= this_bbox.ymin:
-            out_of_bounds = True
-        elif other_bbox.ymin >= this_bbox.ymax:
-            out_of_bounds = True
-        if out_of_bounds:
+        if col_max <= 0 or col_min >= self.cols or row_max <= 0 or row_min >= self.rows:
             raise RuntimeError("Bbox totaly out of bounds.")
 
         # Situations where the other bbox is partially covering this bbox.
-        origin_y, origin_x = None, None
-        displacement_h, displacement_v = None, None
-        patial = False
-        
-        obb_ymax = other_bbox.ymax
-        obb_ymin = other_bbox.ymin
-        obb_xmax = other_bbox.xmax
-        obb_xmin = other_bbox.xmin
-        
-        if obb_ymax > this_bbox.ymax:
-            obb_ymax = this_bbox.ymax
-            origin_y = this_bbox.ymax
-            displacement_v = 0
-            patial = True
-        if obb_ymin < this_bbox.ymin:
-            obb_ymin = this_bbox.ymin
-            patial = True
-        if obb_xmax > this_bbox.xmax:
-            obb_xmax = this_bbox.xmax
-            patial = True
-        if obb_xmin < this_bbox.xmin:
-            obb_xmin = this_bbox.xmin
-            origin_x = this_bbox.xmin
-            displacement_h = 0
-            patial = True
-
-        if patial and not allow_partial:
+        partial = col_min < 0 or row_min < 0 or col_max > self.cols or row_max > self.rows
+        if partial and not allow_partial:
             raise RuntimeError("Other bbox partially out of the image extent, you may use allow_partial=True.")
+        col_min, col_max = max(col_min, 0), min(col_max, self.cols)
+        row_min, row_max = max(row_min, 0), min(row_max, self.rows)
 
         # Como a imagem tem origem no topo esquerdo, o deslocamento deve ser da esquerda e do topo:
         # floor é usado para que sobre parte de um pixel para cima e para a esquerda, em vez de faltar.
-        # Isso é aplicado apenas quando a área de interesse não excede as bordas.
-        if displacement_h is None:
-            displacement_h = int((obb_xmin - this_bbox.xmin) / pixel_size)
-        if displacement_v is None:
-            displacement_v = int((this_bbox.ymax - obb_ymax) / pixel_size)
-
-        # Como é feito este mini deslocamento, passamos a usar estas novas coordenadas como
-        # coordenadas de origem do pedaço (apenas quando o pedaço ainda não foi determinado):
-        if origin_x is None:
-            origin_x = this_bbox.xmin + displacement_h * pixel_size
-        if origin_y is None:
-            origin_y = this_bbox.ymax - displacement_v * pixel_size  # no topo esquerdo, invertido.
-        # (lembre-se que a o sistema de referência (SR) da imagem tem origem no canto superior esquerdo e o geográfico
-        # no canto inferior esquerdo.
-
-        block_width = int((obb_xmax - origin_x) / pixel_size) - 1  # FIXME: -1 Mágico.
-        block_height = int((origin_y - obb_ymin) / pixel_size)
-
-        # origem_y = origem_y - altura_px_pedaco * tamanho_pixel  # no topo esquedo, correto.
+        displacement_h, displacement_v = int(np.floor(col_min)), int(np.floor(row_min))
+        # Passamos a usar o canto deste pixel como origem do pedaço.
+        origin_x, origin_y = (float(value) for value in self.geotransform.forward(displacement_h, displacement_v))
+
+        block_width = int(col_max - displacement_h) - 1  # FIXME: -1 Mágico.
+        block_height = int(row_max - displacement_v)
 
         #        0 dish,          1disv,        2 width,     3 heigth,     4 orx,     5ory
         return displacement_h, displacement_v, block_width, block_height, origin_x, origin_y
@@ -228,17 +265,54 @@ class RasterData:
         Returns a RGB block.
         The mission here is to tranform meters in pixel coordinates that can be accepted by read_block_by_coordinates.
         """
-        ox, oy = self.origem
-        res = self.pixel_size
-        coords = [round((oy - yu1) / res),  # y0
-                  round((oy - yu0) / res),  # y1
-                  round((xu0 - ox) / res),  # x0
-                  round((xu1 - ox) / res),  # x1
-                  ]
-        # Debug:
-        # ty = coords[1] - coords[0]
-        # tx = coords[3] - coords[2]
-        return self.read_block_by_coordinates(*coords)
+        # The window covers the 4 corners, in case the image is rotated.
+        cols, rows = self.geotransform.inverse((xu0, xu1, xu0, xu1), (yu0, yu0, yu1, yu1))
+        cols, rows = np.round(cols).astype(np.int64), np.round(rows).astype(np.int64)
+        return self.read_block_by_coordinates(rows.min(), rows.max(), cols.min(), cols.max())
+
+    def sample_points(self, xs, ys, bands: Sequence[int] = None, srs: Union[osr.SpatialReference, int, str] = None,
+                      fill_value=0) -> np.ndarray:
+        """Values of the pixels under many points, reading each block that has points only once.
+
+        The points are grouped by block and the values are taken from the block with fancy indexing.
+
+        :param xs: X coordinates of the points.
+        :param ys: Y coordinates of the points.
+        :param bands: The bands to sample, defaults to all bands.
+        :param srs: SRS of the points, if different from the image the points are reprojected first.
+        :param fill_value: Value for the points outside the image.
+        :returns: Array (n points, n bands).
+        """
+        xs, ys = np.asarray(xs, dtype=np.float64).ravel(), np.asarray(ys, dtype=np.float64).ravel()
+        if xs.shape != ys.shape:
+            raise ValueError("xs and ys must have the same size.")
+        if srs is not None and len(xs):
+            transform = get_osr_transform(srs, self.wkt_srs)
+            points = np.asarray(transform.TransformPoints(np.column_stack((xs, ys)).tolist()))
+            xs, ys = points[:, 0], points[:, 1]
+
+        band_list = self._get_band_list(bands)
+        values = np.full((len(xs), len(band_list)), fill_value, dtype=self.get_numpy_dtype(band_list[0]))
+        cols, rows = self.geotransform.inverse(xs, ys)
+        cols, rows = np.floor(cols), np.floor(rows)
+        inside = np.flatnonzero((cols >= 0) & (cols < self.cols) & (rows >= 0) & (rows < self.rows))
+        if not len(inside):
+            return values
+        cols, rows = cols[inside].astype(np.int64), rows[inside].astype(np.int64)
+
+        grid = self.block_grid
+        point_blocks = grid.index_of(rows // grid.block_height, cols // grid.block_width)
+        sort = np.argsort(point_blocks, kind="stable")
+        # Limits of the runs of points of the same block.
+        limits = np.flatnonzero(np.diff(point_blocks[sort])) + 1
+        buffer = self.allocate_block_buffer(band_list, values.dtype)
+        for group in np.split(sort, limits):
+            block = grid.blocks[point_blocks[group[0]]]
+            # Python ints for the gdal bindings, not numpy scalars.
+            xoff, yoff, width, height = (int(block[name]) for name in ("xoff", "yoff", "width", "height"))
+            block_data = self._read_window(xoff, yoff, width, height, band_list, out=buffer)
+            values[inside[group]] = block_data[:, rows[group] - yoff, cols[group] - xoff].T
+        return values
 
     # noinspection PyTypeChecker
     @property
@@ -255,11 +329,24 @@ class RasterData:
             self._block_list = self._create_blocks_list()
         return self._block_list
 
+    @property
+    def block_grid(self) -> BlockGrid:
+        """Lazy property with the grid of blocks, shared by block_list and the block coordinates methods."""
+        if self._block_grid is None:
+            self._block_grid = BlockGrid(self.rows, self.cols, self.block_size)
+        return self._block_grid
+
+    @property
+    def geotransform(self) -> GeoTransform:
+        """Lazy property with the affine transform between pixel and world coordinates."""
+        if self._geotransform is None:
+            self._geotransform = GeoTransform(self.gdal_dataset.GetGeoTransform())
+        return self._geotransform
+
     def get_bbox(self):
         """Pega o bbox da imagem."""
-        xmax = self.origem[0] + self.cols * self.pixel_size
-        ymin = self.origem[1] - self.rows * self.pixel_size
-        return BBox(self.origem[0], ymin, xmax, self.origem[1], wkt_srs=self.wkt_srs)
+        xs, ys = self.geotransform.forward((0, self.cols, 0, self.cols), (0, 0, self.rows, self.rows))
+        return BBox(xs.min(), ys.min(), xs.max(), ys.max(), wkt_srs=self.wkt_srs)
 
     def _load_metadata(self):
         """Lê meta informações do arquivo."""
@@ -293,32 +380,7 @@ class RasterData:
 
     def _create_blocks_list(self):
         """Cretes a list of block reading coordinates."""
-        blk_width, blk_height = self.block_size
-
-        # Get the number of blocks.
-        x_blocks = int((self.cols + blk_width - 1) / blk_width)
-        y_blocks = int((self.rows + blk_height - 1) / blk_height)
-        # print("Creating blocks list with {} blocks ({} x {}).".format(
-        #     x_blocks * y_blocks, x_blocks, y_blocks))
-
-        blocks_list = []
-        for block_column in range(0, x_blocks):
-            # Recalculate the shape of the rightmost block.
-            if block_column == x_blocks - 1:
-                valid_x = self.cols - block_column * blk_width
-            else:
-                valid_x = blk_width
-            xoff = block_column * blk_width
-            # loop through Y lines
-            for block_row in range(0, y_blocks):
-                # Recalculate the shape of the final block.
-                if block_row == y_blocks - 1:
-                    valid_y = self.rows - block_row * blk_height
-                else:
-                    valid_y = blk_height
-                yoff = block_row * blk_height
-                blocks_list.append((xoff, yoff, valid_x, valid_y))
-        return blocks_list
+        return self.block_grid.as_list()
 
     def get_blocks_array_indices(self) -> List:
         """Create a list of array indices (i, j) for the first two dimensions of an array.
@@ -328,49 +390,385 @@ class RasterData:
         
         :returns: A list of indices (e.g. [[i0, j0], [i1, j1], [in, jn], ...])
         """
-        # TODO: Make a lazy property.
-        array = self.get_blocks_positions_coordinates()
-        shape = array.shape
-        indices = []
-        for irow in range(shape[0]):
-            for icol in range(shape[1]):
-                indices.append((irow, icol))
-        return indices
+        return list(map(tuple, self.block_grid.array_indices().tolist()))
+
+    def get_block_indices(self, order: str = None) -> Sequence[int]:
+        """The indices of block_list in an iteration order.
+
+        :param order: One of BLOCK_ORDERS, None keeps the order of block_list (BLOCK_ORDER_COLUMN).
+        """
+        if order is None:
+            return range(len(self.block_list))
+        return self.block_grid.order(order)
 
-    def get_iterator(self, banda: int = 1) -> Iterator:
+    def get_iterator(self, banda: int = 1, order: str = None) -> Iterator:
         """Retorna um iterator sobre a imagem, retornando um pedaço do
         tamanho do block size a cada passo.
         
         Notar que os blocos são enviados em ordem diferente do numpy.
+        Para imagens em strips, BLOCK_ORDER_ROW segue a ordem de armazenamento do arquivo. Ao escrever
+        os blocos use write_block com os índices de get_block_indices(order).
 
         :param banda: Banda da imagem para gerar o iterator.
+        :param order: Ordem dos blocos, um de BLOCK_ORDERS (padrão: a ordem de block_list).
         """
         blocks_list = self.block_list
         src_band = self.gdal_dataset.GetRasterBand(banda)
-        for block in blocks_list:
+        for block_index in self.get_block_indices(order):
             # print("Block from list: {}".format(block))
-            block_data = src_band.ReadAsArray(*block)
+            block_data = src_band.ReadAsArray(*blocks_list[block_index])
             yield block_data
 
+    def read_block_into(self, block_index: int, out: np.ndarray, banda: Union[int, Sequence[int]] = 1) -> np.ndarray:
+        """Reads a block of block_list into a preallocated array, without allocating a new one.
+        Returns the view of out with the block data (a slice for the smaller edge blocks).
+
+        :param block_index: Index of the block in block_list.
+        :param out: Array (rows, cols) for a single band or (bands, rows, cols) for a sequence of bands,
+            at least the size of the block.
+        :param banda: A band or a sequence of bands.
+        """
+        xoff, yoff, width, height = self.block_list[block_index]
+        if not isinstance(banda, int):
+            return self._read_window(xoff, yoff, width, height, self._get_band_list(banda), out)
+        if out.ndim != 2 or out.shape[0] < height or out.shape[1] < width:
+            raise ValueError("Buffer of shape {} too small for the block.".format(out.shape))
+        block_data = out[:height, :width]
+        self.gdal_dataset.GetRasterBand(banda).ReadAsArray(xoff, yoff, width, height, buf_obj=block_data)
+        return block_data
+
+    def get_buffered_iterator(self, banda: Union[int, Sequence[int]] = 1, out: np.ndarray = None,
+                              pool_size: int = 2, order: str = None) -> Iterator[np.ndarray]:
+        """Like get_iterator, but the blocks are read into reused arrays instead of new ones.
+
+        The blocks yielded are views and are overwritten later: with a caller supplied out on the next
+        step, with the internal pool after pool_size steps.
+
+        :param banda: A band or a sequence of bands, see read_block_into.
+        :param out: A caller supplied array for all the blocks.
+        :param pool_size: Number of arrays in the pool when out is not given.
+        :param order: Order of the blocks, see get_block_indices.
+        """
+        if out is not None:
+            buffers = repeat(out)
+        else:
+            blk_width, blk_height = self.block_size
+            if isinstance(banda, int):
+                shape, dtype = (blk_height, blk_width), self.get_numpy_dtype(banda)
+            else:
+                shape, dtype = (len(banda), blk_height, blk_width), self.get_numpy_dtype(banda[0])
+            buffers = BufferPool(shape, dtype, pool_size)
+        for block_index in self.get_block_indices(order):
+            yield self.read_block_into(block_index, next(buffers), banda)
+
     def get_rgb_iterator(self, stack: bool = True) -> Iterator:
         """Retorna um iterator sobre os 3 canais (RGB)
         
         :param stack: Empilha os canais em uma matriz (w, h, 3).
         """
-        # FIXME: Em vez de repetir o código, apenas chamar o get iterator para cada banda.
-        blocks_list = self.block_list
-        red_channel = self.gdal_dataset.GetRasterBand(1)
-        green_channel = self.gdal_dataset.GetRasterBand(2)
-        blue_channel = self.gdal_dataset.GetRasterBand(3)
-
-        for block in blocks_list:
-            red_block_data = red_channel.ReadAsArray(*block)
-            green_block_data = green_channel.ReadAsArray(*block)
-            blue_block_data = blue_channel.ReadAsArray(*block)
-            if stack:
-                yield np.dstack((red_block_data, green_block_data, blue_block_data))
+        if stack:
+            yield from self.get_bands_iterator((1, 2, 3), interleave=INTERLEAVE_PIXEL)
+        else:
+            for block_data in self.get_bands_iterator((1, 2, 3)):
+                yield block_data[0], block_data[1], block_data[2]
+
+    def get_bands_iterator(self, bands: Sequence[int] = None, interleave: str = INTERLEAVE_BAND,
+                           out: np.ndarray = None, order: str = None) -> Iterator[np.ndarray]:
+        """Iterates over the blocks of block_list reading all the bands in a single gdal call per block.
+
+        With INTERLEAVE_PIXEL the (rows, cols, bands) array is a view of the data read, no copy is made.
+
+        :param bands: The bands to read (starting from 1), defaults to all bands.
+        :param interleave: INTERLEAVE_BAND for (bands, rows, cols) or INTERLEAVE_PIXEL for (rows, cols, bands).
+        :param out: A buffer reused for every block (see allocate_block_buffer), the blocks yielded
+            are views of it and are overwritten on the next step. Edge blocks are slices of the buffer.
+        :param order: Order of the blocks, see get_block_indices.
+        """
+        if interleave not in (INTERLEAVE_BAND, INTERLEAVE_PIXEL):
+            raise ValueError("Invalid interleave: {}.".format(interleave))
+        band_list = self._get_band_list(bands)
+        for block_index in self.get_block_indices(order):
+            block_data = self._read_window(*self.block_list[block_index], band_list=band_list, out=out)
+            if interleave == INTERLEAVE_PIXEL:
+                block_data = np.moveaxis(block_data, 0, -1)
+            yield block_data
+
+    def get_halo_iterator(self, halo: int, bands: Sequence[int] = None, order: str = None,
+                          out: np.ndarray = None) -> Iterator[Tuple[int, np.ndarray]]:
+        """Iterates over the blocks of block_list with an extra border of halo pixels taken from the
+        neighbour blocks, for neighbourhood operations (convolutions, CNN inference, ...).
+
+        Each block and its halo are read with a single gdal call into a padded buffer, the parts of
+        the halo outside the image are filled by mirroring, in place.
+        Write the results back with write_block(..., halo=halo) to crop the halo off.
+
+        :param halo: The size of the border in pixels.
+        :param bands: The bands to read (starting from 1), defaults to all bands.
+        :param order: Order of the blocks, see get_block_indices.
+        :param out: A buffer (bands, block rows + 2 * halo, block cols + 2 * halo) reused for every block,
+            one is allocated if not given. The blocks yielded are views of it.
+        :returns: Pairs (block index, padded block (bands, rows + 2 * halo, cols + 2 * halo)).
+        """
+        if halo < 0:
+            raise ValueError("halo must be >= 0.")
+        band_list = self._get_band_list(bands)
+        if out is None:
+            blk_width, blk_height = self.block_size
+            out = np.empty((len(band_list), blk_height + 2 * halo, blk_width + 2 * halo),
+                           dtype=self.get_numpy_dtype(band_list[0]))
+
+        for block_index in self.get_block_indices(order):
+            xoff, yoff, width, height = self.block_list[block_index]
+            # Parts of the halo outside the image.
+            top, left = max(halo - yoff, 0), max(halo - xoff, 0)
+            bottom = max(yoff + height + halo - self.rows, 0)
+            right = max(xoff + width + halo - self.cols, 0)
+            padded = out[:len(band_list), :height + 2 * halo, :width + 2 * halo]
+            self._read_window(xoff - halo + left, yoff - halo + top,
+                              width + 2 * halo - left - right, height + 2 * halo - top - bottom,
+                              band_list, out=padded[:, top:, left:])
+            yield block_index, mirror_halo(padded, top, bottom, left, right)
+
+    def prefetch(self, depth: int = 2, workers: int = 1, bands: Union[int, Sequence[int]] = 1,
+                 order: str = None) -> BlockPrefetcher:
+        """Iterates over the blocks reading the next ones in background threads while the current
+        block is processed. Yields pairs (block index, block data), see BlockPrefetcher.
+
+        The stats attribute of the returned object has the time spent waiting for I/O and consuming.
+
+        :param depth: Number of blocks read ahead.
+        :param workers: Number of reading threads.
+        :param bands: A band (rows, cols) or a sequence of bands (bands, rows, cols).
+        :param order: Order of the blocks, see get_block_indices.
+        """
+        return BlockPrefetcher(self, depth, workers, bands, order)
+
+    def aiter_blocks(self, depth: int = 2, workers: int = 1, bands: Union[int, Sequence[int]] = 1,
+                     order: str = None) -> AsyncBlockPrefetcher:
+        """Asyncio version of prefetch: async for block_index, block_data in raster.aiter_blocks()."""
+        return AsyncBlockPrefetcher(self, depth, workers, bands, order)
+
+    def allocate_block_buffer(self, bands: Sequence[int] = None, dtype=None) -> np.ndarray:
+        """Creates an array (bands, rows, cols) big enough for any block of this raster.
+
+        :param bands: The bands the buffer is for, defaults to all bands.
+        :param dtype: Numpy dtype, defaults to the type of the first band.
+        """
+        band_list = self._get_band_list(bands)
+        if dtype is None:
+            dtype = self.get_numpy_dtype(band_list[0])
+        blk_width, blk_height = self.block_size
+        return np.empty((len(band_list), blk_height, blk_width), dtype=dtype)
+
+    def get_numpy_dtype(self, banda: int = 1):
+        """The numpy type equivalent to the gdal data type of a band."""
+        return gdal_array.GDALTypeCodeToNumericTypeCode(self.gdal_dataset.GetRasterBand(banda).DataType)
+
+    def _get_band_list(self, bands: Sequence[int] = None) -> List[int]:
+        if bands is None:
+            return list(range(1, self.n_channels + 1))
+        band_list = [int(band) for band in bands]
+        if not band_list or min(band_list) < 1 or max(band_list) > self.n_channels:
+            raise ValueError("Invalid bands: {}.".format(bands))
+        return band_list
+
+    def _read_window(self, xoff: int, yoff: int, width: int, height: int, band_list: List[int],
+                     out: np.ndarray = None) -> np.ndarray:
+        """Reads a window of several bands with a single gdal call, returns (bands, rows, cols).
+
+        If out is given the data is read into the upper left corner of it and a view is returned.
+        """
+        if out is not None:
+            if out.ndim != 3 or out.shape[0] < len(band_list) or out.shape[1] < height or out.shape[2] < width:
+                raise ValueError("Buffer of shape {} too small for the window.".format(out.shape))
+            out = out[:len(band_list), :height, :width]
+
+        if self._memmap is not None:
+            if band_list == list(range(1, self.n_channels + 1)):
+                data = self._memmap[:, yoff:yoff + height, xoff:xoff + width]
             else:
-                yield red_block_data, green_block_data, blue_block_data
+                data = self._memmap[np.asarray(band_list) - 1, yoff:yoff + height, xoff:xoff + width]
+            if out is None:
+                return data
+            np.copyto(out, data)
+            return out
+
+        if self._block_cache is not None:
+            return self._read_cached_window(xoff, yoff, width, height, band_list, out)
+
+        if out is None:
+            data = self.gdal_dataset.ReadAsArray(xoff, yoff, width, height, band_list=band_list)
+            if data.ndim == 2:
+                data = data[np.newaxis]
+            return data
+        self.gdal_dataset.ReadAsArray(xoff, yoff, width, height, buf_obj=out, band_list=band_list)
+        return out
+
+    def enable_block_cache(self, max_bytes: int = 256 * 1024 * 1024):
+        """Keeps the blocks read in a LRU cache, windows are assembled from the cached blocks.
+
+        Useful for random access with overlapping windows (sample_points, patch extraction). The
+        counters are in block_cache_stats. The parallel workers do not use the cache.
+
+        :param max_bytes: Maximum size of the cache in bytes.
+        """
+        self._block_cache = BlockCache(max_bytes)
+
+    def disable_block_cache(self):
+        self._block_cache = None
+
+    @property
+    def block_cache_stats(self) -> Union[Dict, None]:
+        """Hits, misses, evictions and size of the block cache, None if it is not enabled."""
+        if self._block_cache is None:
+            return None
+        return self._block_cache.stats()
+
+    def _window_block_indices(self, xoff: int, yoff: int, width: int, height: int) -> np.ndarray:
+        """Indices (in block_list) of the blocks touched by a window."""
+        if xoff < 0 or yoff < 0 or width < 1 or height < 1 or xoff + width > self.cols or yoff + height > self.rows:
+            raise ValueError("Window ({}, {}, {}, {}) outside the image.".format(xoff, yoff, width, height))
+        grid = self.block_grid
+        rows = np.arange(yoff // grid.block_height, (yoff + height - 1) // grid.block_height + 1)
+        cols = np.arange(xoff // grid.block_width, (xoff + width - 1) // grid.block_width + 1)
+        return grid.index_of(rows, cols[:, np.newaxis]).ravel()
+
+    def _read_cached_window(self, xoff: int, yoff: int, width: int, height: int, band_list: List[int],
+                            out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((len(band_list), height, width), dtype=self.get_numpy_dtype(band_list[0]))
+        for block_index in self._window_block_indices(xoff, yoff, width, height).tolist():
+            blk_x, blk_y, blk_width, blk_height = self.block_list[block_index]
+            x0, x1 = max(xoff, blk_x), min(xoff + width, blk_x + blk_width)
+            y0, y1 = max(yoff, blk_y), min(yoff + height, blk_y + blk_height)
+            for i, band in enumerate(band_list):
+                block_data = self._block_cache.get((band, block_index), partial(self._read_native_block, band,
+                                                                                 block_index))
+                out[i, y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = block_data[y0 - blk_y:y1 - blk_y,
+                                                                              x0 - blk_x:x1 - blk_x]
+        return out
+
+    def _read_native_block(self, band: int, block_index: int) -> np.ndarray:
+        return self.gdal_dataset.GetRasterBand(band).ReadAsArray(*self.block_list[block_index])
+
+    def _invalidate_cached_window(self, xoff: int, yoff: int, width: int, height: int, channel: int):
+        block_indices = self._window_block_indices(xoff, yoff, width, height)
+        self._block_cache.invalidate((channel, block_index) for block_index in block_indices.tolist())
+
+    @property
+    def dataset_source(self) -> DatasetSource:
+        """The source used by parallel workers to read this raster with their own dataset handles.
+
+        The workers reopen the file, so the data written to this dataset and not flushed yet is flushed first.
+        """
+        if self.src_image is not None:
+            if self.write_enabled:
+                self.gdal_dataset.FlushCache()
+            return DatasetSource(src_image=self.src_image)
+        return DatasetSource(dataset=self.gdal_dataset)
+
+    def map_blocks(self, func: Callable[[np.ndarray], np.ndarray], out: Union[str, 'RasterData'] = None,
+                   banda: int = 1, workers: int = 1, backend: str = BACKEND_THREAD, ordered: bool = True,
+                   max_in_flight: int = None, out_bands: int = 1, data_type: int = None,
+                   order: str = None) -> 'RasterData':
+        """Applies func to every block of a band and writes the results to another raster.
+
+        Blocks are read by the workers, each one with its own dataset handle, and the results are
+        written by the calling thread as they are completed.
+
+        :param func: Receives the block data (rows, cols) and returns an array of the same shape, or
+            (bands, rows, cols) to write several bands. Must be picklable for the process backend.
+        :param out: The output RasterData or the path for a new one created with clone_empty.
+        :param banda: Band to read.
+        :param workers: Number of workers, 1 runs in the calling thread.
+        :param backend: BACKEND_THREAD or BACKEND_PROCESS.
+        :param ordered: Write the blocks in the order they are read, otherwise as they complete.
+        :param max_in_flight: Maximum number of blocks read and not written yet, defaults to 2 * workers.
+        :param out_bands: Number of bands when creating the output.
+        :param data_type: Gdal data type when creating the output, defaults to the type of the band.
+        :param order: Order the blocks are read, see get_block_indices.
+        :returns: The output RasterData.
+        """
+        if out is None:
+            raise ValueError("Must provide an output RasterData or file name.")
+        if isinstance(out, str):
+            if data_type is None:
+                data_type = self.gdal_dataset.GetRasterBand(banda).DataType
+            out = self.clone_empty(out, bandas=out_bands, data_type=data_type)
+        elif not out.write_enabled:
+            raise ValueError("The output RasterData must be write enabled.")
+
+        task = partial(read_and_apply, self.dataset_source, func, banda)
+        items = ((block_index, self.block_list[block_index]) for block_index in self.get_block_indices(order))
+        results = run_tasks(task, items, workers=workers, backend=backend,
+                            ordered=ordered, max_in_flight=max_in_flight)
+        # The results are written at the position of the source blocks, the output may have other blocks.
+        with out.writer() as writer:
+            for (_, block), result in results:
+                if result.ndim == 3:
+                    for channel, band_data in enumerate(result):
+                        writer.write_window(band_data, block[0], block[1], channel + 1)
+                else:
+                    writer.write_window(result, block[0], block[1])
+        return out
+
+    def statistics(self, banda: int = 1, workers: int = 1, backend: str = BACKEND_THREAD) -> Dict:
+        """Count, min, max, sum, mean and std of a band, computed block by block with constant memory.
+        Same results of the numpy functions on read_all(), std with ddof=0.
+
+        :param banda: The band.
+        :param workers: Number of workers, see map_blocks.
+        :param backend: BACKEND_THREAD or BACKEND_PROCESS.
+        """
+        return self._reduce_blocks(RunningStats, banda, workers, backend).as_dict()
+
+    def histogram(self, bins: int = 256, value_range: Tuple[float, float] = None, banda: int = 1,
+                  workers: int = 1, backend: str = BACKEND_THREAD) -> Tuple[np.ndarray, np.ndarray]:
+        """Histogram of a band computed block by block, the same as np.histogram(band, bins, value_range).
+
+        :param bins: Number of bins.
+        :param value_range: (min, max) of the bins, defaults to the band min and max (an extra pass).
+        :returns: The counts and the bin edges.
+        """
+        if value_range is None:
+            band_stats = self.statistics(banda, workers, backend)
+            value_range = (band_stats["min"], band_stats["max"])
+        histogram = self._reduce_blocks(partial(StreamingHistogram, bins, value_range), banda, workers, backend)
+        return histogram.counts, histogram.edges
+
+    def percentiles(self, q: Sequence[float], banda: int = 1, bins: int = 65536, workers: int = 1,
+                    backend: str = BACKEND_THREAD) -> np.ndarray:
+        """Percentiles of a band computed block by block (two passes).
+
+        Exact (like np.percentile) for integer bands with up to bins distinct values between min and max,
+        otherwise approximated by a histogram with bins bins, the error is below the bin width.
+
+        :param q: Percentiles, between 0 and 100.
+        :param bins: Resolution of the approximation.
+        """
+        band_stats = self.statistics(banda, workers, backend)
+        minimum, maximum = band_stats["min"], band_stats["max"]
+        if np.issubdtype(self.get_numpy_dtype(banda), np.integer) and maximum - minimum < bins:
+            counter = self._reduce_blocks(partial(IntegerCounter, minimum, maximum), banda, workers, backend)
+            values = np.arange(counter.minimum, counter.minimum + len(counter.counts))
+            return percentiles_from_counts(counter.counts, values, q)
+        histogram = self._reduce_blocks(partial(StreamingHistogram, bins, (minimum, maximum)), banda, workers, backend)
+        centers = (histogram.edges[:-1] + histogram.edges[1:]) / 2
+        return np.clip(percentiles_from_counts(histogram.counts, centers, q), minimum, maximum)
+
+    def class_counts(self, banda: int = 1, workers: int = 1, backend: str = BACKEND_THREAD) -> Dict:
+        """Number of pixels of each value of a band (e.g. a classification), computed block by block."""
+        return self._reduce_blocks(ClassCounter, banda, workers, backend).counts
+
+    def _reduce_blocks(self, factory: Callable, banda: int, workers: int, backend: str):
+        """Accumulates every block of a band with an accumulator created by factory (see block_stats)."""
+        task = partial(read_and_apply, self.dataset_source, partial(accumulate, factory), banda)
+        block_indices = self.get_block_indices(BLOCK_ORDER_ROW)
+        items = ((block_index, self.block_list[block_index]) for block_index in block_indices)
+        total = factory()
+        for _, accumulator in run_tasks(task, items, workers=workers, backend=backend, ordered=False):
+            total.merge(accumulator)
+        return total
 
     def clone_empty(self, new_img_file: str, bandas: int = 0, data_type=gdal.GDT_Byte, bits=None) -> 'RasterData':
         """Cria uma nova imagem RasterData com as mesmas características desta imagem,
@@ -427,61 +825,66 @@ class RasterData:
 
         Coordinates are: y0, y1, x0, x1
         """
-        # TODO: Make a lazy property.
-        # Quantos blocos inteiros cabem, quantos pixels sobram
-        n_block_rows, resto_pixel_rows = divmod(self.rows, self.block_size[0])
-        n_block_cols, resto_pixel_cols = divmod(self.cols, self.block_size[1])
-        # Caso haja um pedaço sobrando do final, inclui mais um bloco.
-        if resto_pixel_rows != 0:
-            n_block_rows += 1
-        if resto_pixel_cols != 0:
-            n_block_cols += 1
-        # Primeiro, cria a matriz de escrita, o bloco tem o tamanho do blk_size.
-        coord_array = np.empty((n_block_rows, n_block_cols, 4), dtype=np.uint16)
-        for row_index in range(n_block_rows):
-            y0 = row_index * self.block_size[0]
-            if row_index + 1 == n_block_rows:  # Last row.
-                y1 = self.rows
-            else:
-                y1 = self.block_size[0] * (row_index + 1)
-
-            for col_index in range(n_block_cols):
-                x0 = col_index * self.block_size[1]
-                if col_index + 1 == n_block_cols:  # Last column.
-                    x1 = self.cols
-                else:
-                    x1 = self.block_size[1] * (col_index + 1)
-                coord_array[row_index][col_index] = [y0, y1, x0, x1]
-        return coord_array
+        return self.block_grid.positions_coordinates()
 
     def get_block_pixel_coordinates(self, block_index: int) -> np.ndarray:
         """Retorna uma matriz com as coordenadas geográficas dos pixels do bloco.
+        A matriz tem o formato (2, largura, altura): coordenadas x e y do canto superior esquerdo de cada pixel.
 
         :param block_index: 
         """
         block_position = self.block_list[block_index]
-        block_coords = np.empty(self.block_indices.shape)
-        for eixo in range(self.block_indices.shape[0]):
-            coords = self.block_indices[eixo] * self.pixel_size + self.origem[eixo] + \
-                     block_position[eixo] * self.pixel_size
-            block_coords[eixo] = coords
-        return block_coords
-
-    def write_block(self, data_array: np.ndarray, block_index: int, channel: int = 1):
+        xs, ys = self.geotransform.forward(self.block_indices[0] + block_position[0],
+                                           self.block_indices[1] + block_position[1])
+        return np.stack((xs, ys))
+
+    def write_block(self, data_array: np.ndarray, block_index: int, channel: int = 1, flush: bool = True,
+                    halo: int = 0):
         """Escreve um bloco de dados em uma banda.
 
+        For many blocks prefer a writer() session, flushing after every block is slow.
+
         :param channel: 
         :param data_array: 
-        :param block_index: O índice do bloco para escrever.
+        :param block_index: O índice do bloco em block_list, como dado pelos iterators.
+        :param flush: Flush the dataset cache to the disk after writing.
+        :param halo: Size of the border around data_array to crop off, as given by get_halo_iterator.
         """
         block_position = self.block_list[block_index]
-        self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array, block_position[0], block_position[1])
-        self.gdal_dataset.FlushCache()
+        if halo:
+            data_array = data_array[..., halo:data_array.shape[-2] - halo, halo:data_array.shape[-1] - halo]
+        self.write_window(data_array, block_position[0], block_position[1], channel, flush)
+
+    def write_window(self, data_array: np.ndarray, xoff: int, yoff: int, channel: int = 1, flush: bool = True):
+        """Writes an array to a band at a position in pixels.
+
+        :param data_array: The data (rows, cols).
+        :param xoff: Column of the upper left pixel.
+        :param yoff: Row of the upper left pixel.
+        :param channel: The band.
+        :param flush: Flush the dataset cache to the disk after writing.
+        """
+        self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array, int(xoff), int(yoff))
+        if self._block_cache is not None:
+            self._invalidate_cached_window(int(xoff), int(yoff), data_array.shape[-1], data_array.shape[-2], channel)
+        if flush:
+            self.gdal_dataset.FlushCache()
 
-    def write_all(self, data_array: np.ndarray, channel: int = 1):
+    def write_all(self, data_array: np.ndarray, channel: int = 1, flush: bool = True):
         """Write an array to the image starting from the first position."""
         self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array)
-        self.gdal_dataset.FlushCache()
+        if self._block_cache is not None:
+            self._invalidate_cached_window(0, 0, data_array.shape[-1], data_array.shape[-2], channel)
+        if flush:
+            self.gdal_dataset.FlushCache()
+
+    def writer(self, flush_bytes: int = DEFAULT_FLUSH_BYTES, flush_interval: float = None) -> RasterWriter:
+        """Starts a buffered write session, the dataset is flushed only on a size or time threshold and on close.
+
+        :param flush_bytes: Flush when the bytes written since the last flush reach this size. None disables it.
+        :param flush_interval: Flush when this time (seconds) has passed since the last flush. None disables it.
+        """
+        return RasterWriter(self, flush_bytes, flush_interval)
 
     def set_srs(self, srs: Union[osr.SpatialReference, int, str]):
         """Set the spatial reference system for this instance."""
@@ -0,0 +1,98 @@
+# Pablo Carreira - 18/10/26
+from typing import List, Sequence, Union
+
+import numpy as np
+
+DEFAULT_NODE_CAPACITY = 16
+
+
+class STRTree:
+    def __init__(self, envelopes: Union[np.ndarray, Sequence], ids: Union[np.ndarray, Sequence] = None,
+                 node_capacity: int = DEFAULT_NODE_CAPACITY):
+        """A static R-tree packed with the Sort-Tile-Recursive algorithm, built and queried with numpy.
+
+        The items are sorted in tiles so each node holds node_capacity neighbour items (or nodes of the
+        level below), the nodes of a level are contiguous: node i has the children
+        i * node_capacity to (i + 1) * node_capacity - 1.
+
+        :param envelopes: Array (N, 4) with xmin, ymin, xmax, ymax of each item.
+        :param ids: The id of each item (e.g. OGR FIDs) returned by the queries, defaults to 0..N-1.
+        :param node_capacity: Number of children per node.
+        """
+        envelopes = np.asarray(envelopes, dtype=np.float64).reshape((-1, 4))
+        if node_capacity < 2:
+            raise ValueError("node_capacity must be at least 2.")
+        self.node_capacity = node_capacity
+        self.envelopes = envelopes
+        self.ids = np.arange(len(envelopes), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if len(self.ids) != len(envelopes):
+            raise ValueError("ids and envelopes must have the same length.")
+
+        #: Position of the items in the leaves.
+        self.order = self._str_order(envelopes)
+        #: Bounds of the nodes of each level, from the leaves (the sorted items) to the root.
+        self.levels = [envelopes[self.order]]
+        while len(self.levels[-1]) > 1:
+            self.levels.append(self._pack(self.levels[-1]))
+
+    def __len__(self) -> int:
+        return len(self.envelopes)
+
+    def _str_order(self, envelopes: np.ndarray) -> np.ndarray:
+        """Sort-Tile-Recursive: slices by the x of the centers, each slice sorted by the y."""
+        n = len(envelopes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        n_leaves = -(-n // self.node_capacity)
+        n_slices = int(np.ceil(np.sqrt(n_leaves)))
+        slice_size = n_slices * self.node_capacity
+        cx = envelopes[:, 0] + envelopes[:, 2]
+        cy = envelopes[:, 1] + envelopes[:, 3]
+        by_x = np.argsort(cx, kind="stable")
+        slices = np.arange(n) // slice_size
+        # Sort by slice, then by the y inside the slice.
+        return by_x[np.lexsort((cy[by_x], slices))]
+
+    def _pack(self, bounds: np.ndarray) -> np.ndarray:
+        """Bounds of the parent nodes of contiguous groups of node_capacity children."""
+        starts = np.arange(0, len(bounds), self.node_capacity)
+        return np.column_stack((np.minimum.reduceat(bounds[:, 0], starts), np.minimum.reduceat(bounds[:, 1], starts),
+                                np.maximum.reduceat(bounds[:, 2], starts), np.maximum.reduceat(bounds[:, 3], starts)))
+
+    def query(self, bbox: Sequence[float]) -> np.ndarray:
+        """Ids of the items whose envelope intersects (or touches) bbox, sorted.
+
+        :param bbox: xmin, ymin, xmax, ymax (a BBox works too).
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        xmin, ymin, xmax, ymax = (float(value) for value in bbox)
+        candidates = np.zeros(1, dtype=np.int64)
+        for level in reversed(self.levels):
+            if level is not self.levels[-1]:
+                # Children of the candidate nodes.
+                starts = candidates * self.node_capacity
+                counts = np.minimum(starts + self.node_capacity, len(level)) - starts
+                offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+                candidates = np.arange(counts.sum()) + offsets
+            bounds = level[candidates]
+            hit = (bounds[:, 0] <= xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax) & (bounds[:, 3] >= ymin)
+            candidates = candidates[hit]
+            if not len(candidates):
+                break
+        return np.sort(self.ids[self.order[candidates]])
+
+    def query_many(self, bboxes: Union[np.ndarray, Sequence]) -> List[np.ndarray]:
+        """Ids of the items intersecting each box of an array (N, 4) (or a BBoxArray)."""
+        bounds = getattr(bboxes, "bounds", bboxes)
+        return [self.query(bbox) for bbox in np.asarray(bounds, dtype=np.float64).reshape((-1, 4))]
+
+    def save(self, file_name: str):
+        """Saves the envelopes and ids, the tree is packed again on load."""
+        with open(file_name, "wb") as npz_file:
+            np.savez(npz_file, envelopes=self.envelopes, ids=self.ids, node_capacity=self.node_capacity)
+
+    @classmethod
+    def load(cls, file_name: str) -> "STRTree":
+        with np.load(file_name) as data:
+            return cls(data["envelopes"], data["ids"], int(data["node_capacity"]))
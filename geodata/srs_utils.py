@@ -1,31 +1,100 @@
 # Pablo Carreira - 29/06/17
+import threading
+from functools import lru_cache
+
 from osgeo import osr, __version__
 
 from typing import Union
 
+GDAL_MAJOR_VERSION = int(__version__.split(".")[0])
+#: Maximum number of SRS, comparisons and transforms (per thread) kept in the caches.
+SRS_CACHE_SIZE = 256
+
+_clone_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+@lru_cache(maxsize=SRS_CACHE_SIZE)
+def _cached_srs(in_srs: Union[int, str], tradicional: bool) -> osr.SpatialReference:
+    """The parsed SRS shared by the registry, never handed out (only clones of it)."""
+    srs = osr.SpatialReference()
+    if isinstance(in_srs, int):
+        srs.ImportFromEPSG(in_srs)
+    else:
+        srs.ImportFromWkt(in_srs)
+    if GDAL_MAJOR_VERSION >= 3 and tradicional:
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def _srs_key(in_srs: Union[osr.SpatialReference, int, str]) -> Union[int, str]:
+    """The EPSG code or WKT that identifies a srs in the caches."""
+    if isinstance(in_srs, osr.SpatialReference):
+        return in_srs.ExportToWkt()
+    if isinstance(in_srs, (int, str)):
+        return in_srs
+    raise ValueError("Formato srs desconhecido.")
+
 
 def create_osr_srs(in_srs: Union[osr.SpatialReference, int, str], tradicional=True) -> osr.SpatialReference:
     """Creates an osr.SpatialReference object either from an EPSG code or a Wkt.
     If the srs is already an osr.SpatialReference, return a clone.
+
+    EPSG codes and WKTs are parsed only once, the result is a clone of the cached SRS and can be
+    modified freely.
     """
     if isinstance(in_srs, osr.SpatialReference):
         srs = in_srs.Clone()
-    elif isinstance(in_srs, int):
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(in_srs)
-    elif isinstance(in_srs, str):
-        srs = osr.SpatialReference()
-        srs.ImportFromWkt(in_srs)
-    else:
-        raise ValueError("Formato srs desconhecido.")
-    if int(__version__[0]) >= 3 and tradicional:
-        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-    return srs
+        if GDAL_MAJOR_VERSION >= 3 and tradicional:
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return srs
+    cached = _cached_srs(_srs_key(in_srs), tradicional)
+    with _clone_lock:
+        return cached.Clone()
+
+
+@lru_cache(maxsize=SRS_CACHE_SIZE)
+def srs_to_wkt(in_srs: Union[int, str]) -> str:
+    """The WKT exported by osr for an EPSG code or WKT, cached."""
+    with _clone_lock:
+        return _cached_srs(in_srs, True).ExportToWkt()
+
+
+def is_same_srs(srs_a: Union[osr.SpatialReference, int, str], srs_b: Union[osr.SpatialReference, int, str]) -> bool:
+    """Compares two srs with osr IsSame, the result is cached."""
+    return _is_same_srs(_srs_key(srs_a), _srs_key(srs_b))
+
+
+@lru_cache(maxsize=SRS_CACHE_SIZE)
+def _is_same_srs(key_a: Union[int, str], key_b: Union[int, str]) -> bool:
+    with _clone_lock:
+        return bool(_cached_srs(key_a, True).IsSame(_cached_srs(key_b, True)))
+
+
+def get_osr_transform(src_srs: Union[osr.SpatialReference, int, str], dst_srs: Union[osr.SpatialReference, int, str],
+                      tradicional=True) -> osr.CoordinateTransformation:
+    """A CoordinateTransformation between two srs, cached by (src, dst).
+
+    Transformations are not thread safe, so each thread has its own cache. Do not share the result
+    with other threads.
+    """
+    transforms = getattr(_thread_local, "transforms", None)
+    if transforms is None:
+        transforms = _thread_local.transforms = {}
+    key = (_srs_key(src_srs), _srs_key(dst_srs), tradicional)
+    transform = transforms.get(key)
+    if transform is None:
+        if len(transforms) >= SRS_CACHE_SIZE:
+            transforms.clear()
+        transform = osr.CoordinateTransformation(create_osr_srs(src_srs, tradicional),
+                                                 create_osr_srs(dst_srs, tradicional))
+        transforms[key] = transform
+    return transform
 
 
 def epsg_para_wkt(epsg: int) -> str:
     """Converte um código EPSG para WKT SRS."""
-    return create_osr_srs(epsg).ExportToWkt()
+    return srs_to_wkt(epsg)
 
 
 def find_utm_epsg(longitude, latitude):
@@ -0,0 +1,40 @@
+# Pablo Carreira - 18/10/26
+from typing import Dict, Iterable, Tuple
+
+from osgeo import ogr
+
+from geodata.vectordata import VectorData
+
+#: Origin of the squares of create_squares, they are 25 x 25.
+SQUARES = ((10, 10), (40, 60), (70, 20))
+
+
+def create_vector(file_name: str, geom_type: int, features: Iterable[Tuple[ogr.Geometry, Dict]],
+                  batch_size: int = 4) -> VectorData:
+    """Creates a GPKG (EPSG:32722) with the (geometry, properties) pairs and opens it again for reading."""
+    vector = VectorData.create(file_name, "GPKG", 32722, geom_type=geom_type)
+    with vector.bulk_writer(batch_size=batch_size) as writer:
+        writer.write_many(features)
+    return VectorData(file_name)
+
+
+def create_points(file_name: str, n: int) -> VectorData:
+    """n points (i, 2 * i) with ID i."""
+    return create_vector(file_name, ogr.wkbPoint, ((point(i, 2 * i), {"ID": i}) for i in range(n)))
+
+
+def create_squares(file_name: str) -> VectorData:
+    """The SQUARES with ID 1, 2 and 3."""
+    return create_vector(file_name, ogr.wkbPolygon, ((square(x, y, 25), {"ID": i + 1})
+                                                     for i, (x, y) in enumerate(SQUARES)))
+
+
+def point(x: float, y: float) -> ogr.Geometry:
+    geometry = ogr.Geometry(ogr.wkbPoint)
+    geometry.AddPoint_2D(float(x), float(y))
+    return geometry
+
+
+def square(x: float, y: float, size: float) -> ogr.Geometry:
+    wkt = "POLYGON (({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(x, y, x + size, y + size)
+    return ogr.CreateGeometryFromWkt(wkt)
@@ -1,9 +1,21 @@
 # Pablo Carreira - 08/03/17
+import asyncio
 import hashlib
 import os
+import shutil
+import time
 from collections import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
 
-from geodata.rasterdata import RasterData
+import numpy as np
+from osgeo import gdal
+
+from geodata import block_engine, prefetch
+from geodata.block_cache import BlockCache
+from geodata.block_engine import WorkerHandles, worker_dataset
+from geodata.geo_objects import BBox
+from geodata.rasterdata import RasterData, BLOCK_ORDERS
 from geodata.srs_utils import create_osr_srs
 
 raster_data = RasterData("tests/data/imagem.tiff")
@@ -19,11 +31,164 @@ def test_block_list():
     assert block_list[0] == (0, 0, 400, 64)
 
 
+def test_blocks_positions_coordinates():
+    coordinates = raster_data.get_blocks_positions_coordinates()
+    assert coordinates.shape == (7, 1, 4)
+    assert coordinates.dtype == np.int64
+    assert coordinates[-1, 0].tolist() == [384, 400, 0, 400]
+    assert raster_data.get_blocks_array_indices()[-1] == (6, 0)
+    for (row, col), block in zip(raster_data.get_blocks_array_indices(), raster_data.block_list):
+        y0, y1, x0, x1 = coordinates[row, col]
+        assert (x0, y0, x1 - x0, y1 - y0) == block
+
+
+def test_geotransform():
+    geotransform = raster_data.geotransform
+    cols, rows = np.meshgrid(np.arange(0, 400.5, 0.5), np.arange(0, 400.5, 0.5))
+    xs, ys = geotransform.forward(cols, rows)
+    back_cols, back_rows = geotransform.inverse(xs, ys)
+    assert np.allclose(back_cols, cols) and np.allclose(back_rows, rows)
+    bbox = raster_data.get_bbox()
+    assert (bbox.xmin, bbox.ymax) == tuple(raster_data.origem)
+    assert bbox.xmax == bbox.xmin + 400 * geotransform.x_resolution
+    assert bbox.ymin == bbox.ymax + 400 * geotransform.y_resolution
+
+
+def test_bbox_position_within_image():
+    xs, ys = raster_data.geotransform.forward((10.5, 50.5), (20.5, 80.5))
+    bbox = BBox(xs.min(), ys.min(), xs.max(), ys.max(), raster_data.wkt_srs)
+    position = raster_data.get_bbox_position_within_image(bbox)
+    assert position[:4] == (10, 20, 39, 60)
+    assert position[4:] == tuple(float(value) for value in raster_data.geotransform.forward(10, 20))
+    partial = BBox(bbox.xmin - 1000, bbox.ymin, bbox.xmax, bbox.ymax, raster_data.wkt_srs)
+    assert raster_data.get_bbox_position_within_image(partial, allow_partial=True)[:2] == (0, 20)
+
+    dataset = gdal.GetDriverByName("MEM").Create("", 100, 100, 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform((1000, 1, 0.5, 2000, 0.5, -1))
+    rotated = RasterData(dataset)
+    xs, ys = rotated.geotransform.forward((10, 30, 10, 30), (20, 20, 40, 40))
+    displacement_h, displacement_v, width, height = rotated.get_bbox_position_within_image(
+        BBox(xs.min(), ys.min(), xs.max(), ys.max()), allow_any_srs=True)[:4]
+    # The window covers the pixels of the corners.
+    assert displacement_h <= 10 and displacement_v <= 20
+    assert displacement_h + width + 1 >= 30 and displacement_v + height >= 40
+
+
+def test_block_pixel_coordinates():
+    coords = raster_data.get_block_pixel_coordinates(1)
+    assert coords.shape == (2, 400, 64)
+    xs, ys = raster_data.geotransform.forward(5, 64 + 7)
+    assert (coords[0, 5, 7], coords[1, 5, 7]) == (xs, ys)
+    # The y coordinates decrease going down the image.
+    assert coords[1, 0, 1] < coords[1, 0, 0]
+
+
+def test_sample_points():
+    data = raster_data.read_all()
+    rng = np.random.default_rng(0)
+    rows, cols = rng.integers(0, 400, 1000), rng.integers(0, 400, 1000)
+    xs, ys = raster_data.geotransform.forward(cols + 0.5, rows + 0.5)
+    values = raster_data.sample_points(np.append(xs, -1), np.append(ys, -1), fill_value=7)
+    assert values.shape == (1001, 3)
+    assert np.array_equal(values[:-1], data[:, rows, cols].T)
+    assert values[-1].tolist() == [7, 7, 7]
+    assert np.array_equal(raster_data.sample_points(xs, ys, bands=[2])[:, 0], data[1, rows, cols])
+
+
 def test_create_iterator():
     iterator = raster_data.get_iterator()
     assert isinstance(iterator, Iterator)
 
 
+def test_bands_iterator():
+    rgb_blocks = list(raster_data.get_rgb_iterator())
+    out = raster_data.allocate_block_buffer()
+    for indice, block_data in enumerate(raster_data.get_bands_iterator(interleave="pixel", out=out)):
+        assert np.shares_memory(block_data, out)
+        assert np.array_equal(block_data, rgb_blocks[indice])
+    last_block = raster_data.block_list[-1]
+    assert block_data.shape == (last_block[3], last_block[2], 3)
+
+
+def test_buffered_iterator():
+    out = np.empty((64, 400), dtype=np.uint8)
+    blocks = zip(raster_data.get_iterator(banda=2), raster_data.get_buffered_iterator(banda=2, out=out))
+    for block_data, buffered_data in blocks:
+        assert np.shares_memory(buffered_data, out)
+        assert np.array_equal(block_data, buffered_data)
+    assert np.array_equal(raster_data.read_block_into(0, out, 2), raster_data.read_block_by_coordinates(0, 64, 0, 400)[..., 1])
+
+
+def test_halo_iterator():
+    all_data = raster_data.read_all()
+    padded_image = np.pad(all_data, ((0, 0), (5, 5), (5, 5)), mode="symmetric")
+    for block_index, padded in raster_data.get_halo_iterator(5):
+        xoff, yoff, width, height = raster_data.block_list[block_index]
+        assert np.array_equal(padded, padded_image[:, yoff:yoff + height + 10, xoff:xoff + width + 10])
+
+
+def test_prefetch():
+    blocks = list(raster_data.get_bands_iterator(bands=(1, 3)))
+    prefetcher = raster_data.prefetch(depth=3, workers=2, bands=(1, 3))
+    for block_index, block_data in prefetcher:
+        assert np.array_equal(block_data, blocks[block_index])
+    assert prefetcher.stats.n_blocks == len(blocks)
+
+    async def consume():
+        return [block_data async for _, block_data in raster_data.aiter_blocks(bands=2)]
+
+    async_blocks = asyncio.run(consume())
+    assert all(np.array_equal(a, b) for a, b in zip(async_blocks, raster_data.get_iterator(banda=2)))
+
+
+def test_prefetch_read_ahead():
+    reads = []
+    read_block = prefetch.read_block
+    prefetch.read_block = lambda source, bands, item: reads.append(item[0]) or read_block(source, bands, item)
+    try:
+        blocks = iter(raster_data.prefetch(depth=2, workers=2))
+        next(blocks)
+        # The current block and the 2 next ones.
+        deadline = time.monotonic() + 5
+        while len(reads) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sorted(reads) == [0, 1, 2]
+        blocks.close()
+    finally:
+        prefetch.read_block = read_block
+
+
+def test_async_prefetch_close():
+    handles, open_during_read = [], []
+    worker_handles, read_block = prefetch.WorkerHandles, prefetch.read_block
+
+    def slow_read(source, bands, item):
+        # Still running when the iteration stops after the first block.
+        if item[0]:
+            time.sleep(0.05)
+        block_data = read_block(source, bands, item)
+        open_during_read.append(bool(handles[0]._caches))
+        return block_data
+
+    async def first_block():
+        blocks = raster_data.aiter_blocks(depth=3, workers=3).__aiter__()
+        await blocks.__anext__()
+        await blocks.aclose()
+
+    prefetch.WorkerHandles = lambda: handles.append(worker_handles()) or handles[-1]
+    prefetch.read_block = slow_read
+    try:
+        asyncio.run(first_block())
+        deadline = time.monotonic() + 5
+        while handles[0]._caches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Closed after the reads still running when the iteration stopped.
+        assert not handles[0]._caches
+        assert len(open_during_read) > 1 and all(open_during_read)
+    finally:
+        prefetch.WorkerHandles, prefetch.read_block = worker_handles, read_block
+
+
 def test_clone():
     new_raster = raster_data.clone_empty("tests/data/imagem_clone.tiff")
     assert raster_data == new_raster
@@ -58,6 +223,82 @@ def test_write():
         assert md5 == clone_written
 
 
+def test_writer():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    red_band = source_raster.read_all()[0]
+    with TemporaryDirectory() as temp_dir:
+        new_raster = source_raster.clone_empty(os.path.join(temp_dir, "imagem_writer.tiff"))
+        # The clone has other blocks than the source (256 columns wide), so they come from its own block list.
+        with new_raster.writer(flush_bytes=100000) as writer:
+            for indice, (xoff, yoff, width, height) in enumerate(new_raster.block_list):
+                writer.write_block(red_band[yoff:yoff + height, xoff:xoff + width], indice)
+        assert writer.bytes_written == 400 * 400
+        assert writer.n_flushes == 2
+        assert np.array_equal(new_raster.read_all()[0], red_band)
+
+
+def test_block_cache():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    data = np.moveaxis(source_raster.read_all(), 0, -1)
+    # Room for 6 blocks of the 9 (3 bands x 3 blocks) the first window touches.
+    source_raster.enable_block_cache(max_bytes=400 * 64 * 6)
+    assert np.array_equal(source_raster.read_block_by_coordinates(50, 150, 10, 390), data[50:150, 10:390])
+    assert source_raster.block_cache_stats["misses"] == 3 * 3
+    assert source_raster.block_cache_stats["evictions"] == 3
+    assert np.array_equal(source_raster.read_block_by_coordinates(70, 80, 0, 400), data[70:80])
+    assert source_raster.block_cache_stats["hits"] == 3
+
+    with TemporaryDirectory() as temp_dir:
+        new_raster = source_raster.clone_empty(os.path.join(temp_dir, "imagem_cache.tiff"), bandas=1)
+        new_raster.enable_block_cache()
+        assert new_raster.read_block_by_coordinates(0, 10, 0, 10).max() == 0
+        new_raster.write_window(np.ones((10, 10), dtype=np.uint8), 0, 0, flush=False)
+        assert new_raster.read_block_by_coordinates(0, 10, 0, 10).min() == 1
+
+
+def test_block_cache_threads():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    data = np.moveaxis(source_raster.read_all(), 0, -1)
+    source_raster.enable_block_cache()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        windows = list(executor.map(lambda _: source_raster.read_block_by_coordinates(0, 400, 0, 400), range(8)))
+    assert all(np.array_equal(window, data) for window in windows)
+    # Each block is loaded once.
+    assert source_raster.block_cache_stats["misses"] == 3 * len(source_raster.block_list)
+
+    cache = BlockCache(1000)
+
+    def loader():
+        # Written while it was loaded, the block can't be cached.
+        cache.invalidate([(1, 0)])
+        return np.zeros(10)
+
+    cache.get((1, 0), loader)
+    assert len(cache) == 0
+    cache.get((1, 0), lambda: np.zeros(10))
+    assert len(cache) == 1
+
+
+def test_write_block_order():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    red_band = source_raster.read_all()[0]
+    for order in BLOCK_ORDERS:
+        block_indices = source_raster.get_block_indices(order)
+        for indice, red_array in enumerate(source_raster.get_iterator(banda=1, order=order)):
+            xoff, yoff, width, height = source_raster.block_list[block_indices[indice]]
+            assert np.array_equal(red_array, red_band[yoff:yoff + height, xoff:xoff + width])
+
+        # The halo iterator gives the indices of block_list, write_block takes them back in any order.
+        with TemporaryDirectory() as temp_dir:
+            img_path = os.path.join(temp_dir, "imagem_order.tiff")
+            shutil.copy("tests/data/imagem.tiff", img_path)
+            new_raster = RasterData(img_path, write_enabled=True)
+            with new_raster.writer() as writer:
+                for block_index, block in new_raster.get_halo_iterator(0, bands=[1], order=order):
+                    writer.write_block(255 - block[0], block_index)
+            assert np.array_equal(new_raster.read_all()[0], 255 - red_band)
+
+
 def test_create():
     img_path = os.path.abspath("tests/data/test_image.tif")
     try:
@@ -80,12 +321,71 @@ def test_set_projection():
     assert srs.GetAttrValue("AUTHORITY", 1) == '4326'
 
 
+def test_as_memmap():
+    with TemporaryDirectory() as temp_dir:
+        img_path = os.path.join(temp_dir, "test_memmap.tif")
+        source_raster = RasterData.create(img_path, 100, 50, 1, 0, 0, bands=2, data_type=gdal.GDT_UInt16)
+        data = np.arange(2 * 100 * 50, dtype=np.uint16).reshape((2, 100, 50))
+        for channel in range(2):
+            source_raster.write_all(data[channel], channel + 1)
+        source_raster = RasterData(img_path)
+        assert source_raster.as_memmap() is not None
+        assert np.array_equal(source_raster.read_all(), data)
+        assert np.array_equal(source_raster.read_block_by_coordinates(10, 20, 5, 45),
+                              np.moveaxis(data[:, 10:20, 5:45], 0, -1))
+        assert raster_data.clone_empty(os.path.join(temp_dir, "imagem_clone.tiff")).as_memmap() is None
+
+
 def test_read_all():
     source_raster = RasterData("tests/data/imagem.tiff")
     array = source_raster.read_all()
     assert array.shape == (3, 400, 400)
 
 
+def test_map_blocks():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    expected = _double(source_raster.gdal_dataset.GetRasterBand(1).ReadAsArray())
+    with TemporaryDirectory() as temp_dir:
+        for backend in ("thread", "process"):
+            out = source_raster.map_blocks(_double, os.path.join(temp_dir, "imagem_map.tiff"),
+                                           data_type=gdal.GDT_UInt16, workers=2, backend=backend, ordered=False)
+            assert np.array_equal(out.read_all(), expected)
+
+
+def test_block_statistics():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    band = source_raster.read_all()[1]
+    for workers in (1, 2):
+        band_stats = source_raster.statistics(banda=2, workers=workers)
+        assert (band_stats["min"], band_stats["max"], band_stats["sum"]) == (band.min(), band.max(), band.sum())
+        assert np.isclose(band_stats["mean"], band.mean()) and np.isclose(band_stats["std"], band.std())
+    counts, edges = source_raster.histogram(bins=10, banda=2)
+    assert np.array_equal(counts, np.histogram(band, 10)[0]) and np.allclose(edges, np.histogram(band, 10)[1])
+    assert np.allclose(source_raster.percentiles([0, 5, 50, 99.9], banda=2), np.percentile(band, [0, 5, 50, 99.9]))
+    values, value_counts = np.unique(band, return_counts=True)
+    assert source_raster.class_counts(banda=2, workers=2) == dict(zip(values.tolist(), value_counts.tolist()))
+
+
+def test_worker_handles():
+    handles = WorkerHandles()
+    task = handles.bind(worker_dataset)
+    assert task("tests/data/imagem.tiff") is task("tests/data/imagem.tiff")
+    handles.close()
+    # Outside of a run the handles are not kept.
+    assert worker_dataset("tests/data/imagem.tiff") is not worker_dataset("tests/data/imagem.tiff")
+
+    with TemporaryDirectory() as temp_dir:
+        new_raster = raster_data.clone_empty(os.path.join(temp_dir, "imagem_handles.tiff"), bandas=1)
+        for value in (1, 2):
+            new_raster.write_all(np.full((400, 400), value, dtype=np.uint8), flush=False)
+            assert new_raster.statistics(workers=1)["max"] == value
+    assert getattr(block_engine._local, "handles", None) is None
+
+
+def _double(block_data):
+    return block_data.astype(np.uint16) * 2
+
+
 if __name__ == '__main__':
     test_clone()
     # test_read_all()
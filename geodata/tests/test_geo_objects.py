@@ -1,7 +1,9 @@
 # Pablo Carreira
+import numpy as np
 from osgeo import osr
 
-from geodata.geo_objects import BBox
+from geodata.geo_objects import BBox, BBoxArray
+from geodata.srs_utils import epsg_para_wkt, get_osr_transform
 
 
 def test_bbox_as_ogr_geometry():
@@ -36,11 +38,44 @@ def test_bbox_transform_srs():
     assert int(b_utm22.xmax) == 802092
     assert int(b_utm22.ymax) == 7600000
 
-if __name__ == '__main__':
-    test_bbox_transform_srs()
-
 
-
-imagem.get_bbox_position_within_image(BBox)
+def test_bbox_transform_srs_densified():
+    bbox = BBox(200000, 7000000, 800000, 8000000, epsg_para_wkt(32722))
+    corners = bbox.transform_srs(4326)
+    densified = bbox.transform_srs(4326, densify_points=21)
+    # The edges bend outwards, the corners underestimate the extent.
+    assert densified.xmin <= corners.xmin and densified.ymin <= corners.ymin
+    assert densified.xmax >= corners.xmax and densified.ymax >= corners.ymax
+    transform = get_osr_transform(32722, 4326)
+    if hasattr(transform, "TransformBounds"):  # gdal >= 3.4
+        expected = transform.TransformBounds(*bbox.as_tuple(), 21)
+        assert np.allclose(densified.as_tuple(), expected, rtol=0, atol=1e-4)
+    boxes = BBoxArray.from_bboxes([bbox, BBox(300000, 7500000, 400000, 7600000, epsg_para_wkt(32722))])
+    densified_array = boxes.transform_srs(4326, densify_points=21)
+    assert np.allclose(densified_array.bounds[0], densified.as_tuple())
+
+
+def test_bbox_array():
+    boxes = BBoxArray([(0, 0, 10, 10), (5, 5, 20, 20), (30, 30, 40, 40)])
+    assert boxes.area().tolist() == [100, 225, 100]
+    assert boxes.intersects(BBox(8, 8, 12, 12)).tolist() == [True, True, False]
+    assert boxes.contains(BBox(6, 6, 9, 9)).tolist() == [True, True, False]
+    assert boxes.contains_point(35, 35).tolist() == [False, False, True]
+    intersection = boxes.intersection(BBox(8, 8, 12, 12))
+    assert intersection.bounds[:2].tolist() == [[8, 8, 10, 10], [8, 8, 12, 12]]
+    assert np.isnan(intersection.bounds[2]).all()
+    assert boxes.union(boxes[::-1]).bounds[1].tolist() == [5, 5, 20, 20]
+    assert boxes.total_bounds().as_tuple() == (0, 0, 40, 40)
+    assert [list(bbox) for bbox in boxes] == boxes.bounds.tolist()
+    assert BBoxArray.from_bboxes(boxes.to_bboxes()).bounds.tolist() == boxes.bounds.tolist()
+
+
+def test_bbox_array_transform_srs():
+    bboxes = [BBox(-48.1 + i * 0.01, -22.6, -48.09 + i * 0.01, -22.59, epsg_para_wkt(4326)) for i in range(5)]
+    transformed = BBoxArray.from_bboxes(bboxes).transform_srs(32722)
+    for bbox, row in zip(bboxes, transformed.bounds.tolist()):
+        assert np.allclose(bbox.transform_srs(32722).as_tuple(), row)
 
 
+if __name__ == '__main__':
+    test_bbox_transform_srs()
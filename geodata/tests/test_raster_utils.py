@@ -0,0 +1,67 @@
+# Pablo Carreira - 18/10/26
+import numpy as np
+
+from geodata.block_grid import BlockGrid
+from geodata.raster_utils import ArraySampler, SAMPLER_RATIO_METHOD, SAMPLER_METHOD_N_SAMPLES, mirror_halo, \
+    SpatialBlockSampler, SPATIAL_CHECKERBOARD, SPATIAL_GROUPS
+
+
+def test_sample_indices():
+    sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.3)
+    selected, not_selected = sampler.sample_indices(1000)
+    assert len(selected) == 300 and len(not_selected) == 700
+    assert np.array_equal(np.union1d(selected, not_selected), np.arange(1000))
+    assert np.array_equal(sampler.sample_indices(1000)[0], selected)
+
+
+def test_sample_list():
+    sampler = ArraySampler(SAMPLER_METHOD_N_SAMPLES, n_samples=3)
+    indices = [(i, i + 1) for i in range(10)]
+    selected, not_selected = sampler.sample(indices)
+    assert len(selected) == 3 and sorted(selected + not_selected) == indices
+
+
+def test_sample_stratified():
+    labels = np.array([0] * 50 + [1] * 30 + [2] * 20)
+    selected, _ = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.1).sample_stratified(labels)
+    assert np.bincount(labels[selected]).tolist() == [5, 3, 2]
+    selected, _ = ArraySampler(SAMPLER_METHOD_N_SAMPLES, n_samples=7).sample_stratified(labels)
+    assert len(selected) == 7
+
+
+def test_kfold():
+    folds = list(ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.5).kfold(10, 3))
+    assert len(folds) == 3
+    assert np.array_equal(np.sort(np.concatenate([validation for _, validation in folds])), np.arange(10))
+
+
+def test_iter_sample():
+    sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.25)
+    selected = np.concatenate(list(sampler.iter_sample(100000, chunk_size=7000)))
+    assert len(selected) == 25000 and len(np.unique(selected)) == 25000
+
+
+def test_spatial_sampler_checkerboard():
+    grid = BlockGrid(700, 900, (100, 100))
+    train, validation = SpatialBlockSampler(SPATIAL_CHECKERBOARD, group_size=2).split(grid)
+    assert len(train) + len(validation) == len(grid)
+    rows, cols = grid.blocks["row"][validation], grid.blocks["col"][validation]
+    assert np.all((rows // 2 + cols // 2) % 2 == 1)
+
+
+def test_spatial_sampler_buffer():
+    grid = BlockGrid(2000, 2000, (100, 100))
+    train, validation = SpatialBlockSampler(SPATIAL_GROUPS, group_size=4, ratio=0.2, buffer=1).split(grid)
+    assert len(validation) == 16 * 5
+    train_rows, train_cols = grid.blocks["row"][train], grid.blocks["col"][train]
+    validation_rows, validation_cols = grid.blocks["row"][validation], grid.blocks["col"][validation]
+    distance = np.maximum(np.abs(train_rows[:, None] - validation_rows), np.abs(train_cols[:, None] - validation_cols))
+    assert distance.min() > 1
+
+
+def test_mirror_halo():
+    block = np.arange(42).reshape((6, 7))
+    padded = np.zeros((9, 12), dtype=block.dtype)
+    padded[2:8, 1:8] = block
+    mirror_halo(padded, 2, 1, 1, 4)
+    assert np.array_equal(padded, np.pad(block, ((2, 1), (1, 4)), mode="symmetric"))
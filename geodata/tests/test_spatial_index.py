@@ -0,0 +1,73 @@
+# Pablo Carreira - 18/10/26
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from geodata.geo_objects import BBox
+from geodata.spatial_index import STRTree
+from geodata.tests.fixtures import create_points, point
+from geodata.vectordata import SPATIAL_INDEX_SUFFIX, VectorData
+
+
+def _brute_force(envelopes, bbox):
+    return np.flatnonzero((envelopes[:, 0] <= bbox[2]) & (envelopes[:, 2] >= bbox[0]) &
+                          (envelopes[:, 1] <= bbox[3]) & (envelopes[:, 3] >= bbox[1]))
+
+
+def test_str_tree_query():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 1000, (5000, 2))
+    envelopes = np.column_stack((corners, corners + rng.uniform(0, 10, (5000, 2))))
+    tree = STRTree(envelopes, ids=np.arange(5000) + 100, node_capacity=8)
+    queries = np.column_stack((corners[:50], corners[:50] + 30))
+    for bbox, result in zip(queries, tree.query_many(queries)):
+        assert np.array_equal(result, _brute_force(envelopes, bbox) + 100)
+    assert len(tree.query((-10, -10, -5, -5))) == 0
+
+
+def test_str_tree_small():
+    assert len(STRTree(np.zeros((0, 4))).query((0, 0, 1, 1))) == 0
+    assert STRTree([(0, 0, 1, 1)]).query((1, 1, 2, 2)).tolist() == [0]
+
+
+def test_str_tree_save_load():
+    tree = STRTree([(0, 0, 1, 1), (5, 5, 6, 6), (2, 2, 8, 8)], ids=[10, 20, 30])
+    with TemporaryDirectory() as temp_dir:
+        index_file = os.path.join(temp_dir, "index.npz")
+        tree.save(index_file)
+        loaded = STRTree.load(index_file)
+    assert loaded.query((4, 4, 5.5, 5.5)).tolist() == [20, 30]
+
+
+def test_vector_spatial_index():
+    with TemporaryDirectory() as temp_dir:
+        vector = create_points(os.path.join(temp_dir, "points.gpkg"), 10)
+        index_file = vector.src_file + ".camada" + SPATIAL_INDEX_SUFFIX
+        layer = vector.get_layer()
+        layer.SetAttributeFilter("ID < 3")
+        layer.SetSpatialFilterRect(0, 0, 1, 2)
+        vector.build_spatial_index(persist=True)
+        assert os.path.isfile(index_file)
+        # All the features are indexed and the filters of the layer are kept.
+        assert len(vector.get_spatial_index()) == 10
+        assert layer.GetFeatureCount() == 2
+        layer.SetAttributeFilter(None)
+        layer.SetSpatialFilter(None)
+        assert [feature.GetField("ID") for feature in vector.get_features_in_bbox(BBox(2.5, 0, 5.5, 20))] == [3, 4, 5]
+
+        # Loaded from the file, not built again.
+        writable = VectorData(vector.src_file, update=True)
+        writable.build_spatial_index = None
+        assert len(writable.get_spatial_index()) == 10
+        del writable.build_spatial_index
+
+        writable.add_feature_to_layer(point(100, 200), {"ID": 10})
+        assert not os.path.isfile(index_file)
+        assert len(writable.query_bbox(BBox(99, 199, 101, 201))) == 1
+
+        writable.build_spatial_index(persist=True)
+        with writable.bulk_writer() as writer:
+            writer.write(point(100, 200), {"ID": 11})
+        assert not os.path.isfile(index_file)
+        assert len(writable.query_bbox(BBox(99, 199, 101, 201))) == 2
@@ -0,0 +1,34 @@
+# Pablo Carreira - 18/10/26
+import threading
+
+from osgeo import osr
+
+from geodata.srs_utils import create_osr_srs, get_osr_transform, is_same_srs, epsg_para_wkt
+
+
+def test_create_osr_srs_clones():
+    srs_a = create_osr_srs(32722)
+    srs_b = create_osr_srs(32722)
+    assert srs_a is not srs_b
+    assert srs_a.IsSame(srs_b)
+    srs_a.ImportFromEPSG(4326)
+    assert create_osr_srs(32722).IsSame(srs_b)
+
+
+def test_is_same_srs():
+    utm22s = epsg_para_wkt(32722)
+    assert is_same_srs(utm22s, 32722)
+    assert is_same_srs(create_osr_srs(utm22s), utm22s)
+    assert not is_same_srs(utm22s, 32723)
+
+
+def test_osr_transform_cache():
+    transform = get_osr_transform(4326, 32722)
+    assert get_osr_transform(4326, 32722) is transform
+    assert isinstance(transform, osr.CoordinateTransformation)
+    # Each thread has its own transforms.
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_osr_transform(4326, 32722)))
+    thread.start()
+    thread.join()
+    assert other[0] is not transform
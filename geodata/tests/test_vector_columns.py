@@ -0,0 +1,81 @@
+# Pablo Carreira - 18/10/26
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from osgeo import ogr
+
+from geodata.geo_objects import BBox
+from geodata.tests.fixtures import create_points
+from geodata.vector_columns import GEOMETRY_COORDS, _datetime64, _geometry_columns, _to_column
+from geodata.vector_utils import polygons_to_wkb, split_wkb
+
+
+def test_read_columns():
+    with TemporaryDirectory() as temp_dir:
+        vector = create_points(os.path.join(temp_dir, "points.gpkg"), 10)
+        columns = vector.read_columns(geometry="bounds")
+        assert columns["ID"].tolist() == list(range(10))
+        assert len(columns["fid"]) == 10
+        assert columns["geometry"][3].tolist() == [3, 6, 3, 6]
+
+        columns = vector.read_columns(fields=[], geometry="coords", where="ID >= 5")
+        assert set(columns) == {"fid", "geometry", "ring_offsets", "part_offsets", "geometry_offsets"}
+        assert columns["geometry"].tolist() == [[i, 2 * i] for i in range(5, 10)]
+        # A point is one part with one vertex sequence.
+        for name in ("ring_offsets", "part_offsets", "geometry_offsets"):
+            assert columns[name].tolist() == list(range(6))
+
+        columns = vector.read_columns(geometry="wkb", bbox=BBox(-1, -1, 2.5, 5))
+        offsets = columns["geometry_offsets"]
+        wkbs = [columns["geometry"][start:end].tobytes() for start, end in zip(offsets[:-1], offsets[1:])]
+        assert [ogr.CreateGeometryFromWkb(wkb).GetX() for wkb in wkbs] == [0, 1, 2]
+
+        # The filters set on the layer are kept.
+        vector.get_layer().SetAttributeFilter("ID < 3")
+        assert len(vector.read_columns(fields=[], geometry=None, where="ID >= 1")["fid"]) == 9
+        assert len(vector.read_columns(fields=[], geometry=None)["fid"]) == 3
+        # So are the ignored fields.
+        vector.get_layer().SetIgnoredFields(["ID"])
+        assert vector.read_columns(fields=["ID"], geometry=None)["ID"].tolist() == [0, 1, 2]
+        assert vector.get_layer().GetLayerDefn().GetFieldDefn(0).IsIgnored()
+
+
+def test_coords_columns():
+    wkts = ["POLYGON ((0 0,10 0,10 10,0 0),(1 1,2 1,2 2,1 1))",
+            "MULTIPOLYGON (((20 0,30 0,30 10,20 0)),((40 0,50 0,50 10,40 0)))"]
+    columns = _geometry_columns([ogr.CreateGeometryFromWkt(wkt).ExportToIsoWkb() for wkt in wkts] + [None],
+                                GEOMETRY_COORDS)
+    assert columns["geometry_offsets"].tolist() == [0, 1, 3, 3]
+    assert columns["part_offsets"].tolist() == [0, 2, 3, 4]
+    assert columns["ring_offsets"].tolist() == [0, 4, 8, 12, 16]
+    # One polygon per part.
+    buffer, offsets = polygons_to_wkb(columns["geometry"], columns["ring_offsets"], columns["part_offsets"])
+    polygons = [ogr.CreateGeometryFromWkb(wkb) for wkb in split_wkb(buffer, offsets)]
+    multipolygon = ogr.CreateGeometryFromWkt(wkts[1])
+    assert polygons[0].Equals(ogr.CreateGeometryFromWkt(wkts[0]))
+    assert polygons[1].Equals(multipolygon.GetGeometryRef(0)) and polygons[2].Equals(multipolygon.GetGeometryRef(1))
+
+
+def test_to_column_nulls():
+    assert _to_column([1, 2], ogr.OFTInteger).dtype == np.int64
+    assert np.isnan(_to_column([1, None], ogr.OFTInteger)[1])
+    assert _to_column([b"a", None], ogr.OFTString).tolist() == ["a", None]
+
+
+def test_date_columns():
+    layer_defn = ogr.FeatureDefn()
+    layer_defn.AddFieldDefn(ogr.FieldDefn("date", ogr.OFTDate))
+    layer_defn.AddFieldDefn(ogr.FieldDefn("datetime", ogr.OFTDateTime))
+    feature = ogr.Feature(layer_defn)
+    feature.SetField(0, 2020, 1, 2, 0, 0, 0, 0)
+    # UTC+1.
+    feature.SetField(1, 2020, 1, 2, 3, 4, 5.5, 104)
+    dates = _to_column([_datetime64(feature, 0), None], ogr.OFTDate)
+    assert dates.dtype == np.dtype("datetime64[D]")
+    assert dates[0] == np.datetime64("2020-01-02") and np.isnat(dates[1])
+    assert _datetime64(feature, 1) == np.datetime64("2020-01-02T02:04:05.500")
+    # The Arrow reader gives masked arrays.
+    masked = np.ma.masked_array(np.array(["2020-01-02T03:04", "2020-01-03"], dtype="datetime64[ms]"), [False, True])
+    datetimes = _to_column(masked, ogr.OFTDateTime)
+    assert datetimes[0] == np.datetime64("2020-01-02T03:04") and np.isnat(datetimes[1])
@@ -0,0 +1,52 @@
+# Pablo Carreira - 18/10/26
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from osgeo import gdal
+
+from geodata.rasterdata import RasterData
+from geodata.tests.fixtures import create_squares
+from geodata.vector_raster import rasterize, zonal_stats, ZONAL_BLOCK, ZONAL_POLYGON
+
+
+def test_rasterize():
+    with TemporaryDirectory() as temp_dir:
+        vector = create_squares(os.path.join(temp_dir, "squares.gpkg"))
+        like = RasterData.create(os.path.join(temp_dir, "like.tif"), 100, 100, 1, 0, 100, data_type=gdal.GDT_Byte)
+        like.set_srs(32722)
+
+        # The whole layer at once, the reference.
+        mem_dataset = gdal.GetDriverByName("MEM").Create("", 100, 100, 1, gdal.GDT_Byte)
+        mem_dataset.SetGeoTransform(like.gdal_dataset.GetGeoTransform())
+        mem_dataset.SetProjection(like.wkt_srs)
+        gdal.RasterizeLayer(mem_dataset, [1], vector.get_layer(), options=["ATTRIBUTE=ID"])
+        expected = mem_dataset.ReadAsArray()
+
+        out = rasterize(vector, like, attribute="ID", out=os.path.join(temp_dir, "labels.tif"), workers=2)
+        assert np.array_equal(out.read_all(), expected)
+        assert set(np.unique(expected)) == {0, 1, 2, 3}
+
+        mask = rasterize(vector, like, out=os.path.join(temp_dir, "mask.tif"))
+        assert np.array_equal(mask.read_all(), (expected > 0).astype(np.uint8))
+
+
+def test_zonal_stats():
+    with TemporaryDirectory() as temp_dir:
+        vector = create_squares(os.path.join(temp_dir, "squares.gpkg"))
+        raster = RasterData.create(os.path.join(temp_dir, "values.tif"), 100, 100, 1, 0, 100,
+                                   data_type=gdal.GDT_Float32)
+        raster.set_srs(32722)
+        data = np.random.default_rng(0).uniform(0, 100, (100, 100)).astype(np.float32)
+        raster.write_all(data)
+        raster = RasterData(raster.src_image)
+        # Rows go down: the square from y 10 to 35 is in the rows 65 to 90.
+        expected = data[65:90, 10:35]
+        for mode in (ZONAL_POLYGON, ZONAL_BLOCK):
+            results = zonal_stats(raster, vector, mode=mode, workers=2)
+            assert len(results) == 3
+            first = results[min(results)]
+            assert first["count"] == expected.size
+            assert np.isclose(first["mean"], expected.mean(dtype=np.float64))
+            assert np.isclose(first["std"], expected.std(dtype=np.float64))
+            assert first["max"] == expected.max()
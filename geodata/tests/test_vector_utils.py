@@ -0,0 +1,75 @@
+# Pablo Carreira - 18/10/26
+import struct
+
+import numpy as np
+from osgeo import ogr, osr
+
+from geodata.srs_utils import create_osr_srs
+from geodata.vector_utils import create_ogr_geom, create_ogr_linestring_from_list, lines_to_wkb, \
+    multipoints_to_wkb, points_to_wkb, polygons_to_wkb, split_wkb, transform_coords, transform_geometries
+
+
+def test_lines_to_wkb():
+    coords = np.array([(0, 0), (1, 1), (2, 0), (5, 5), (6, 6)], dtype=np.float64)
+    wkbs = split_wkb(*lines_to_wkb(coords, [0, 3, 5]))
+    assert struct.unpack_from("<BII", wkbs[0]) == (1, 2, 3)
+    assert len(wkbs[1]) == 9 + 2 * 16
+    assert ogr.CreateGeometryFromWkb(wkbs[1]).Equals(ogr.CreateGeometryFromWkt("LINESTRING (5 5,6 6)"))
+
+
+def test_polygons_to_wkb():
+    square = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+    hole = [(2, 2), (2, 4), (4, 4), (2, 2)]
+    coords = np.array(square + hole + square, dtype=np.float64)
+    wkbs = split_wkb(*polygons_to_wkb(coords, [0, 5, 9, 14], [0, 2, 3]))
+    polygon = ogr.CreateGeometryFromWkb(wkbs[0])
+    assert polygon.GetGeometryCount() == 2
+    assert polygon.Area() == 100 - 2
+    assert ogr.CreateGeometryFromWkb(wkbs[1]).Area() == 100
+
+
+def test_points_to_wkb():
+    coords = np.array([(1, 2, 3), (4, 5, 6)], dtype=np.float64)
+    wkbs = split_wkb(*points_to_wkb(coords))
+    assert [ogr.CreateGeometryFromWkb(wkb).GetPoint() for wkb in wkbs] == [(1, 2, 3), (4, 5, 6)]
+    multipoint = ogr.CreateGeometryFromWkb(split_wkb(*multipoints_to_wkb(coords[:, :2], [0, 2]))[0])
+    assert multipoint.GetGeometryCount() == 2
+
+
+def test_empty_to_wkb():
+    empty = np.zeros((0, 2))
+    for buffer, offsets in (points_to_wkb(empty), lines_to_wkb(empty, [0]), multipoints_to_wkb(empty, [0]),
+                            polygons_to_wkb(empty, [0], [0])):
+        assert len(buffer) == 0 and offsets.tolist() == [0]
+    # Geometries without vertices.
+    assert struct.unpack("<BII", split_wkb(*lines_to_wkb(empty, [0, 0]))[0]) == (1, 2, 0)
+    assert struct.unpack("<BII", split_wkb(*polygons_to_wkb(empty, [0], [0, 0]))[0]) == (1, 3, 0)
+    assert create_ogr_linestring_from_list([]).GetPointCount() == 0
+
+
+def test_create_ogr_geom_dispatch():
+    wkt = "POINT (1 2)"
+    geom = ogr.CreateGeometryFromWkt(wkt)
+    for source in (wkt, bytes(geom.ExportToWkb()), geom.ExportToWkb().hex(), geom.ExportToJson(),
+                   {"type": "Point", "coordinates": [1, 2]}):
+        assert create_ogr_geom(source).Equals(geom)
+
+
+def test_transform_coords():
+    lons, lats = np.linspace(-50, -48, 7), np.linspace(-23, -21, 7)
+    xs, ys = transform_coords(lons, lats, 4326, 32722, chunk_size=3, workers=2)
+    transform = osr.CoordinateTransformation(create_osr_srs(4326), create_osr_srs(32722))
+    expected = np.array(transform.TransformPoints(np.column_stack((lons, lats)).tolist()))
+    assert np.allclose(xs, expected[:, 0]) and np.allclose(ys, expected[:, 1])
+
+
+def test_transform_geometries():
+    wkts = ["POINT (-48 -22)", "LINESTRING (-48 -22,-47.5 -21.5)", "POLYGON ((-48 -22,-47 -22,-47 -21,-48 -22))",
+            "MULTIPOINT Z ((-48 -22 10),(-47 -21 20))"]
+    geometries = [ogr.CreateGeometryFromWkt(wkt) for wkt in wkts]
+    transformed = transform_geometries([geometry.ExportToIsoWkb() for geometry in geometries], 4326, 32722,
+                                       chunk_size=2)
+    transform = osr.CoordinateTransformation(create_osr_srs(4326), create_osr_srs(32722))
+    for geometry, wkb in zip(geometries, transformed):
+        geometry.Transform(transform)
+        assert ogr.CreateGeometryFromWkb(wkb).Distance(geometry) < 1e-6
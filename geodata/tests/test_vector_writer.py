@@ -0,0 +1,42 @@
+# Pablo Carreira - 18/10/26
+import os
+from tempfile import TemporaryDirectory
+
+from osgeo import ogr
+
+from geodata.tests.fixtures import point
+from geodata.vectordata import VectorData
+
+
+def test_feature_writer():
+    with TemporaryDirectory() as temp_dir:
+        vector = VectorData.create(os.path.join(temp_dir, "points.gpkg"), "GPKG", 32722, geom_type=ogr.wkbPoint)
+        with vector.bulk_writer(batch_size=4) as writer:
+            # ogr.Geometry and WKB.
+            writer.write_many((point(i, i), {"ID": i}) for i in range(5))
+            writer.write_many((bytes(point(i, i).ExportToWkb()), {"ID": i}) for i in range(5, 10))
+        assert (writer.n_features, writer.n_commits) == (10, 3)
+        assert writer.features_per_second > 0
+        # Stopped on close.
+        assert writer.elapsed == writer.elapsed
+
+        # The layer is valid while its VectorData is referenced.
+        written = VectorData(vector.src_file)
+        layer = written.get_layer()
+        assert [(feature.GetField("ID"), feature.GetGeometryRef().GetX()) for feature in layer] == \
+            [(i, i) for i in range(10)]
+
+
+def test_feature_writer_rollback():
+    with TemporaryDirectory() as temp_dir:
+        vector = VectorData.create(os.path.join(temp_dir, "points.gpkg"), "GPKG", 32722, geom_type=ogr.wkbPoint)
+        try:
+            with vector.bulk_writer(batch_size=4) as writer:
+                writer.write_many((point(i, i), {"ID": i}) for i in range(6))
+                raise RuntimeError("Interrupted.")
+        except RuntimeError:
+            pass
+        # The first batch was committed, the second one rolled back.
+        assert (writer.n_features, writer.n_commits, writer.closed) == (4, 1, True)
+        written = VectorData(vector.src_file)
+        assert written.get_layer().GetFeatureCount() == 4
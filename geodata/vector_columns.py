@@ -0,0 +1,218 @@
+# Pablo Carreira - 18/10/26
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from osgeo import ogr
+
+GEOMETRY_WKB = "wkb"
+GEOMETRY_BOUNDS = "bounds"
+GEOMETRY_COORDS = "coords"
+GEOMETRY_FORMATS = (GEOMETRY_WKB, GEOMETRY_BOUNDS, GEOMETRY_COORDS)
+
+DEFAULT_COLUMNS_BATCH_SIZE = 65536
+
+_INTEGER_TYPES = (ogr.OFTInteger, ogr.OFTInteger64)
+#: numpy unit of the date and time fields, the types of the Arrow reader of gdal.
+_DATE_UNITS = {ogr.OFTDate: "D", ogr.OFTTime: "ms", ogr.OFTDateTime: "ms"}
+_COLLECTION_TYPES = (ogr.wkbMultiPoint, ogr.wkbMultiLineString, ogr.wkbMultiPolygon, ogr.wkbGeometryCollection)
+
+
+def read_layer_columns(ogr_layer: ogr.Layer, fields: Sequence[str] = None, geometry: str = GEOMETRY_WKB,
+                       batch_size: int = DEFAULT_COLUMNS_BATCH_SIZE) -> Dict[str, np.ndarray]:
+    """Reads the features of a layer as columns, see VectorData.read_columns.
+
+    The filters already set on the layer (spatial and attribute) are respected. The fields not
+    requested are ignored by OGR, so they are not even decoded, the ignored fields of the layer are
+    restored afterwards.
+    """
+    if geometry is not None and geometry not in GEOMETRY_FORMATS:
+        raise ValueError("Invalid geometry format: {}, must be one of {} or None.".format(geometry, GEOMETRY_FORMATS))
+    layer_defn = ogr_layer.GetLayerDefn()
+    all_fields = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+    fields = all_fields if fields is None else list(fields)
+    missing = set(fields) - set(all_fields)
+    if missing:
+        raise ValueError("Fields not found: {}.".format(sorted(missing)))
+    field_types = {name: layer_defn.GetFieldDefn(layer_defn.GetFieldIndex(name)).GetType() for name in fields}
+
+    ignored = [name for name in all_fields if name not in fields]
+    if geometry is None:
+        ignored.append("OGR_GEOMETRY")
+    previous_ignored = _ignored_fields(ogr_layer)
+    ogr_layer.SetIgnoredFields(ignored)
+    ogr_layer.ResetReading()
+    try:
+        if hasattr(ogr_layer, "GetArrowStreamAsNumPy"):
+            fids, columns, wkbs = _read_arrow(ogr_layer, fields, geometry is not None, batch_size)
+        else:
+            fids, columns, wkbs = _read_features(ogr_layer, fields, geometry is not None)
+    finally:
+        ogr_layer.SetIgnoredFields(previous_ignored)
+        ogr_layer.ResetReading()
+
+    result = {"fid": np.asarray(fids, dtype=np.int64)}
+    for name in fields:
+        result[name] = _to_column(columns[name], field_types[name])
+    if geometry is not None:
+        result.update(_geometry_columns(wkbs, geometry))
+    return result
+
+
+def _ignored_fields(ogr_layer: ogr.Layer) -> List[str]:
+    """The fields ignored on a layer, as given to SetIgnoredFields."""
+    layer_defn = ogr_layer.GetLayerDefn()
+    ignored = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())
+               if layer_defn.GetFieldDefn(i).IsIgnored()]
+    if layer_defn.IsGeometryIgnored():
+        ignored.append("OGR_GEOMETRY")
+    if layer_defn.IsStyleIgnored():
+        ignored.append("OGR_STYLE")
+    return ignored
+
+
+def _read_arrow(ogr_layer: ogr.Layer, fields: List[str], with_geometry: bool,
+                batch_size: int) -> Tuple[List, Dict[str, List], List]:
+    """Reads the columns in batches with the Arrow stream interface of GDAL >= 3.6."""
+    fid_column = ogr_layer.GetFIDColumn() or "OGC_FID"
+    geometry_column = ogr_layer.GetGeometryColumn() or "wkb_geometry"
+    options = ["INCLUDE_FID=YES", "MAX_FEATURES_IN_BATCH={}".format(batch_size), "GEOMETRY_ENCODING=WKB"]
+    fids, columns, wkbs = [], {name: [] for name in fields}, []
+    stream = ogr_layer.GetArrowStreamAsNumPy(options=options)
+    for batch in stream:
+        fids.append(np.asarray(batch[fid_column]))
+        for name in fields:
+            columns[name].append(batch[name])
+        if with_geometry:
+            wkbs.extend(batch[geometry_column].tolist())
+    fids = np.concatenate(fids) if fids else []
+    return fids, {name: _concatenate(values) for name, values in columns.items()}, wkbs
+
+
+def _concatenate(arrays: List[np.ndarray]):
+    if not arrays:
+        return []
+    if any(isinstance(array, np.ma.MaskedArray) for array in arrays):
+        return np.ma.concatenate(arrays)
+    return np.concatenate(arrays)
+
+
+def _read_features(ogr_layer: ogr.Layer, fields: List[str], with_geometry: bool) -> Tuple[List, Dict[str, List], List]:
+    """Fallback without Arrow: one pass over the features, collecting the values in lists."""
+    layer_defn = ogr_layer.GetLayerDefn()
+    indices = [(name, layer_defn.GetFieldIndex(name)) for name in fields]
+    date_indices = {index for _, index in indices if layer_defn.GetFieldDefn(index).GetType() in _DATE_UNITS}
+    fids, columns, wkbs = [], {name: [] for name in fields}, []
+    for feature in ogr_layer:
+        fids.append(feature.GetFID())
+        for name, index in indices:
+            if not feature.IsFieldSetAndNotNull(index):
+                value = None
+            elif index in date_indices:
+                value = _datetime64(feature, index)
+            else:
+                value = feature.GetField(index)
+            columns[name].append(value)
+        if with_geometry:
+            geometry = feature.GetGeometryRef()
+            wkbs.append(None if geometry is None else bytes(geometry.ExportToIsoWkb()))
+    return fids, columns, wkbs
+
+
+def _datetime64(feature: ogr.Feature, index: int) -> np.datetime64:
+    """The value of a date or time field like the Arrow reader gives it: in UTC when the time zone is
+    known and times on 1970-01-01."""
+    year, month, day, hour, minute, second, tz_flag = feature.GetFieldAsDateTime(index)
+    value = np.datetime64("{:04d}-{:02d}-{:02d}".format(year or 1970, month or 1, day or 1), "ms")
+    value += np.timedelta64(int(round((hour * 3600 + minute * 60 + second) * 1000)), "ms")
+    if tz_flag > 1:
+        # 100 is UTC, each step is 15 minutes.
+        value -= np.timedelta64((tz_flag - 100) * 15, "m")
+    return value
+
+
+def _to_column(values, field_type: int) -> np.ndarray:
+    """Converts the values of a field to an array: int64 for integers (float64 with NaN if there are
+    nulls), float64 for reals, datetime64 for dates and times (NaT for nulls) and object arrays for the
+    other types (None for nulls)."""
+    if field_type in _DATE_UNITS:
+        dtype = "datetime64[{}]".format(_DATE_UNITS[field_type])
+        if isinstance(values, np.ma.MaskedArray):
+            return values.astype(dtype).filled(np.datetime64("NaT"))
+        if isinstance(values, np.ndarray):
+            return values.astype(dtype)
+        return np.array([np.datetime64("NaT") if value is None else value for value in values], dtype=dtype)
+    if isinstance(values, np.ma.MaskedArray):
+        if field_type in _INTEGER_TYPES + (ogr.OFTReal,) and values.dtype.kind in "iuf":
+            return values.astype(np.float64).filled(np.nan) if values.mask.any() else values.data
+        values = [None if masked else value for value, masked in zip(values.data.tolist(), values.mask.tolist())]
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values
+    if field_type in _INTEGER_TYPES:
+        if any(value is None for value in values):
+            return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if field_type == ogr.OFTReal:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    if field_type == ogr.OFTString:
+        # The Arrow reader may give the strings as bytes.
+        values = [value.decode("utf-8") if isinstance(value, bytes) else value for value in values]
+    column[:] = list(values)
+    return column
+
+
+def _geometry_columns(wkbs: List, geometry: str) -> Dict[str, np.ndarray]:
+    """The geometry columns in the requested format.
+
+    GEOMETRY_WKB: "geometry" is a uint8 buffer with all the WKBs and "geometry_offsets" (n + 1) the
+        start of each one, WKB i is geometry[offsets[i]:offsets[i + 1]] (empty for nulls).
+    GEOMETRY_BOUNDS: "geometry" (n, 4) with xmin, ymin, xmax, ymax, NaN for nulls.
+    GEOMETRY_COORDS: "geometry" (m, 2) with the x, y of all vertices and three levels of offsets:
+        "ring_offsets" the start of each vertex sequence (a ring, a line or a point) in geometry,
+        "part_offsets" the first sequence of each part (a polygon, a line or a point) and
+        "geometry_offsets" (n + 1) the first part of each feature. A polygon layer gives the input of
+        polygons_to_wkb(geometry, ring_offsets, part_offsets), one polygon per part.
+    """
+    if geometry == GEOMETRY_WKB:
+        wkbs = [b"" if wkb is None else bytes(wkb) for wkb in wkbs]
+        offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+        np.cumsum([len(wkb) for wkb in wkbs], out=offsets[1:])
+        return {"geometry": np.frombuffer(b"".join(wkbs), dtype=np.uint8), "geometry_offsets": offsets}
+
+    geometries = [None if wkb is None or not len(wkb) else ogr.CreateGeometryFromWkb(bytes(wkb)) for wkb in wkbs]
+    if geometry == GEOMETRY_BOUNDS:
+        bounds = np.full((len(geometries), 4), np.nan)
+        for i, geom in enumerate(geometries):
+            if geom is not None and not geom.IsEmpty():
+                xmin, xmax, ymin, ymax = geom.GetEnvelope()
+                bounds[i] = xmin, ymin, xmax, ymax
+        return {"geometry": bounds}
+
+    vertices, ring_offsets, part_offsets, geometry_offsets = [], [0], [0], [0]
+    for geom in geometries:
+        if geom is not None and not geom.IsEmpty():
+            for part in _parts(geom):
+                for ring in _rings(part):
+                    vertices.extend(vertex[:2] for vertex in ring.GetPoints() or [])
+                    ring_offsets.append(len(vertices))
+                part_offsets.append(len(ring_offsets) - 1)
+        geometry_offsets.append(len(part_offsets) - 1)
+    return {"geometry": np.array(vertices, dtype=np.float64).reshape((-1, 2)),
+            "ring_offsets": np.array(ring_offsets, dtype=np.int64),
+            "part_offsets": np.array(part_offsets, dtype=np.int64),
+            "geometry_offsets": np.array(geometry_offsets, dtype=np.int64)}
+
+
+def _parts(geometry: ogr.Geometry) -> List[ogr.Geometry]:
+    """The simple geometries of a geometry, the members of multi geometries and collections."""
+    if ogr.GT_Flatten(geometry.GetGeometryType()) in _COLLECTION_TYPES:
+        return [part for i in range(geometry.GetGeometryCount()) for part in _parts(geometry.GetGeometryRef(i))
+                if not part.IsEmpty()]
+    return [geometry]
+
+
+def _rings(part: ogr.Geometry) -> List[ogr.Geometry]:
+    """The vertex sequences of a simple geometry: the rings of a polygon, otherwise itself."""
+    if ogr.GT_Flatten(part.GetGeometryType()) == ogr.wkbPolygon:
+        return [part.GetGeometryRef(i) for i in range(part.GetGeometryCount())]
+    return [part]
@@ -0,0 +1,304 @@
+# Pablo Carreira - 18/10/26
+from functools import partial
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from geodata.block_engine import BACKEND_THREAD, DatasetSource, read_block, run_tasks, worker_handle
+from geodata.block_stats import RunningStats
+from geodata.geo_objects import BBox, GeoTransform
+from geodata.rasterdata import RasterData
+from geodata.srs_utils import is_same_srs
+from geodata.vector_columns import GEOMETRY_WKB
+from geodata.vector_utils import split_wkb, transform_geometries
+from geodata.vectordata import VectorData, QUERY_DENSIFY_POINTS
+
+ZONAL_POLYGON = "polygon"
+ZONAL_BLOCK = "block"
+ZONAL_MODES = (ZONAL_POLYGON, ZONAL_BLOCK)
+ZONAL_STATS = ("count", "min", "max", "sum", "mean", "std")
+
+
+def worker_datasource(src_file: str) -> ogr.DataSource:
+    """Returns a read only OGR datasource private to the current thread (or process) for the current run,
+    like worker_dataset.
+
+    The spatial filter of the layers is changed for each block, so the workers can't share them.
+
+    :param src_file: Path to the vector file.
+    """
+    return worker_handle(("ogr", src_file), partial(_open_datasource, src_file))
+
+
+def _open_datasource(src_file: str) -> ogr.DataSource:
+    datasource = ogr.Open(src_file, 0)
+    if not datasource:
+        raise IOError("Can't open file: {}".format(src_file))
+    return datasource
+
+
+class RasterizeParams:
+    __slots__ = ("src_file", "layer", "wkt_srs", "geotransform", "data_type", "options", "burn_value")
+
+    def __init__(self, src_file: str, layer: Union[str, int], wkt_srs: str, geotransform: Tuple[float, ...],
+                 data_type: int, options: list, burn_value: float):
+        """What the workers need to rasterize a block, picklable for the process backend."""
+        self.src_file = src_file
+        self.layer = layer
+        self.wkt_srs = wkt_srs
+        self.geotransform = geotransform
+        self.data_type = data_type
+        self.options = options
+        self.burn_value = burn_value
+
+
+def rasterize_block(params: RasterizeParams, item: Tuple[int, Tuple]) -> Union[np.ndarray, None]:
+    """Rasterizes the features that intersect a block into a block sized MEM dataset.
+
+    :param params: The rasterization parameters.
+    :param item: Pair (block index, block) from the block list.
+    :returns: The block data (rows, cols) or None if no feature touches the block.
+    """
+    xoff, yoff, width, height = item[1]
+    geotransform = GeoTransform(params.geotransform)
+    # Geotransform of the block: the image one with the origin moved to the block corner.
+    x0, y0 = geotransform.forward(xoff, yoff)
+    block_geotransform = (float(x0), geotransform.a, geotransform.b, float(y0), geotransform.d, geotransform.e)
+    xs, ys = GeoTransform(block_geotransform).forward((0, width, 0, width), (0, 0, height, height))
+    bbox = BBox(xs.min(), ys.min(), xs.max(), ys.max(), params.wkt_srs)
+
+    # The layer is valid while the datasource is referenced.
+    datasource = worker_datasource(params.src_file)
+    ogr_layer = datasource.GetLayer(params.layer)
+    if ogr_layer is None:
+        raise ValueError("Layer not found: {}.".format(params.layer))
+    layer_srs = ogr_layer.GetSpatialRef()
+    if layer_srs is not None and params.wkt_srs and not is_same_srs(params.wkt_srs, layer_srs.ExportToWkt()):
+        bbox = bbox.transform_srs(layer_srs.ExportToWkt(), densify_points=QUERY_DENSIFY_POINTS)
+    ogr_layer.SetSpatialFilterRect(*bbox.as_tuple())
+    try:
+        ogr_layer.ResetReading()
+        if ogr_layer.GetNextFeature() is None:
+            return None
+        ogr_layer.ResetReading()
+        mem_dataset = gdal.GetDriverByName("MEM").Create("", width, height, 1, params.data_type)
+        mem_dataset.SetGeoTransform(block_geotransform)
+        if params.wkt_srs:
+            mem_dataset.SetProjection(params.wkt_srs)
+        if params.burn_value is None:
+            error = gdal.RasterizeLayer(mem_dataset, [1], ogr_layer, options=params.options)
+        else:
+            error = gdal.RasterizeLayer(mem_dataset, [1], ogr_layer, burn_values=[params.burn_value],
+                                        options=params.options)
+        if error != 0:
+            raise RuntimeError("Error rasterizing the block {}.".format(item[0]))
+        return mem_dataset.GetRasterBand(1).ReadAsArray()
+    finally:
+        ogr_layer.SetSpatialFilter(None)
+
+
+def rasterize(vector: VectorData, like: RasterData, attribute: str = None, out: Union[str, RasterData] = None,
+              burn_value: float = 1, layer: Union[str, int] = 0, all_touched: bool = False,
+              data_type: int = gdal.GDT_Byte, workers: int = 1, backend: str = BACKEND_THREAD,
+              max_in_flight: int = None) -> RasterData:
+    """Burns the features of a layer into a raster with the grid of like, block by block.
+
+    For each block of like.block_list only the features that intersect it are fetched (spatial
+    filter) and rasterized into a block sized MEM dataset, which is written to out. The memory
+    used depends on the block size, not on the extent. The layer is reprojected if needed.
+
+    Blocks without features are not written, they keep the values of out (0 in new files).
+
+    :param vector: The vector data, read by the workers from its file.
+    :param like: The raster that defines the grid (size, geotransform, srs and blocks).
+    :param attribute: Field with the values to burn, otherwise burn_value is used.
+    :param out: The output RasterData or the path for a new one created with like.clone_empty.
+    :param burn_value: Value burned when there is no attribute.
+    :param layer: Layer name or index.
+    :param all_touched: Burn all the pixels touched by the geometries, not only those whose center is inside.
+    :param data_type: Gdal data type when creating the output.
+    :param workers: Number of workers, 1 runs in the calling thread.
+    :param backend: BACKEND_THREAD or BACKEND_PROCESS.
+    :param max_in_flight: Maximum number of blocks rasterized and not written yet, defaults to 2 * workers.
+    :returns: The output RasterData.
+    """
+    if out is None:
+        raise ValueError("Must provide an output RasterData or file name.")
+    if isinstance(out, str):
+        out = like.clone_empty(out, bandas=1, data_type=data_type)
+    elif not out.write_enabled:
+        raise ValueError("The output RasterData must be write enabled.")
+
+    options = ["ALL_TOUCHED=TRUE"] if all_touched else []
+    if attribute is not None:
+        options.append("ATTRIBUTE={}".format(attribute))
+        burn_value = None
+    if vector.update:
+        # The workers reopen the file.
+        vector.ogr_datasource.GetLayer(layer).SyncToDisk()
+    params = RasterizeParams(vector.src_file, layer, like.wkt_srs, like.geotransform.as_tuple(),
+                             out.gdal_dataset.GetRasterBand(1).DataType, options, burn_value)
+    task = partial(rasterize_block, params)
+    items = enumerate(like.block_list)
+    results = run_tasks(task, items, workers=workers, backend=backend, ordered=False, max_in_flight=max_in_flight)
+    with out.writer() as writer:
+        for (_, block), data in results:
+            if data is not None:
+                writer.write_window(data, block[0], block[1])
+    return out
+
+
+class ZonalParams:
+    __slots__ = ("source", "band", "shape", "geotransform", "all_touched", "nodata")
+
+    def __init__(self, source: DatasetSource, band: int, shape: Tuple[int, int], geotransform: Tuple[float, ...],
+                 all_touched: bool, nodata: float):
+        """What the workers need to compute the statistics of the zones, picklable for the process backend."""
+        self.source = source
+        self.band = band
+        self.shape = shape
+        self.geotransform = geotransform
+        self.all_touched = all_touched
+        self.nodata = nodata
+
+
+def zonal_stats(raster: RasterData, zones: VectorData, stats: Sequence[str] = ZONAL_STATS, band: int = 1,
+                layer: Union[str, int] = 0, mode: str = ZONAL_POLYGON, all_touched: bool = False,
+                nodata: float = None, workers: int = 1, backend: str = BACKEND_THREAD) -> Dict[int, Dict]:
+    """Statistics of the pixels of a band inside each polygon, without reading the whole raster.
+
+    ZONAL_POLYGON reads the window of each polygon, rasterizes its mask for the window and computes
+    the statistics; good for large polygons, use the process backend to spread them on several cores.
+    ZONAL_BLOCK groups the polygons by the blocks they touch and reads each block once; good for many
+    small polygons. The results are the same.
+
+    The polygons are reprojected to the raster srs if needed. Pixels equal to nodata are ignored.
+
+    :param raster: The raster, read by the workers from its file.
+    :param zones: The polygons.
+    :param stats: The statistics, a subset of ZONAL_STATS (std with ddof=0).
+    :param band: The band.
+    :param layer: Layer name or index of the zones.
+    :param mode: ZONAL_POLYGON or ZONAL_BLOCK.
+    :param all_touched: Use all the pixels touched by the polygon, not only those whose center is inside.
+    :param nodata: Value to ignore, defaults to the nodata of the band.
+    :param workers: Number of workers, 1 runs in the calling thread.
+    :param backend: BACKEND_THREAD or BACKEND_PROCESS.
+    :returns: The statistics of each polygon by FID, {fid: {stat: value}}. Polygons outside the raster have count 0.
+    """
+    unknown = set(stats) - set(ZONAL_STATS)
+    if unknown:
+        raise ValueError("Unknown statistics: {}, must be in {}.".format(sorted(unknown), ZONAL_STATS))
+    if mode not in ZONAL_MODES:
+        raise ValueError("Invalid mode: {}, must be one of {}.".format(mode, ZONAL_MODES))
+    if nodata is None:
+        nodata = raster.gdal_dataset.GetRasterBand(band).GetNoDataValue()
+
+    columns = zones.read_columns(fields=[], geometry=GEOMETRY_WKB, layer=layer)
+    wkbs = split_wkb(columns["geometry"], columns["geometry_offsets"])
+    layer_srs = zones.ogr_datasource.GetLayer(layer).GetSpatialRef()
+    if layer_srs is not None and raster.wkt_srs and not is_same_srs(layer_srs.ExportToWkt(), raster.wkt_srs):
+        wkbs = transform_geometries(wkbs, layer_srs.ExportToWkt(), raster.wkt_srs)
+
+    params = ZonalParams(raster.dataset_source, band, raster.shape, raster.geotransform.as_tuple(), all_touched,
+                         nodata)
+    results = {fid: RunningStats() for fid in columns["fid"].tolist()}
+    zones_list = [(fid, wkb) for fid, wkb in zip(columns["fid"].tolist(), wkbs) if wkb]
+    if mode == ZONAL_POLYGON:
+        task = partial(polygon_stats, params)
+        for (fid, _), zone_stats in run_tasks(task, zones_list, workers=workers, backend=backend, ordered=False):
+            results[fid].merge(zone_stats)
+    else:
+        task = partial(block_zonal_stats, params)
+        items = _group_by_block(raster, params, zones_list)
+        for _, block_results in run_tasks(task, items, workers=workers, backend=backend, ordered=False):
+            for fid, zone_stats in block_results:
+                results[fid].merge(zone_stats)
+    return {fid: {name: value for name, value in zone_stats.as_dict().items() if name in stats}
+            for fid, zone_stats in results.items()}
+
+
+def polygon_stats(params: ZonalParams, item: Tuple[int, bytes]) -> RunningStats:
+    """Statistics of one polygon: reads its window and applies its mask. Task of the ZONAL_POLYGON mode."""
+    geometry = ogr.CreateGeometryFromWkb(item[1])
+    zone_stats = RunningStats()
+    window = _pixel_window(params, geometry)
+    if window is not None:
+        with params.source.dataset() as dataset:
+            data = dataset.GetRasterBand(params.band).ReadAsArray(*window)
+        _update_stats(zone_stats, data, _polygon_mask(params, geometry, window), params.nodata)
+    return zone_stats
+
+
+def block_zonal_stats(params: ZonalParams, item: Tuple[Tuple[int, Tuple], List]) -> List[Tuple[int, RunningStats]]:
+    """Statistics of the polygons that touch a block, the block is read once. Task of the ZONAL_BLOCK mode.
+
+    :param item: ((block index, block), [(fid, wkb, polygon window)]).
+    """
+    block_item, block_zones = item
+    blk_x, blk_y, blk_width, blk_height = block_item[1]
+    data = read_block(params.source, params.band, block_item)
+    block_results = []
+    for fid, wkb, (xoff, yoff, width, height) in block_zones:
+        # The part of the polygon window inside the block.
+        x0, x1 = max(xoff, blk_x), min(xoff + width, blk_x + blk_width)
+        y0, y1 = max(yoff, blk_y), min(yoff + height, blk_y + blk_height)
+        mask = _polygon_mask(params, ogr.CreateGeometryFromWkb(wkb), (x0, y0, x1 - x0, y1 - y0))
+        zone_stats = RunningStats()
+        _update_stats(zone_stats, data[y0 - blk_y:y1 - blk_y, x0 - blk_x:x1 - blk_x], mask, params.nodata)
+        block_results.append((fid, zone_stats))
+    return block_results
+
+
+def _group_by_block(raster: RasterData, params: ZonalParams, zones_list: List[Tuple[int, bytes]]) -> List[Tuple]:
+    """The items of the ZONAL_BLOCK mode: each block with the polygons whose window touches it."""
+    grid = raster.block_grid
+    by_block = {}
+    for fid, wkb in zones_list:
+        window = _pixel_window(params, ogr.CreateGeometryFromWkb(wkb))
+        if window is None:
+            continue
+        xoff, yoff, width, height = window
+        rows = np.arange(yoff // grid.block_height, (yoff + height - 1) // grid.block_height + 1)
+        cols = np.arange(xoff // grid.block_width, (xoff + width - 1) // grid.block_width + 1)
+        for block_index in grid.index_of(rows, cols[:, np.newaxis]).ravel().tolist():
+            by_block.setdefault(block_index, []).append((fid, wkb, window))
+    return [((block_index, raster.block_list[block_index]), by_block[block_index]) for block_index in sorted(by_block)]
+
+
+def _pixel_window(params: ZonalParams, geometry: ogr.Geometry) -> Union[Tuple[int, int, int, int], None]:
+    """The window (xoff, yoff, width, height) of the pixels under the envelope of a geometry, clipped
+    to the image. None if it is outside."""
+    xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+    cols, rows = GeoTransform(params.geotransform).inverse((xmin, xmax, xmin, xmax), (ymin, ymin, ymax, ymax))
+    x0, x1 = max(int(np.floor(cols.min())), 0), min(int(np.ceil(cols.max())), params.shape[1])
+    y0, y1 = max(int(np.floor(rows.min())), 0), min(int(np.ceil(rows.max())), params.shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _polygon_mask(params: ZonalParams, geometry: ogr.Geometry, window: Tuple[int, int, int, int]) -> np.ndarray:
+    """Rasterizes a geometry (in the raster srs) over a window, True inside."""
+    xoff, yoff, width, height = window
+    geotransform = GeoTransform(params.geotransform)
+    x0, y0 = geotransform.forward(xoff, yoff)
+    mem_dataset = gdal.GetDriverByName("MEM").Create("", width, height, 1, gdal.GDT_Byte)
+    mem_dataset.SetGeoTransform((float(x0), geotransform.a, geotransform.b, float(y0), geotransform.d,
+                                 geotransform.e))
+    datasource = ogr.GetDriverByName("Memory").CreateDataSource("")
+    zone_layer = datasource.CreateLayer("zone", geom_type=geometry.GetGeometryType())
+    feature = ogr.Feature(zone_layer.GetLayerDefn())
+    feature.SetGeometry(geometry)
+    zone_layer.CreateFeature(feature)
+    gdal.RasterizeLayer(mem_dataset, [1], zone_layer, burn_values=[1],
+                        options=["ALL_TOUCHED=TRUE"] if params.all_touched else [])
+    return mem_dataset.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def _update_stats(zone_stats: RunningStats, data: np.ndarray, mask: np.ndarray, nodata: float):
+    values = data[mask]
+    if nodata is not None:
+        values = values[~np.isnan(values)] if np.isnan(nodata) else values[values != nodata]
+    zone_stats.update(values)
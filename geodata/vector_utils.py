@@ -1,40 +1,189 @@
 # Pablo Carreira - 22/06/17
 
 import json
+import struct
+from functools import partial
+from typing import Iterable, List, Sequence, Tuple, Union
 
+import numpy as np
 from osgeo import ogr, osr
 
+from geodata.block_engine import BACKEND_THREAD, run_tasks
+from geodata.srs_utils import get_osr_transform
+
 ogr.UseExceptions()
 
 
+#: WKB geometry type codes (ISO), + 1000 for the 3D (Z) variants.
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+_WKB_HEADER = np.dtype([("order", "u1"), ("type", "<u4")])
+_WKB_HEADER_COUNT = np.dtype([("order", "u1"), ("type", "<u4"), ("count", "<u4")])
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+#: Points per TransformPoints call (and per task when running in parallel).
+DEFAULT_TRANSFORM_CHUNK = 100000
+
+
 def create_ogr_linestring_from_list(geom: list) -> ogr.Geometry:
-    """Creates a geometry from a Json geometry object"""
-    return ogr.CreateGeometryFromJson(json.dumps({"type": 'LineString', 'coordinates': geom}))
+    """Creates a linestring from a list of coordinates (x, y) or (x, y, z)."""
+    coords = np.asarray(geom, dtype=np.float64)
+    buffer, _ = lines_to_wkb(coords, [0, len(coords)])
+    return ogr.CreateGeometryFromWkb(buffer.tobytes())
 
 
 def create_ogr_geom(geom) -> ogr.Geometry:
-    """Creates a ogr geometry from a wkt ou wkb.
+    """Creates a ogr geometry from a wkb (bytes or hex string), wkt or GeoJSON (string or dict).
 
-    :param geom:
-    :return:
+    The format is chosen by the type and the first characters, without trying each one.
     """
     if isinstance(geom, ogr.Geometry):
         return geom
-
-    # Converte os tipos para diferentes situações (python 2.7).
-    # if isinstance(geom, str):
-    #     geom = str(geom)
-    # elif isinstance(geom, unicode):
-    #     geom = str(geom)
-    try:
-        ogr_geom = ogr.CreateGeometryFromWkb(geom)
-    except RuntimeError:
-        ogr_geom = ogr.CreateGeometryFromWkt(geom)
-    if not ogr_geom:
-        ogr_geom = ogr.CreateGeometryFromWkt(geom)
+    if isinstance(geom, (bytes, bytearray, memoryview)):
+        ogr_geom = ogr.CreateGeometryFromWkb(bytes(geom))
+    elif isinstance(geom, dict):
+        ogr_geom = ogr.CreateGeometryFromJson(json.dumps(geom))
+    elif isinstance(geom, str):
+        text = geom.strip()
+        if text.startswith("{"):
+            ogr_geom = ogr.CreateGeometryFromJson(text)
+        elif text[:2] in ("00", "01") and _HEX_DIGITS.issuperset(text):
+            ogr_geom = ogr.CreateGeometryFromWkb(bytes.fromhex(text))
+        else:
+            ogr_geom = ogr.CreateGeometryFromWkt(text)
+    else:
+        raise TypeError("Tipo de geometria não suportado: {}.".format(type(geom)))
+    if ogr_geom is None:
+        raise ValueError("Invalid geometry: {!r}.".format(str(geom)[:100]))
     return ogr_geom
 
 
+def split_wkb(buffer: np.ndarray, offsets: np.ndarray) -> List[bytes]:
+    """The WKB of each geometry of a buffer built by the *_to_wkb functions (or read_columns)."""
+    data = buffer.tobytes()
+    offsets = np.asarray(offsets).tolist()
+    return [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def points_to_wkb(coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """WKB points from an array (n, 2) or (n, 3).
+
+    :returns: The buffer (uint8) with all the geometries and the offsets (n + 1), geometry i is
+        buffer[offsets[i]:offsets[i + 1]].
+    """
+    coords, dims = _check_coords(coords)
+    size = 5 + 8 * dims
+    offsets = np.arange(len(coords) + 1, dtype=np.int64) * size
+    buffer = np.empty(offsets[-1], dtype=np.uint8)
+    starts = offsets[:-1]
+    _put(buffer, starts, _headers(_WKB_HEADER, len(coords), _wkb_type(WKB_POINT, dims)))
+    _put(buffer, starts + 5, _vertex_bytes(coords))
+    return buffer, offsets
+
+
+def lines_to_wkb(coords: np.ndarray, offsets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """WKB linestrings from the vertices of all lines (m, 2) or (m, 3) and the offsets (n + 1) of the
+    lines, line i has the vertices coords[offsets[i]:offsets[i + 1]].
+
+    :returns: The buffer and the WKB offsets, see points_to_wkb.
+    """
+    return _counted_to_wkb(WKB_LINESTRING, coords, offsets)
+
+
+def multipoints_to_wkb(coords: np.ndarray, offsets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """WKB multipoints from the points (m, 2) or (m, 3) and the offsets (n + 1) of each geometry.
+
+    :returns: The buffer and the WKB offsets, see points_to_wkb.
+    """
+    return _counted_to_wkb(WKB_MULTIPOINT, coords, offsets)
+
+
+def polygons_to_wkb(coords: np.ndarray, ring_offsets: Sequence[int],
+                    polygon_offsets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """WKB polygons from the vertices of all rings (m, 2) or (m, 3).
+
+    Ring r has the vertices coords[ring_offsets[r]:ring_offsets[r + 1]] and polygon i the rings
+    polygon_offsets[i] to polygon_offsets[i + 1] - 1, the exterior ring first. The rings must be closed.
+
+    :returns: The buffer and the WKB offsets, see points_to_wkb.
+    """
+    coords, dims = _check_coords(coords)
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+    vertex_size = 8 * dims
+    ring_lengths = np.diff(ring_offsets)
+    ring_sizes = 4 + vertex_size * ring_lengths
+    ring_ends = np.concatenate(([0], np.cumsum(ring_sizes)))
+    n_rings = np.diff(polygon_offsets)
+    # Polygon size: header, count of rings, the rings.
+    sizes = 9 + ring_ends[polygon_offsets[1:]] - ring_ends[polygon_offsets[:-1]]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    buffer = np.empty(offsets[-1], dtype=np.uint8)
+    _put(buffer, offsets[:-1], _headers(_WKB_HEADER_COUNT, len(sizes), _wkb_type(WKB_POLYGON, dims), n_rings))
+
+    ring_polygon = np.repeat(np.arange(len(sizes)), n_rings)
+    ring_starts = offsets[:-1][ring_polygon] + 9 + ring_ends[:-1] - ring_ends[polygon_offsets[:-1]][ring_polygon]
+    _put(buffer, ring_starts, ring_lengths.astype("<u4").view(np.uint8).reshape((-1, 4)))
+    vertex_ring = np.repeat(np.arange(len(ring_lengths)), ring_lengths)
+    vertex_starts = ring_starts[vertex_ring] + 4 + vertex_size * (np.arange(len(coords)) - ring_offsets[vertex_ring])
+    _put(buffer, vertex_starts, _vertex_bytes(coords))
+    return buffer, offsets
+
+
+def _counted_to_wkb(geom_type: int, coords: np.ndarray, offsets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Linestrings and multipoints: a header with the count followed by the vertices or points."""
+    coords, dims = _check_coords(coords)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    # The points of a multipoint are complete geometries, with their own header.
+    vertex_size = 8 * dims + (5 if geom_type == WKB_MULTIPOINT else 0)
+    wkb_offsets = np.concatenate(([0], np.cumsum(9 + vertex_size * counts)))
+    buffer = np.empty(wkb_offsets[-1], dtype=np.uint8)
+    _put(buffer, wkb_offsets[:-1], _headers(_WKB_HEADER_COUNT, len(counts), _wkb_type(geom_type, dims), counts))
+    vertex_geom = np.repeat(np.arange(len(counts)), counts)
+    vertex_starts = wkb_offsets[:-1][vertex_geom] + 9 + vertex_size * (np.arange(len(coords)) - offsets[vertex_geom])
+    if geom_type == WKB_MULTIPOINT:
+        _put(buffer, vertex_starts, _headers(_WKB_HEADER, len(coords), _wkb_type(WKB_POINT, dims)))
+        vertex_starts = vertex_starts + 5
+    _put(buffer, vertex_starts, _vertex_bytes(coords))
+    return buffer, wkb_offsets
+
+
+def _check_coords(coords: np.ndarray) -> Tuple[np.ndarray, int]:
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.size == 0:
+        coords = coords.reshape((0, 2))
+    if coords.ndim != 2 or coords.shape[1] not in (2, 3):
+        raise ValueError("coords must have the shape (n, 2) or (n, 3), got {}.".format(coords.shape))
+    return coords, coords.shape[1]
+
+
+def _wkb_type(geom_type: int, dims: int) -> int:
+    return geom_type + 1000 if dims == 3 else geom_type
+
+
+def _headers(dtype: np.dtype, n: int, geom_type: int, counts: np.ndarray = None) -> np.ndarray:
+    """n WKB headers (little endian), as rows of bytes."""
+    headers = np.empty(n, dtype=dtype)
+    headers["order"] = 1
+    headers["type"] = geom_type
+    if counts is not None:
+        headers["count"] = counts
+    return headers.view(np.uint8).reshape((n, dtype.itemsize))
+
+
+def _vertex_bytes(coords: np.ndarray) -> np.ndarray:
+    """The coordinates as little endian doubles, one row of bytes per vertex."""
+    return np.ascontiguousarray(coords, dtype="<f8").view(np.uint8).reshape((len(coords), 8 * coords.shape[1]))
+
+
+def _put(buffer: np.ndarray, starts: np.ndarray, rows: np.ndarray):
+    """Copies each row of bytes to the buffer at its start position."""
+    if len(rows):
+        buffer[starts[:, np.newaxis] + np.arange(rows.shape[1])] = rows
+
+
 def create_osr_transform(src_epsg: int, dst_epsg: int):
     """Creates an OSR transform from epsg codes."""
     src_srs = osr.SpatialReference()
@@ -43,3 +192,136 @@ def create_osr_transform(src_epsg: int, dst_epsg: int):
     dst_srs.ImportFromEPSG(dst_epsg)
     return osr.CoordinateTransformation(src_srs, dst_srs)
 
+
+def transform_coords(xs, ys, src_srs: Union[osr.SpatialReference, int, str],
+                     dst_srs: Union[osr.SpatialReference, int, str], zs=None,
+                     chunk_size: int = DEFAULT_TRANSFORM_CHUNK, workers: int = 1) -> Tuple[np.ndarray, ...]:
+    """Reprojects arrays of coordinates, with one TransformPoints call per chunk.
+
+    The transforms are cached (see srs_utils.get_osr_transform) and use the traditional GIS axis
+    order (x = longitude) with gdal 3, like create_osr_srs.
+
+    :param xs: X coordinates.
+    :param ys: Y coordinates.
+    :param src_srs: Source srs, EPSG code, WKT or osr.SpatialReference.
+    :param dst_srs: Destination srs.
+    :param zs: Optional Z coordinates.
+    :param chunk_size: Points per TransformPoints call.
+    :param workers: Number of threads transforming chunks in parallel.
+    :returns: The new xs, ys (and zs if given).
+    """
+    columns = (xs, ys) if zs is None else (xs, ys, zs)
+    points = np.column_stack([np.asarray(column, dtype=np.float64).ravel() for column in columns])
+    chunks = [(start, min(start + chunk_size, len(points))) for start in range(0, len(points), chunk_size)]
+    task = partial(_transform_chunk, points, src_srs, dst_srs)
+    transformed = np.empty_like(points)
+    for (start, stop), result in run_tasks(task, chunks, workers, BACKEND_THREAD):
+        transformed[start:stop] = result
+    return tuple(transformed[:, i] for i in range(points.shape[1]))
+
+
+def _transform_chunk(points: np.ndarray, src_srs, dst_srs, item: Tuple[int, int]) -> np.ndarray:
+    start, stop = item
+    transform = get_osr_transform(src_srs, dst_srs)
+    result = np.asarray(transform.TransformPoints(points[start:stop].tolist()), dtype=np.float64)
+    return result[:, :points.shape[1]]
+
+
+def transform_geometries(wkbs: Iterable[bytes], src_srs: Union[osr.SpatialReference, int, str],
+                         dst_srs: Union[osr.SpatialReference, int, str], chunk_size: int = DEFAULT_TRANSFORM_CHUNK,
+                         workers: int = 1) -> List[bytes]:
+    """Reprojects WKB geometries, the vertices of many geometries go in a single TransformPoints call.
+
+    The coordinates are read and written in place in the WKB (ISO or extended, Z and M), without
+    creating ogr geometries. The axis order is the same of transform_coords.
+
+    :param wkbs: The geometries in WKB.
+    :param src_srs: Source srs.
+    :param dst_srs: Destination srs.
+    :param chunk_size: Approximate number of vertices per TransformPoints call.
+    :param workers: Number of threads transforming chunks in parallel.
+    :returns: The transformed WKBs.
+    """
+    buffers = [bytearray(wkb) for wkb in wkbs]
+    runs = [_wkb_coordinate_runs(buffer) for buffer in buffers]
+    # Groups whole geometries in chunks of about chunk_size vertices.
+    chunks, start, n_vertices = [], 0, 0
+    for i, geometry_runs in enumerate(runs):
+        n_vertices += sum(run[1] for run in geometry_runs)
+        if n_vertices >= chunk_size:
+            chunks.append((start, i + 1))
+            start, n_vertices = i + 1, 0
+    if start < len(buffers):
+        chunks.append((start, len(buffers)))
+    task = partial(_transform_wkb_chunk, buffers, runs, src_srs, dst_srs)
+    for _ in run_tasks(task, chunks, workers, BACKEND_THREAD):
+        pass
+    return [bytes(buffer) for buffer in buffers]
+
+
+def _transform_wkb_chunk(buffers: List[bytearray], runs: List[List[Tuple]], src_srs, dst_srs, item: Tuple[int, int]):
+    """Transforms the coordinates of the geometries start to stop - 1 in place."""
+    start, stop = item
+    views = []
+    for buffer, geometry_runs in zip(buffers[start:stop], runs[start:stop]):
+        for offset, count, dims, has_z, dtype in geometry_runs:
+            views.append((np.frombuffer(buffer, dtype, count * dims, offset).reshape((count, dims)), has_z))
+    if not views:
+        return
+    points = np.zeros((sum(len(view) for view, _ in views), 3), dtype=np.float64)
+    position = 0
+    for view, has_z in views:
+        points[position:position + len(view), :3 if has_z else 2] = view[:, :3 if has_z else 2]
+        position += len(view)
+    transform = get_osr_transform(src_srs, dst_srs)
+    result = np.asarray(transform.TransformPoints(points.tolist()), dtype=np.float64)
+    position = 0
+    for view, has_z in views:
+        view[:, :3 if has_z else 2] = result[position:position + len(view), :3 if has_z else 2]
+        position += len(view)
+
+
+def _wkb_coordinate_runs(wkb: bytearray) -> List[Tuple]:
+    """Finds the runs of coordinates of a WKB: (offset, number of vertices, dims, has z, dtype).
+    Only the structure is read with struct, the coordinates are left to numpy."""
+    runs = []
+    _read_wkb_runs(wkb, 0, runs)
+    return runs
+
+
+def _read_wkb_runs(wkb: bytearray, position: int, runs: List[Tuple]) -> int:
+    """Adds the coordinate runs of the geometry at position to runs, returns the end of the geometry."""
+    endian = "<" if wkb[position] == 1 else ">"
+    geom_type = struct.unpack_from(endian + "I", wkb, position + 1)[0]
+    position += 5
+    if geom_type & 0xE0000000:
+        # Extended WKB: flags for Z, M and SRID.
+        has_z, has_m = bool(geom_type & 0x80000000), bool(geom_type & 0x40000000)
+        if geom_type & 0x20000000:
+            position += 4
+        base_type = geom_type & 0xFFFF
+    else:
+        has_z, has_m = geom_type // 1000 in (1, 3), geom_type // 1000 in (2, 3)
+        base_type = geom_type % 1000
+    dims = 2 + has_z + has_m
+    dtype = np.dtype(endian + "f8")
+    if base_type == WKB_POINT:
+        runs.append((position, 1, dims, has_z, dtype))
+        return position + 8 * dims
+    count = struct.unpack_from(endian + "I", wkb, position)[0]
+    position += 4
+    if base_type == WKB_LINESTRING:
+        runs.append((position, count, dims, has_z, dtype))
+        return position + 8 * dims * count
+    if base_type == WKB_POLYGON:
+        for _ in range(count):
+            n_vertices = struct.unpack_from(endian + "I", wkb, position)[0]
+            runs.append((position + 4, n_vertices, dims, has_z, dtype))
+            position += 4 + 8 * dims * n_vertices
+        return position
+    if base_type in (4, 5, 6, 7):
+        # Multi geometries and collections contain complete geometries.
+        for _ in range(count):
+            position = _read_wkb_runs(wkb, position, runs)
+        return position
+    raise ValueError("WKB geometry type not supported: {}.".format(geom_type))
@@ -0,0 +1,123 @@
+# Pablo Carreira - 18/10/26
+import time
+from typing import Dict, Iterable, Tuple, Union
+
+from osgeo import ogr
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class FeatureWriter:
+    def __init__(self, vector_data: "VectorData", layer: Union[str, int] = 0, batch_size: int = DEFAULT_BATCH_SIZE):
+        """A bulk insertion session, the features are created in transactions of batch_size features.
+
+        The layer, its definition and the field indices are looked up once. Use VectorData.bulk_writer():
+
+            with vector.bulk_writer() as writer:
+                writer.write_many((geometry, {"ID": i}) for i, geometry in enumerate(geometries))
+            print(writer.features_per_second)
+
+        If an error happens inside the with block the current batch is rolled back.
+
+        :param vector_data: The VectorData to write to, opened with update=True.
+        :param layer: Layer name or index.
+        :param batch_size: Number of features per transaction.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        self.vector_data = vector_data
+        self.layer = vector_data.ogr_datasource.GetLayer(layer)
+        if self.layer is None:
+            raise ValueError("Layer not found: {}.".format(layer))
+        self.layer_defn = self.layer.GetLayerDefn()
+        self.batch_size = batch_size
+        self._field_indices = {}
+        #: Statistics.
+        self.n_features = 0
+        self.n_commits = 0
+        self.pending = 0
+        self.closed = False
+        self._start_time = time.perf_counter()
+        self._end_time = None
+        self._in_transaction = False
+
+    def __enter__(self) -> "FeatureWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self._in_transaction:
+            self.layer.RollbackTransaction()
+            self.n_features -= self.pending
+            self.pending = 0
+            self._in_transaction = False
+        self.close()
+
+    def _field_index(self, name: str) -> int:
+        index = self._field_indices.get(name)
+        if index is None:
+            index = self.layer_defn.GetFieldIndex(name)
+            if index < 0:
+                raise ValueError("Field not found: {}.".format(name))
+            self._field_indices[name] = index
+        return index
+
+    def write(self, geometry: Union[ogr.Geometry, bytes, None], properties: Dict = None):
+        """Adds a feature.
+
+        :param geometry: An ogr.Geometry (copied), WKB bytes or None.
+        :param properties: Values of the fields by name.
+        """
+        if self.closed:
+            raise RuntimeError("Writer already closed.")
+        if not self._in_transaction:
+            self.layer.StartTransaction()
+            self._in_transaction = True
+        feature = ogr.Feature(self.layer_defn)
+        if isinstance(geometry, (bytes, bytearray, memoryview)):
+            # The geometry is still built from the WKB, but handed to the feature without the copy of SetGeometry.
+            feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(bytes(geometry)))
+        elif geometry is not None:
+            feature.SetGeometry(geometry)
+        if properties:
+            for name, value in properties.items():
+                feature.SetField(self._field_index(name), value)
+        if self.layer.CreateFeature(feature) != 0:
+            raise IOError("Error creating the feature {}.".format(self.n_features))
+        self.n_features += 1
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def write_many(self, features: Iterable[Tuple[Union[ogr.Geometry, bytes, None], Dict]]):
+        """Adds the (geometry, properties) pairs of an iterable."""
+        for geometry, properties in features:
+            self.write(geometry, properties)
+
+    def commit(self):
+        """Commits the current batch."""
+        if self._in_transaction:
+            self.layer.CommitTransaction()
+            self._in_transaction = False
+            self.n_commits += 1
+            self.pending = 0
+
+    def close(self):
+        """Commits the remaining features and ends the session."""
+        if self.closed:
+            return
+        self.commit()
+        self.layer.SyncToDisk()
+        self.closed = True
+        self._end_time = time.perf_counter()
+        self.vector_data.features_changed(self.layer.GetName())
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the writer was created, until it was closed."""
+        end_time = self._end_time if self._end_time is not None else time.perf_counter()
+        return end_time - self._start_time
+
+    @property
+    def features_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.n_features / elapsed if elapsed > 0 else 0.0
@@ -1,10 +1,20 @@
 # Pablo Carreira - 21/03/17
 import os
-from typing import Union, Iterator
+from typing import Dict, Union, Iterator, List, Sequence, Tuple
 
+import numpy as np
 from osgeo import ogr, osr
 
-from geodata.geo_objects import BBox
+from geodata.geo_objects import BBox, BBoxArray
+from geodata.vector_columns import DEFAULT_COLUMNS_BATCH_SIZE, GEOMETRY_WKB, read_layer_columns
+from geodata.spatial_index import DEFAULT_NODE_CAPACITY, STRTree
+from geodata.srs_utils import is_same_srs
+from geodata.vector_writer import DEFAULT_BATCH_SIZE, FeatureWriter
+
+#: Suffix of the spatial index files saved next to the data, after the layer name.
+SPATIAL_INDEX_SUFFIX = ".stridx.npz"
+#: Points per edge used to reproject the query boxes to the layer srs.
+QUERY_DENSIFY_POINTS = 21
 
 
 class VectorData:
@@ -20,6 +30,7 @@ class VectorData:
         self.ogr_format = None
         self.update = update
         self.srs = None
+        self._spatial_indexes = {}
 
         if not os.path.isfile(src_file):
             raise NotImplementedError(f"Not a file: {src_file}. \n Use VectorData.create() to create a new file.")
@@ -76,6 +87,138 @@ class VectorData:
         srs = layer.GetSpatialRef().ExportToWkt()
         return BBox.create_from_ogr_extent(extent, srs)
 
+    def _get_ogr_layer(self, layer: Union[str, int] = 0) -> ogr.Layer:
+        ogr_layer = self.ogr_datasource.GetLayer(layer)
+        if ogr_layer is None:
+            raise ValueError("Layer not found: {}.".format(layer))
+        return ogr_layer
+
+    def _open_layer(self, ogr_layer: ogr.Layer) -> Tuple[ogr.DataSource, ogr.Layer]:
+        """Opens the file again read only and returns the same layer, without the filters and ignored
+        fields set on ogr_layer. The layer is valid while the datasource is referenced."""
+        if self.update:
+            ogr_layer.SyncToDisk()
+        ogr_datasource = ogr.Open(self.src_file, 0)
+        if not ogr_datasource:
+            raise IOError("Can't open file: {}".format(self.src_file))
+        return ogr_datasource, ogr_datasource.GetLayer(ogr_layer.GetName())
+
+    def _spatial_index_file(self, layer_name: str) -> str:
+        return "{}.{}{}".format(self.src_file, layer_name, SPATIAL_INDEX_SUFFIX)
+
+    def build_spatial_index(self, layer: Union[str, int] = 0, node_capacity: int = DEFAULT_NODE_CAPACITY,
+                            persist: bool = False) -> STRTree:
+        """Builds a STR packed R-tree over the envelopes of the features of a layer.
+
+        Features without geometry are left out, the filters set on the layer are not applied. The index
+        is kept for the next queries.
+
+        :param layer: Layer name or index.
+        :param node_capacity: Number of children per node of the tree.
+        :param persist: Saves the index next to the file, it is loaded by get_spatial_index while the
+            data file is not modified.
+        """
+        ogr_layer = self._get_ogr_layer(layer)
+        # Its own handle: the filters set on the layer would leave features out of the index.
+        ogr_datasource, index_layer = self._open_layer(ogr_layer)
+        layer_defn = index_layer.GetLayerDefn()
+        # Only the geometries are needed.
+        index_layer.SetIgnoredFields([layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())])
+        fids, envelopes = [], []
+        for feature in index_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None or geometry.IsEmpty():
+                continue
+            xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+            fids.append(feature.GetFID())
+            envelopes.append((xmin, ymin, xmax, ymax))
+        index = STRTree(np.array(envelopes, dtype=np.float64).reshape((-1, 4)), fids, node_capacity)
+        if persist:
+            index.save(self._spatial_index_file(ogr_layer.GetName()))
+        self._spatial_indexes[ogr_layer.GetName()] = index
+        return index
+
+    def get_spatial_index(self, layer: Union[str, int] = 0) -> STRTree:
+        """The spatial index of a layer: the one already built, the one saved next to the file if it is
+        up to date or a new one."""
+        ogr_layer = self._get_ogr_layer(layer)
+        index = self._spatial_indexes.get(ogr_layer.GetName())
+        if index is None:
+            index_file = self._spatial_index_file(ogr_layer.GetName())
+            if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(self.src_file):
+                index = self._spatial_indexes[ogr_layer.GetName()] = STRTree.load(index_file)
+            else:
+                index = self.build_spatial_index(layer)
+        return index
+
+    def _to_layer_srs(self, bboxes: Union[BBox, BBoxArray], ogr_layer: ogr.Layer) -> Union[BBox, BBoxArray]:
+        """Reprojects the query boxes to the srs of the layer when both are known and differ."""
+        layer_srs = ogr_layer.GetSpatialRef()
+        if bboxes.wkt_srs is None or layer_srs is None:
+            return bboxes
+        layer_wkt = layer_srs.ExportToWkt()
+        if is_same_srs(bboxes.wkt_srs, layer_wkt):
+            return bboxes
+        return bboxes.transform_srs(layer_wkt, densify_points=QUERY_DENSIFY_POINTS)
+
+    def query_bbox(self, bbox: BBox, layer: Union[str, int] = 0) -> np.ndarray:
+        """FIDs of the features whose envelope intersects bbox, using the spatial index.
+
+        The result can drive GetFeature lookups (see get_features_in_bbox). The envelope test is the
+        same one of SetSpatialFilter, exact tests are left to the caller.
+
+        :param bbox: The query box, reprojected to the layer srs if needed.
+        :param layer: Layer name or index.
+        """
+        ogr_layer = self._get_ogr_layer(layer)
+        return self.get_spatial_index(layer).query(self._to_layer_srs(bbox, ogr_layer))
+
+    def query_many(self, bboxes: BBoxArray, layer: Union[str, int] = 0) -> List[np.ndarray]:
+        """FIDs of the features intersecting each box, see query_bbox."""
+        ogr_layer = self._get_ogr_layer(layer)
+        return self.get_spatial_index(layer).query_many(self._to_layer_srs(bboxes, ogr_layer))
+
+    def get_features_in_bbox(self, bbox: BBox, layer: Union[str, int] = 0) -> Iterator[ogr.Feature]:
+        """The features whose envelope intersects bbox, read directly by FID."""
+        ogr_layer = self._get_ogr_layer(layer)
+        for fid in self.query_bbox(bbox, layer).tolist():
+            yield ogr_layer.GetFeature(fid)
+
+    def read_columns(self, fields: Sequence[str] = None, geometry: str = GEOMETRY_WKB, layer: Union[str, int] = 0,
+                     bbox: BBox = None, where: str = None,
+                     batch_size: int = DEFAULT_COLUMNS_BATCH_SIZE) -> Dict[str, np.ndarray]:
+        """Reads the features as a dict of numpy arrays, one per field plus "fid" and the geometry.
+
+        Uses the Arrow stream interface of gdal (>= 3.6) when available, otherwise a single pass over
+        the features. The filters are applied by OGR and the fields not requested are not read.
+
+        Integer fields with nulls become float64 with NaN, dates and times datetime64 (NaT for nulls, UTC
+        when the time zone is known, times on 1970-01-01) and strings object arrays.
+
+        :param fields: Names of the fields, defaults to all. An empty list reads only the fids and geometries.
+        :param geometry: "wkb" gives the buffer "geometry" and "geometry_offsets" (WKB i is
+            geometry[offsets[i]:offsets[i + 1]]), "bounds" an array (n, 4) and "coords" the vertices (m, 2)
+            with "ring_offsets", "part_offsets" and "geometry_offsets" (see vector_columns._geometry_columns).
+            None skips the geometries.
+        :param layer: Layer name or index.
+        :param bbox: Spatial filter, reprojected to the layer srs if needed.
+        :param where: Attribute filter (OGR SQL where clause).
+        :param batch_size: Features per Arrow batch.
+        """
+        ogr_layer = self._get_ogr_layer(layer)
+        if bbox is None and where is None:
+            # The filters already set on the layer apply.
+            return read_layer_columns(ogr_layer, fields, geometry, batch_size)
+
+        # OGR can't give back the attribute filter of a layer to restore it afterwards, so the filtered
+        # reads use their own handle and the filters of the layer of this VectorData are kept.
+        ogr_datasource, filtered_layer = self._open_layer(ogr_layer)
+        if bbox is not None:
+            filtered_layer.SetSpatialFilterRect(*self._to_layer_srs(bbox, ogr_layer).as_tuple())
+        if where is not None and filtered_layer.SetAttributeFilter(where) != 0:
+            raise ValueError("Invalid attribute filter: {}.".format(where))
+        return read_layer_columns(filtered_layer, fields, geometry, batch_size)
+
     def open_file(self) -> None:
         """Opens the vector file."""
         ogr_datasource = ogr.Open(self.src_file, 1 if self.update else 0)
@@ -104,4 +247,25 @@ class VectorData:
         feature.SetGeometry(geometry)
         for k, v in properties.items():
             feature.SetField(k, v)
-        layer.CreateFeature(feature)
\ No newline at end of file
+        layer.CreateFeature(feature)
+        self.features_changed(layer.GetName())
+
+    def bulk_writer(self, batch_size: int = DEFAULT_BATCH_SIZE, layer: Union[str, int] = 0) -> FeatureWriter:
+        """Starts a bulk insertion session, the features are written in transactions of batch_size.
+        Much faster than add_feature_to_layer for many features, see FeatureWriter.
+
+        :param batch_size: Number of features per transaction.
+        :param layer: Layer name or index.
+        """
+        return FeatureWriter(self, layer, batch_size)
+
+    def features_changed(self, layer_name: str):
+        """Discards the spatial index of a layer after its features were changed, the saved one too.
+
+        The file modification time is not enough to detect a stale index: some formats (e.g. GPKG in
+        WAL mode) don't write to the data file right away.
+        """
+        self._spatial_indexes.pop(layer_name, None)
+        index_file = self._spatial_index_file(layer_name)
+        if os.path.isfile(index_file):
+            os.remove(index_file)
\ No newline at end of file